@@ -0,0 +1,198 @@
+import numpy as np
+
+'''
+Tempo and beat grid of a song from a downsampled onset envelope, with numpy only
+
+The song is mixed down to mono and decimated to about 11 kHz, its spectral flux (how much the log magnitude spectrum
+grows from one frame to the next) peaks on every note and drum hit. The tempo is the strongest period of the envelope
+autocorrelation, refined on the whole song with the envelope component at the beat frequency, whose phase also places
+the beats. Downbeats are the beats of the bar position with the loudest hits, the music starts on the first
+downbeat of a bar with audible beats, even a quiet one, and ends on the downbeat closing the last one
+'''
+
+DECIMATION = 4  # samples averaged together before the analysis, 44.1 kHz => 11 kHz
+FRAME = 512  # decimated samples per spectrum
+HOP = 128  # decimated samples between spectra, about 86 envelope values per second at 44.1 kHz
+ONSET_POSITION = FRAME * 7 / 8  # onsets raise the log spectrum as soon as they enter a frame, measured on click tracks
+MIN_BPM, MAX_BPM = 60, 200
+PRIOR_BPM = 120  # tempo favoured between octave candidates (a beat at 60 or 240 bpm is also one at 120)
+REFINE = 0.02  # relative range searched around the autocorrelation tempo
+PEAK_STEPS = 4  # tempo candidates per width of the beat peak, which narrows as songs get longer
+BEATS_PER_BAR = 4
+ACCENT_FRAMES = 4  # frames after a beat in which its loudness is measured
+ACTIVE_RATIO = 0.05  # bars whose beats stand out less than this fraction of the clearest bar are silence or noise
+EXCERPTS = 3  # windows analysed by fast_tempo
+EXCERPT_SECONDS = 20
+
+
+def decimated(blocks, scale: float = 1, factor: int = DECIMATION):
+    """
+    Yields the samples (np.ndarray of float32) of blocks [(offset, mono samples), ...] (see
+    generate_timestamps.mono_blocks) averaged by groups of factor and divided by scale, block by block
+    """
+
+    carry = np.zeros(0)
+    for _, block in blocks:
+        block = np.concatenate([carry, block]) if len(carry) else block
+        usable = len(block) // factor * factor
+        yield (block[:usable].reshape(-1, factor).mean(axis=1) / scale).astype(np.float32)
+        carry = block[usable:]
+
+
+def onset_envelope(blocks, sr: int, scale: float = 1):
+    """
+    Returns the onset envelope (flux, rms, fps) of a song from blocks of mono samples (see generate_timestamps.mono_blocks)
+    at sample rate sr, scale being the value of a full scale sample. Only a block is decoded at a time
+
+    flux (np.ndarray): spectral flux of every frame, peaking on onsets
+    rms (np.ndarray): loudness of every frame
+    fps (float): frames per second, see frame_time for the time of a frame
+    """
+
+    window = np.hanning(FRAME).astype(np.float32)
+    flux, rms, previous, pending = [], [], None, np.zeros(0, dtype=np.float32)
+    for samples in decimated(blocks, scale):
+        pending = np.concatenate([pending, samples])  # frames overlap: the end of a block starts the next frames
+        if len(pending) < FRAME:
+            continue
+        frames = np.lib.stride_tricks.sliding_window_view(pending, FRAME)[::HOP]
+        spectrum = np.log1p(100 * np.abs(np.fft.rfft(frames * window, axis=1)))
+        rows = spectrum if previous is None else np.vstack([previous, spectrum])
+        increase = np.maximum(np.diff(rows, axis=0), 0).sum(axis=1)
+        flux.append(increase if previous is not None else np.concatenate([[0], increase]))
+        rms.append(np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1)))
+        previous, pending = spectrum[-1:], pending[len(frames) * HOP:]
+    fps = sr / DECIMATION / HOP
+    return (np.concatenate(flux), np.concatenate(rms), fps) if flux else (np.zeros(0), np.zeros(0), fps)
+
+
+def frame_time(frame, fps: float):
+    """
+    returns the time in seconds (float or np.ndarray) of the onsets peaking at an envelope frame (float or np.ndarray)
+    """
+
+    return (frame + ONSET_POSITION / HOP) / fps
+
+
+def autocorrelation_tempo(envelopes: list, fps: float):
+    """
+    Returns the bpm (float) whose period is the strongest in the autocorrelation of one or several onset envelopes
+    (np.ndarray), octave candidates weighted towards PRIOR_BPM
+    """
+
+    lags = np.arange(max(1, int(60 * fps / MAX_BPM)), int(60 * fps / MIN_BPM) + 2)
+    score = np.zeros(len(lags))
+    for envelope in envelopes:
+        n = len(envelope)
+        if n <= lags[-1]:
+            continue
+        envelope = envelope - envelope.mean()
+        acf = np.fft.irfft(np.abs(np.fft.rfft(envelope, 2 * n)) ** 2)[:n] / np.arange(n, 0, -1)  # unbiased
+        score += acf[lags] / acf[0] if acf[0] else 0
+    score *= np.exp(-0.5 * np.log2(60 * fps / lags / PRIOR_BPM) ** 2)
+
+    best = int(np.clip(np.argmax(score), 1, len(lags) - 2))
+    before, peak, after = score[best - 1:best + 2]
+    shift = 0.5 * (before - after) / (before - 2 * peak + after) if before - 2 * peak + after else 0
+    return 60 * fps / (lags[best] + np.clip(shift, -0.5, 0.5))  # parabolic interpolation between lags
+
+
+def beat_component(envelope: np.ndarray, period: float):
+    """
+    Returns the strength (float) and phase in frames (float, from 0 to period) of the periodicity of an onset envelope
+    at period frames
+    """
+
+    component = np.dot(envelope, np.exp(-2j * np.pi * np.arange(len(envelope)) / period))
+    return abs(component), (-np.angle(component) / (2 * np.pi) * period) % period
+
+
+def refine_tempo(envelopes: list, fps: float, bpm: float):
+    """
+    Returns the bpm (float) within REFINE of bpm at which the onset envelopes have the strongest beat component
+    """
+
+    period = 60 * fps / bpm
+    steps = max(int(2 * REFINE * PEAK_STEPS * max(len(envelope) for envelope in envelopes) / period), 8)
+    candidates = bpm * (1 + np.linspace(-REFINE, REFINE, 2 * (steps // 2) + 1))
+    strengths = np.array([sum(beat_component(envelope, 60 * fps / candidate)[0] for envelope in envelopes)
+                          for candidate in candidates])
+    best = int(np.clip(np.argmax(strengths), 1, len(candidates) - 2))
+    before, peak, after = strengths[best - 1:best + 2]
+    shift = 0.5 * (before - after) / (before - 2 * peak + after) if before - 2 * peak + after else 0
+    return float(candidates[best] + np.clip(shift, -0.5, 0.5) * (candidates[1] - candidates[0]))
+
+
+def estimate_tempo(flux: np.ndarray, fps: float):
+    """
+    Returns the bpm (float, rounded to 0.01) of a song from its onset envelope (see onset_envelope)
+    """
+
+    return round(refine_tempo([flux], fps, autocorrelation_tempo([flux], fps)), 2)
+
+
+def fast_tempo(read, length: int, sr: int, scale: float = 1, excerpts: int = EXCERPTS, seconds: float = EXCERPT_SECONDS):
+    """
+    Returns the bpm (float, rounded to 0.01) of a song from a few excerpts spread over it, the rest being never read
+
+    read (callable): read(first, last) yields the blocks of mono samples of frames first to last (see
+        generate_timestamps.mono_blocks)
+    length (int): number of frames of the song
+    """
+
+    window = int(seconds * sr)
+    if length <= excerpts * window:
+        ranges = [(0, length)]
+    else:
+        ranges = [(int(length * (i + 1) / (excerpts + 1)) - window // 2, int(length * (i + 1) / (excerpts + 1)) + window // 2)
+                  for i in range(excerpts)]
+    envelopes = [onset_envelope(read(first, last), sr, scale) for first, last in ranges]
+    fps = envelopes[0][2]
+    flux = [envelope[0] for envelope in envelopes]
+    return round(refine_tempo(flux, fps, autocorrelation_tempo(flux, fps)), 2)
+
+
+def beat_grid(flux: np.ndarray, rms: np.ndarray, fps: float, bpm: float, duration: float):
+    """
+    Returns the beat grid {'bpm', 'beats', 'downbeats', 'start', 'finish'} of a song at bpm from its onset envelope
+    (see onset_envelope), times in seconds
+
+    start: first downbeat of a bar with audible beats
+    finish: downbeat closing the last bar with audible beats (the last downbeat if that bar is cut short)
+    beats, downbeats: from start to finish
+    start and finish are 0 and duration when no bar has audible beats: silence, or a song shorter than a bar
+    """
+
+    period = 60 * fps / bpm
+    _, phase = beat_component(flux, period)
+    frames = np.arange(phase, len(flux), period)
+    starts = np.round(frames).astype(int)
+
+    # log spectra hardly grow more on a loud hit than on a soft one, the accent of a downbeat is in its loudness
+    accents = np.array([rms[frame:frame + ACCENT_FRAMES].max() for frame in starts])
+    position = int(np.argmax([accents[i::BEATS_PER_BAR].mean() if len(accents[i::BEATS_PER_BAR]) else 0
+                              for i in range(BEATS_PER_BAR)]))
+
+    # a bar is music when its beats stand out of the flux between them, however quiet it is
+    bars = range(position, len(frames), BEATS_PER_BAR)
+    onsets = np.array([flux[max(0, frame - 1):frame + 2].max() for frame in starts])
+    salience = np.array([onsets[bar:bar + BEATS_PER_BAR].mean()
+                         - np.median(flux[starts[bar]:starts[bar] + int(BEATS_PER_BAR * period)]) for bar in bars])
+    active = np.flatnonzero(salience >= ACTIVE_RATIO * salience.max()) if len(salience) and salience.max() > 0 else []
+
+    times = frame_time(frames, fps)
+    downbeats = times[position::BEATS_PER_BAR]
+    start, finish = 0, duration
+    if len(active):
+        start = downbeats[active[0]]
+        finish = downbeats[active[-1]] + BEATS_PER_BAR * 60 / bpm
+        if finish > duration:
+            finish = downbeats[active[-1]]
+    if finish <= start:  # a single bar cut short by the end of the song
+        start, finish = 0, duration
+
+    def between(values):
+        return np.round(values[(values >= start - 1e-6) & (values <= finish + 1e-6)], 4).tolist()
+
+    return {'bpm': bpm, 'beats': between(times), 'downbeats': between(downbeats), 'start': round(float(start), 4),
+            'finish': round(float(finish), 4)}
@@ -0,0 +1,1042 @@
+import os
+import io
+import sys
+import json
+import platform
+import argparse
+import math
+import bisect
+import random
+import time
+import wave
+import shutil
+import hashlib
+import tempfile
+import tracemalloc
+import threading
+import contextlib
+import subprocess
+import concurrent.futures
+import numpy as np
+from os.path import join
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from scipy.io.wavfile import read
+
+import tools
+import streaming
+import compositor
+import ffmpeg_render
+import video_downloader
+import make_sub_movies
+import generate_timestamps
+from footage import FootagePool
+from catalog import FootageCatalog
+from proxies import ProxyCache
+from song_analysis import SongAnalysis
+from render_profile import RenderProfile, target_size
+
+'''
+Offline benchmarks: every input is synthesised on the fly, run with "python benchmark.py [name ...]" after
+"pip install -r requirements-benchmark.txt" (librosa for the tempo reference)
+
+Results of the benchmarks that record them are written with --json results.json, and compared to the results of
+another commit with --compare baseline.json
+'''
+
+STAGE_CASES = ((20, 8, 360), (60, 8, 360), (20, 32, 360), (20, 8, 720))  # song seconds, library clips, resolution
+OUTPUT_TARGETS = ('720', '360', '360x640')  # delivered from a composite at the first one
+PROFILE_CASES = (('final', None), ('draft', (20, 40)))  # render profile, window of the 60s song
+TEMPO_CASES = ((90, 1.37), (123.4, 3.0), (128, 0.5), (174, 2.11))  # bpm, first beat in seconds
+REGRESSION = 1.1  # ratio to the baseline over which a timing is reported as a regression
+IMPORT_BUDGET = 0.4  # seconds an entry module may take to import
+ENTRY_MODULES = ('music_video_generator', 'make_sub_movies', 'song_analysis', 'generate_timestamps', 'catalog',
+                 'video_downloader')
+LAZY_PACKAGES = ('moviepy', 'librosa', 'numba', 'scipy', 'pixabay', 'pexelsapi')  # imported only when used
+
+RESULTS = []  # {'benchmark', 'case', 'metrics'} recorded by the benchmarks run
+
+
+def record(benchmark: str, case: dict, **metrics):
+    """
+    Keeps the metrics (seconds, MB...) of a benchmark case for --json and --compare
+    """
+
+    RESULTS.append({'benchmark': benchmark, 'case': case, 'metrics': metrics})
+
+
+def make_wav(path: str, seconds: float, bpm: float = 128, sr: int = 44100, channels: int = 2, dtype=np.int16):
+    """
+    Writes a synthetic song (.wav) with a silent intro / outro and 4 bar sections of varying loudness, one second at a time
+    """
+
+    length_of_16_beats = 16 * 60 / bpm
+    rng = np.random.default_rng(0)
+    sections = rng.choice([0.3, 0.7, 1.0], int(seconds / length_of_16_beats) + 1)
+    sections[[0, -1]] = 1.0  # loud first and last sections so the downbeat guess spans the whole song
+
+    with wave.open(path, "wb") as file:
+        file.setnchannels(channels)
+        file.setsampwidth(np.dtype(dtype).itemsize)
+        file.setframerate(sr)
+        for second in range(math.ceil(seconds)):
+            t = np.arange(second * sr, min(second + 1, seconds) * sr) / sr
+            loudness = sections[(t / length_of_16_beats).astype(int)]
+            clicks = np.exp(-40 * ((t * bpm / 60) % 1))  # one decaying click per beat
+            signal = np.sin(2 * np.pi * 110 * t) * clicks * loudness * ((t > 1) & (t < seconds - 1))
+            samples = (signal * np.iinfo(dtype).max * 0.9).astype(dtype)
+            file.writeframes(np.repeat(samples[:, None], channels, axis=1).astype(f"<{np.dtype(dtype).str[1:]}").tobytes())
+
+
+def make_video(path: str, seconds: float, height: int = 360, fps: int = 25, hue: int = 0):
+    """
+    Writes a synthetic 16:9 clip (.mp4) from the ffmpeg testsrc2 pattern, hue rotated so that clips differ
+    """
+
+    subprocess.run(["ffmpeg", "-f", "lavfi", "-i", f"testsrc2=size={height * 16 // 9}x{height}:rate={fps}:"
+                    f"duration={seconds}", "-vf", f"hue=h={hue}", "-c:v", "libx264", "-pix_fmt", "yuv420p",
+                    "-y", path, "-hide_banner", "-loglevel", "error"], check=True)
+
+
+def make_project(folder: str, seconds: float, clips: int = 8, height: int = 360, bpm: float = 128):
+    """
+    Writes a synthetic project folder (music/song.wav, videos/, titles/) and returns the song path
+    """
+
+    for sub_folder in ('music', 'videos', 'titles'):
+        os.makedirs(join(folder, sub_folder), exist_ok=True)
+    for i in range(clips):
+        make_video(join(folder, 'videos', f"clip{i}.mp4"), 20, height, hue=i * 360 // clips)
+    make_video(join(folder, 'titles', "title.mp4"), seconds, height)
+    make_wav(join(folder, 'music', 'song.wav'), seconds, bpm)
+    return join(folder, 'music', 'song.wav')
+
+
+def reference_intensities(music_file_path: str, bpm: float, start: float, finish: float):
+    """
+    Per sample loop version of generate_timestamps.get_intensities from the first (start) to the last downbeat (finish),
+    kept as the speed reference. Parity with the original loops is tested by test_generate_timestamps.py
+    """
+
+    duration = generate_timestamps.get_duration(music_file_path)
+    _, data = read(music_file_path)
+    data = data[:, 0]
+    length = len(data)
+    counts_in_4_bars = next(c for c in range(length) if c / length >= (16 * 60 / bpm) / duration)
+
+    averages, count_, sum_ = [], 0, float(0)
+    for count, point in enumerate(data):
+        if start / duration <= count / length <= finish / duration:
+            count_ += 1
+            sum_ += float(abs(int(point)))
+            if count_ >= counts_in_4_bars:
+                averages.append(sum_ / count_)
+                count_, sum_ = 0, float(0)
+
+    return generate_timestamps.classify_intensities(averages)
+
+
+def bench_analysis():
+    """
+    Checks the vectorised waveform analysis against the per sample loops and times both
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        for seconds in (30, 120):
+            for bpm in (90, 128, 174):
+                path = join(folder, f"{seconds}s.wav")
+                make_wav(path, seconds, bpm)
+
+                bounds = generate_timestamps.guess_first_and_last_down_beat(path, bpm)
+                start = time.perf_counter()
+                expected = reference_intensities(path, bpm, *bounds)
+                loops = time.perf_counter() - start
+
+                start = time.perf_counter()
+                intensities = generate_timestamps.get_intensities(path, bpm)
+                vectorised = time.perf_counter() - start
+
+                assert intensities == expected, f"intensities mismatch for {seconds}s at {bpm} bpm"
+                print(f"analysis {seconds}s @ {bpm} bpm: loops {loops:.2f}s, numpy {vectorised:.3f}s "
+                      f"(x{loops / vectorised:.0f})")
+
+
+def make_click_track(path: str, seconds: float, bpm: float, first_beat: float, quiet_bars: int = 4, sr: int = 44100):
+    """
+    Writes a click track (.wav) over background noise: a kick on every downbeat, a hi-hat on the other beats, the
+    first quiet_bars at a sixth of the volume. Returns the true beat times (np.ndarray) in seconds
+    """
+
+    rng = np.random.default_rng(0)
+    signal = rng.normal(0, 0.01, int(seconds * sr))
+    times = np.arange(first_beat, seconds - 0.2, 60 / bpm)
+    t = np.arange(int(0.08 * sr)) / sr
+    for beat, time_ in enumerate(times):
+        first = int(time_ * sr)
+        volume = (1 if beat % 4 == 0 else 0.5) * (0.15 if beat < 4 * quiet_bars else 1)
+        pitch = 80 if beat % 4 == 0 else 1500
+        click = volume * (np.sin(2 * np.pi * pitch * t) * np.exp(-40 * t) + 0.3 * rng.normal(0, 1, len(t)) * np.exp(-80 * t))
+        signal[first:first + len(t)] += click[:len(signal) - first]
+    with wave.open(path, "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(sr)
+        file.writeframes((np.clip(signal, -1, 1) * 32000).astype("<i2").tobytes())
+    return times
+
+
+def threshold_down_beats(music_file_path: str):
+    """
+    First and last downbeats (float, float) in seconds as guessed before the beat grid: the first and last samples
+    above max/1.5, kept as the accuracy reference
+    """
+
+    _, data = generate_timestamps.open_wav(music_file_path)
+    samples = data.mean(axis=1)
+    above = np.flatnonzero(samples >= samples.max() / 1.5)
+    duration = generate_timestamps.get_duration(music_file_path)
+    return above[0] / len(data) * duration, (above[-1] + 1) / len(data) * duration
+
+
+def librosa_bpm(music_file_path: str):
+    """
+    bpm (float) as guessed before the beat grid, with librosa at 22.05 kHz, kept as the accuracy / speed reference
+    """
+
+    import librosa
+
+    y, sr = librosa.load(music_file_path)
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    return round(float(librosa.feature.tempo(onset_envelope=onset_env, sr=sr)[0]), 1)
+
+
+def bench_tempo():
+    """
+    Tempo and downbeats of click tracks with a quiet intro: librosa and max/1.5 threshold guesses against the beat grid
+    (whole song) and fast tempo (excerpts only), errors in bpm and milliseconds
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        make_click_track(join(folder, "clicks.wav"), 10, 120, 0)
+        librosa_bpm(join(folder, "clicks.wav"))  # librosa compiles with numba on its first call, kept out of the timings
+        for seconds in (60, 240):
+            for bpm, first_beat in TEMPO_CASES:
+                path = join(folder, "clicks.wav")
+                truth = make_click_track(path, seconds, bpm, first_beat)
+                downbeat = truth[0]
+
+                start = time.perf_counter()
+                reference = librosa_bpm(path)
+                librosa_seconds = time.perf_counter() - start
+                threshold_start, _ = threshold_down_beats(path)
+
+                start = time.perf_counter()
+                grid = generate_timestamps.guess_beat_grid(path)
+                grid_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    fast = generate_timestamps.guess_bpm(path)
+                fast_seconds = time.perf_counter() - start
+
+                beat_errors = np.abs(np.array(grid['beats'])[:, None] - truth[None]).min(axis=1) * 1000
+                record('tempo', {'seconds': seconds, 'bpm': bpm}, librosa_seconds=librosa_seconds,
+                       grid_seconds=grid_seconds, fast_seconds=fast_seconds, librosa_error=abs(reference - bpm),
+                       grid_error=abs(grid['bpm'] - bpm), fast_error=abs(fast - bpm),
+                       threshold_start_ms=abs(threshold_start - downbeat) * 1000,
+                       grid_start_ms=abs(grid['start'] - downbeat) * 1000, grid_beat_ms=float(beat_errors.max()))
+                print(f"tempo {seconds}s @ {bpm} bpm: librosa {reference} in {librosa_seconds:.2f}s, grid "
+                      f"{grid['bpm']} in {grid_seconds:.2f}s, fast {fast} in {fast_seconds:.2f}s | first downbeat "
+                      f"{downbeat:.2f}s: threshold {threshold_start:.2f}s, grid {grid['start']:.2f}s | "
+                      f"grid beats within {beat_errors.max():.0f}ms")
+
+
+def peak_rss_mb(code: str):
+    """
+    Runs python code in a fresh interpreter and returns its peak resident memory (float) in MB
+    """
+
+    code += "\nimport resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return int(output.split()[-1]) / 1024  # kB on linux
+
+
+def import_time(module: str):
+    """
+    Returns the time (float) a fresh interpreter takes to import a module, from python -X importtime, and the
+    LAZY_PACKAGES it loaded (list)
+    """
+
+    code = (f"import sys, json, {module}; "
+            f"print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}} & {set(LAZY_PACKAGES)})))")
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", code], check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    line = next(line for line in output.stderr.splitlines() if line.endswith(f"| {module}"))
+    return int(line.split('|')[1]) / 1e6, json.loads(output.stdout)
+
+
+def bench_imports():
+    """
+    Import time of the entry modules against IMPORT_BUDGET, none of them loading the LAZY_PACKAGES (moviepy,
+    librosa, scipy, provider clients...) at import. The budget is enforced by test_imports.py
+    """
+
+    for module in ENTRY_MODULES:
+        seconds, loaded = import_time(module)
+        record('imports', {'module': module}, seconds=seconds)
+        print(f"import {module}: {seconds * 1000:.0f}ms" + (f", loads {', '.join(loaded)}" if loaded else "")
+              + (" (over budget)" if seconds > IMPORT_BUDGET or loaded else ""))
+
+
+def bench_memory():
+    """
+    Peak RSS of the analysis as songs get longer: memory-mapped block analysis vs a full scipy read of the same file
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        baseline = peak_rss_mb("import generate_timestamps")
+        for minutes in (2, 8, 32):
+            path = join(folder, f"{minutes}min.wav")
+            make_wav(path, minutes * 60)
+            streamed = peak_rss_mb(f"import generate_timestamps; generate_timestamps.get_intensities({path!r}, 128)")
+            full = peak_rss_mb(f"import generate_timestamps; from scipy.io.wavfile import read; "
+                               f"read({path!r})[1].mean(axis=1)")
+            print(f"memory {minutes} min song: streamed {streamed - baseline:.0f} MB, "
+                  f"full read {full - baseline:.0f} MB above a {baseline:.0f} MB interpreter")
+            os.remove(path)
+
+
+def bench_composite():
+    """
+    Blend / glitch / mux of sub videos: the multi-file cascade against the single filter graph pass
+    """
+
+    for height, seconds in ((360, 30), (720, 30)):
+        timings = {}
+        for name, composite in compositor.COMPOSITORS.items():
+            with tempfile.TemporaryDirectory() as folder:
+                temp_path = join(folder, 'temp' + os.sep)
+                os.makedirs(temp_path)
+                make_wav(join(folder, 'song.wav'), seconds)
+                sub_vid_paths = [join(temp_path, f"song_subVid{i}.mp4") for i in range(3)]
+                for i, path in enumerate(sub_vid_paths):
+                    make_video(path, seconds, height, hue=i * 90)
+
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    composite(sub_vid_paths, join(folder, 'song.wav'), temp_path, 'song')
+                timings[name] = time.perf_counter() - start
+        print(f"composite 3 x {seconds}s @ {height}p: " +
+              ", ".join(f"{name} {timing:.1f}s" for name, timing in timings.items()))
+
+
+def bench_render():
+    """
+    Sub video rendering with thread and process pools, for 1 worker up to the number of cores
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        music_file_path = make_project(folder, 30)
+        analysis = SongAnalysis(music_file_path, 128)
+        start, finish = analysis.first_and_last_down_beat
+        with contextlib.redirect_stdout(io.StringIO()):
+            footage = FootagePool.scan(join(folder, 'videos' + os.sep), 360).footage
+            plans = [make_sub_movies.plan_sub_movie(music_file_path, 128, footage, i, start, finish,
+                                                    analysis.duration, analysis.intensities, '360', 'smart_vid')
+                     for i in range(4)]
+
+        workers = sorted({1, 2, 4, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+        for Executor in (concurrent.futures.ThreadPoolExecutor, concurrent.futures.ProcessPoolExecutor):
+            for count in workers:
+                start = time.perf_counter()
+                with Executor(max_workers=count) as executor, contextlib.redirect_stdout(io.StringIO()):
+                    list(executor.map(make_sub_movies.render_sub_movie, plans))
+                print(f"render 4 sub videos of 30s @ 360p, {Executor.__name__} x {count}: "
+                      f"{time.perf_counter() - start:.1f}s")
+
+
+def bench_backends():
+    """
+    Same edit decision lists rendered by the moviepy and the ffmpeg backends
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        for seconds in (30, 60):
+            music_file_path = make_project(folder, seconds)
+            analysis = SongAnalysis(music_file_path, 128)
+            start, finish = analysis.first_and_last_down_beat
+            with contextlib.redirect_stdout(io.StringIO()):
+                footage = FootagePool.scan(join(folder, 'videos' + os.sep), 360, seed=0).footage
+                plan = make_sub_movies.plan_sub_movie(music_file_path, 128, footage, 0, start, finish,
+                                                      analysis.duration, analysis.intensities, '360', 'smart_vid', 0)
+
+            timings = {}
+            for name, render in (('moviepy', make_sub_movies.render_sub_movie), ('ffmpeg', ffmpeg_render.render_edl)):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    render(plan)
+                timings[name] = time.perf_counter() - start
+            print(f"backends {len(plan['clips'])} clips, {seconds}s @ 360p: " +
+                  ", ".join(f"{name} {timing:.1f}s" for name, timing in timings.items()))
+
+
+def reference_effect(clip, effect: str):
+    """
+    tools.apply_effect as it was before tools.EFFECTS: a fancy indexed copy of every frame to swap green and blue, then
+    moviepy's mirrors, kept as the allocation / speed reference
+    """
+
+    from moviepy.editor import vfx
+
+    if effect == 'invert_green_blue':
+        clip = clip.fl_image(lambda image: image[:, :, [0, 2, 1]])
+    elif effect == 'mirror_x':
+        clip = clip.fx(vfx.mirror_x)
+    elif effect == 'invert_green_blue_mirror_y':
+        clip = clip.fl_image(lambda image: image[:, :, [0, 2, 1]]).fx(vfx.mirror_y)
+    return clip
+
+
+def frame_allocations(clip, frames: int):
+    """
+    Returns the frame buffers (float) allocated on average to get a frame of a clip: the peak of the memory traced while
+    getting it, above what was in use before, in frames
+    """
+
+    frame_bytes = clip.size[0] * clip.size[1] * 3
+    clip.get_frame(0)
+    tracemalloc.start()
+    allocated = 0
+    for i in range(1, frames + 1):
+        in_use = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        clip.get_frame(i / clip.fps)
+        allocated += tracemalloc.get_traced_memory()[1] - in_use
+    tracemalloc.stop()
+    return allocated / frames / frame_bytes
+
+
+def bench_effects():
+    """
+    Colour / mirror effects before (reference_effect) and after (tools.EFFECTS): frame buffers allocated and time spent
+    by the effect itself on a read-only decoded frame, then frames per second of a clip decoded and composed as
+    render_sub_movie does (best of 3), and of the same effects as ffmpeg filters
+    """
+
+    from moviepy.editor import VideoClip, VideoFileClip, concatenate_videoclips
+
+    seconds = 10
+    with tempfile.TemporaryDirectory() as folder:
+        for height in (360, 720):
+            path = join(folder, f"{height}.mp4")
+            make_video(path, seconds, height)
+            source = VideoFileClip(path, audio=False)
+            decoded = source.get_frame(1)  # read-only, as frames coming out of the reader are
+            source.close()
+
+            for effect in tools.EFFECTS:
+                measures = {}
+                for name, apply in (('before', reference_effect), ('after', tools.apply_effect)):
+                    still = apply(VideoClip(lambda t: decoded, duration=seconds).set_fps(25), effect)
+                    allocations = frame_allocations(still, 50)
+                    start = time.perf_counter()
+                    for i in range(250):
+                        still.get_frame(i / 25)
+                    effect_ms = (time.perf_counter() - start) / 250 * 1000
+
+                    timings = []
+                    for _ in range(3):
+                        clip = apply(VideoFileClip(path, audio=False), effect)
+                        composed = concatenate_videoclips([clip], method="compose")
+                        start = time.perf_counter()
+                        frames = sum(1 for _ in composed.iter_frames(fps=clip.fps))
+                        timings.append(time.perf_counter() - start)
+                        clip.close()
+                    measures[name] = allocations, effect_ms, frames / min(timings)
+
+                segment = join(folder, "segment.mp4")
+                start = time.perf_counter()
+                subprocess.run(ffmpeg_render.segment_command({'start': 0, 'path': path, 'effect': effect, 'fx': None},
+                                                             seconds * 25, height, 25, segment), check=True)
+                ffmpeg_fps = seconds * 25 / (time.perf_counter() - start)
+
+                record('effects', {'height': height, 'effect': effect}, **{
+                    f"{measure}_{name}": value for name, values in measures.items()
+                    for measure, value in zip(('allocations', 'effect_ms', 'fps'), values)}, ffmpeg_fps=ffmpeg_fps)
+                print(f"effects {effect} @ {height}p: " + ", ".join(
+                    f"{name} {allocations:.1f} frame allocations {effect_ms:.2f}ms, {fps:.0f} fps composed"
+                    for name, (allocations, effect_ms, fps) in measures.items()) + f" | ffmpeg {ffmpeg_fps:.0f} fps")
+
+
+def bench_slicing():
+    """
+    One sub video cut into time slices rendered by 1 worker up to the number of cores, for both backends
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        music_file_path = make_project(folder, 60)
+        analysis = SongAnalysis(music_file_path, 128)
+        start, finish = analysis.first_and_last_down_beat
+        with contextlib.redirect_stdout(io.StringIO()):
+            footage = FootagePool.scan(join(folder, 'videos' + os.sep), 360, seed=0).footage
+            plan = make_sub_movies.plan_sub_movie(music_file_path, 128, footage, 0, start, finish,
+                                                  analysis.duration, analysis.intensities, '360', 'smart_vid', 0)
+
+        workers = sorted({1, 2, 4, 8, os.cpu_count()} & set(range(1, os.cpu_count() + 1)))
+        for name, render in (('moviepy', make_sub_movies.render_sub_movie), ('ffmpeg', ffmpeg_render.render_edl)):
+            timings = []
+            for count in workers:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    make_sub_movies.render_sliced([plan], render, concurrent.futures.ProcessPoolExecutor, count)
+                timings.append(time.perf_counter() - start)
+            print(f"slicing {name} 60s @ 360p: " + ", ".join(
+                f"{count} workers {timing:.1f}s (x{timings[0] / timing:.1f})" for count, timing in zip(workers, timings)))
+
+
+def bench_library():
+    """
+    Startup time, peak RSS and open file descriptors on a large library: every clip opened up front (the former
+    tools.preload) vs the footage pool probing metadata and opening readers on demand
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        videos_path = join(folder, 'videos' + os.sep)
+        os.makedirs(videos_path)
+        for i in range(200):
+            make_video(join(videos_path, f"clip{i:03d}.mp4"), 4, hue=i)
+
+        baseline = peak_rss_mb("import footage")
+        eager = (f"import os, time, footage; start = time.perf_counter(); "
+                 f"clips = [footage.open_clip(os.path.join({videos_path!r}, vid), 360, 'none') "
+                 f"for vid in sorted(os.listdir({videos_path!r}))]")
+        lazy = (f"import os, time, footage; start = time.perf_counter(); "
+                f"pool = footage.FootagePool.scan({videos_path!r}, 360)")
+        touched = lazy + ("; first = [pool.open(clip['path'], clip['effect']).get_frame(0)[0, 0].tolist() "
+                          "for clip in pool.footage]")
+        report = "; print(time.perf_counter() - start, len(os.listdir('/proc/self/fd')))"
+        for name, code in (('open all', eager), ('pool scan', lazy), ('pool, a frame of every clip', touched)):
+            output = subprocess.run([sys.executable, "-c", code + report], check=True, capture_output=True,
+                                    text=True).stdout.split()
+            rss = peak_rss_mb(code)
+            print(f"library 200 clips, {name}: {float(output[-2]):.1f}s, {rss - baseline:.0f} MB above the "
+                  f"interpreter, {output[-1]} open file descriptors")
+
+
+def retry_draws(footage: list, length: float, rng):
+    """
+    Number of random draws (int) the former retry loop of make_sub_movie needed to find a clip lasting length seconds
+    """
+
+    draws = 1
+    while rng.choice(footage)['duration'] < length:
+        draws += 1
+    return draws
+
+
+def bench_catalog():
+    """
+    Footage metadata of a 200 clip library: cold catalog, warm catalog, a few modified files, then clip selection on
+    a short clip heavy library, former retry loop vs the sorted duration index
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        videos_path = join(folder, 'videos' + os.sep)
+        os.makedirs(videos_path)
+        for i in range(200):
+            make_video(join(videos_path, f"clip{i:03d}.mp4"), 2 if i % 20 else 12, hue=i)
+
+        timings = {}
+        catalog = FootageCatalog.of(videos_path)
+        for name in ('cold', 'warm', '5 modified'):
+            if name == '5 modified':
+                for i in range(5):
+                    make_video(join(videos_path, f"clip{i:03d}.mp4"), 3, hue=i)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                footage = catalog.refresh(videos_path)
+            timings[name] = time.perf_counter() - start
+        print(f"catalog {len(footage)} clips: " + ", ".join(f"{name} {timing:.2f}s" for name, timing in timings.items()))
+        catalog.close()
+
+    # 1 clip out of 50 lasts long enough for the 16 beat slots of the low intensity sections
+    footage = [{'path': f"clip{i}.mp4", 'duration': 20 if i % 50 == 0 else 2, 'effect': 'none'} for i in range(5000)]
+    slots, rng = [16 * 60 / 128] * 2000, random.Random(0)
+    start = time.perf_counter()
+    draws = sum(retry_draws(footage, length, rng) for length in slots)
+    retry = time.perf_counter() - start
+    start = time.perf_counter()
+    durations = sorted(video['duration'] for video in footage)
+    for length in slots:
+        rng.randrange(bisect.bisect_left(durations, length), len(footage))
+    indexed = time.perf_counter() - start
+    print(f"selection of {len(slots)} long slots among {len(footage)} clips: retry loop {retry * 1000:.0f}ms "
+          f"({draws / len(slots):.0f} draws per slot), sorted duration index {indexed * 1000:.1f}ms (1 draw per slot)")
+
+
+def bench_proxies():
+    """
+    3 sub videos at 360p from 720p footage with the ffmpeg backend: read from the sources, from proxies made for the
+    occasion, then from the proxies of a previous run
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        music_file_path = make_project(folder, 60, height=720)
+        analysis = SongAnalysis(music_file_path, 128)
+        start, finish = analysis.first_and_last_down_beat
+        with contextlib.redirect_stdout(io.StringIO()):
+            footage = FootagePool.scan(join(folder, 'videos' + os.sep), 360, seed=0).footage
+            plans = [make_sub_movies.plan_sub_movie(music_file_path, 128, footage, i, start, finish,
+                                                    analysis.duration, analysis.intensities, '360', 'smart_vid', 0)
+                     for i in range(3)]
+
+        timings = {}
+        for name in ('sources', 'cold proxies', 'warm proxies'):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                rendered = plans if name == 'sources' else ProxyCache.of(join(folder, 'videos')).use_proxies(plans)
+                for plan in rendered:
+                    ffmpeg_render.render_edl(plan)
+            timings[name] = time.perf_counter() - start
+        print(f"proxies 3 sub videos of 60s @ 360p from 720p footage: " +
+              ", ".join(f"{name} {timing:.1f}s" for name, timing in timings.items()))
+
+
+def bench_stages():
+    """
+    Every stage of the generation of a song timed on its own: analysis, bpm guess, footage scan, plan, sub video renders
+    (3, ffmpeg backend, proxies included), blend, glitch and mux. Song length, library size and resolution each vary
+    from a 20s song, 8 clips at 360p (see STAGE_CASES)
+    """
+
+    for seconds, clips, height in STAGE_CASES:
+        with tempfile.TemporaryDirectory() as folder:
+            music_file_path = make_project(folder, seconds, clips, height)
+            videos_path, temp_path = join(folder, 'videos' + os.sep), join(folder, 'temp' + os.sep)
+            timings = {}
+
+            def timed(stage: str, run):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = run()
+                timings[stage] = time.perf_counter() - start
+                return result
+
+            timed('analysis', lambda: SongAnalysis(music_file_path, 128).analyse())
+            timed('bpm guess', lambda: SongAnalysis(music_file_path, cache_dir=join(folder, 'bpm')).bpm)
+            timed('footage scan', lambda: FootagePool.scan(videos_path, height, seed=0))
+            plans = timed('plan', lambda: make_sub_movies.plan_sub_movies(music_file_path, 128, 3, str(height),
+                                                                          'smart_vid', 0))
+            timed('render', lambda: make_sub_movies.render_sub_movies(plans, 'process', 'ffmpeg'))
+            sub_vid_paths = [plan['output_path'] for plan in plans]
+            timed('blend', lambda: compositor.blend_cascade(sub_vid_paths, temp_path, 'song'))
+            timed('glitch', lambda: compositor.glitch(temp_path, 'song'))
+            timed('mux', lambda: compositor.mux(music_file_path, temp_path, 'song'))
+
+        record('stages', {'song_seconds': seconds, 'clips': clips, 'resolution': height}, **timings)
+        print(f"stages {seconds}s song, {clips} clips @ {height}p: " +
+              ", ".join(f"{stage} {timing:.2f}s" for stage, timing in timings.items()))
+
+
+def bench_profiles():
+    """
+    Time from a planned 60s song (8 clips) to its finished 720p video with the final profile, then with the draft one
+    on a 20s window: proxies, sub video renders (3, ffmpeg backend) and the filter_graph composite. Both profiles render
+    the same project, their proxies and outputs are kept apart
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        music_file_path = make_project(folder, 60, 8)
+        for name, window in PROFILE_CASES:
+            profile = RenderProfile(name, '720', window)
+            with contextlib.redirect_stdout(io.StringIO()):
+                plans = make_sub_movies.plan_sub_movies(music_file_path, 128, 3, '720', 'smart_vid', 0, profile)
+                start = time.perf_counter()
+                make_sub_movies.render_sub_movies(plans, 'process', 'ffmpeg')
+                output_path = compositor.filter_graph([plan['output_path'] for plan in plans], music_file_path,
+                                                      join(folder, 'temp' + os.sep), 'song' + profile.suffix(), profile)
+                elapsed = time.perf_counter() - start
+            size = os.path.getsize(output_path) >> 10
+
+            record('profiles', {'profile': name, 'window': window, 'encoder': profile.encoder}, seconds=elapsed,
+                   kilobytes=size)
+            print(f"profile {name} ({profile.encoder} {profile.preset}, {profile.resolution}p, "
+                  f"{'whole song' if window is None else f'{window[0]}-{window[1]}s'}): {elapsed:.2f}s, {size} kB")
+
+
+def bench_outputs():
+    """
+    Delivering OUTPUT_TARGETS of a 20s song (8 clips): one run rendering the sub videos (3, ffmpeg backend) at 720p
+    and compositing them once into every target, against one run per target, as many renders and composites as
+    targets. Proxies are made beforehand, a project keeps them from one run to the next
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        music_file_path = make_project(folder, 20, 8)
+        temp_path = join(folder, 'temp' + os.sep)
+        profile = RenderProfile('final', OUTPUT_TARGETS[0])
+
+        def run(resolution: str, song_name: str, targets: list):
+            plans = make_sub_movies.plan_sub_movies(music_file_path, 128, 3, resolution, 'smart_vid', 0)
+            make_sub_movies.render_sub_movies(plans, 'process', 'ffmpeg')
+            return compositor.filter_graph([plan['output_path'] for plan in plans], music_file_path, temp_path,
+                                           song_name, profile, targets)
+
+        def resolution_of(target: str):  # vertical cuts are cropped from a landscape render
+            return OUTPUT_TARGETS[0] if 'x' in target else target
+
+        timings = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for resolution in {resolution_of(target) for target in OUTPUT_TARGETS}:
+                plans = make_sub_movies.plan_sub_movies(music_file_path, 128, 3, resolution, 'smart_vid', 0)
+                ProxyCache.of(temp_path).use_proxies(plans)
+
+            start = time.perf_counter()
+            shared = run(OUTPUT_TARGETS[0], 'shared', list(OUTPUT_TARGETS))
+            timings['shared'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            separate = [run(resolution_of(target), f"separate{i}", [target])[0]
+                        for i, target in enumerate(OUTPUT_TARGETS)]
+            timings['separate'] = time.perf_counter() - start
+
+        sizes = [[int(value) for value in subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height", "-of",
+             "csv=p=0", path], capture_output=True, text=True).stdout.split(',')] for path in shared]
+        assert sizes == [list(target_size(target)) for target in OUTPUT_TARGETS], sizes
+        assert all(os.path.exists(path) for path in separate)
+
+    record('outputs', {'targets': list(OUTPUT_TARGETS)}, **timings)
+    print(f"outputs {', '.join(OUTPUT_TARGETS)}: one composite {timings['shared']:.2f}s, one run per target "
+          f"{timings['separate']:.2f}s ({timings['separate'] / timings['shared']:.2f}x)")
+
+
+def bench_keyframes():
+    """
+    Sub video renders (3, ffmpeg backend, one after another) of a 60s song at 720p (8 clips with a key frame every 10s)
+    with every segment encoded, then with the segments starting on a key frame of their proxy copied, then with cuts
+    snapped to the key frames of the sources: copied / encoded segments and render time. Proxies are made beforehand
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        music_file_path = make_project(folder, 60, 8)
+        for case, snap, copy in (('encoded', False, False), ('copied', False, True), ('snapped', True, True)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                plans = make_sub_movies.plan_sub_movies(music_file_path, 128, 3, '720', 'smart_vid', 0,
+                                                        snap_keyframes=snap)
+                plans = [dict(plan, clips=[dict(clip, keyframe=clip['keyframe'] and copy) for clip in plan['clips']])
+                         for plan in ProxyCache.of(join(folder, 'temp')).use_proxies(plans)]
+                start = time.perf_counter()
+                counts = [ffmpeg_render.render_edl(plan) for plan in plans]
+                elapsed = time.perf_counter() - start
+            copied, encoded = sum(count['copied'] for count in counts), sum(count['encoded'] for count in counts)
+            copyable = sum(not tools.EFFECTS[clip['effect']] and not clip['fx'] for plan in plans for clip in plan['clips'])
+
+            record('keyframes', {'case': case}, seconds=elapsed, copied=copied, encoded=encoded)
+            print(f"keyframes {case}: {copied} segments copied / {encoded} encoded ({copied / (copied + encoded):.0%}, "
+                  f"{copyable} without effect nor fade), {elapsed:.2f}s")
+
+
+def bench_segments():
+    """
+    Sub video renders (3, ffmpeg backend) of a 60s song at 720p (8 clips): first render, the same plans rendered again,
+    then with one clip of one sub video cut from another part of its video. Proxies are made beforehand
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        music_file_path = make_project(folder, 60, 8)
+        with contextlib.redirect_stdout(io.StringIO()):
+            plans = make_sub_movies.plan_sub_movies(music_file_path, 128, 3, '720', 'smart_vid', 0)
+            ProxyCache.of(join(folder, 'temp')).use_proxies(plans)
+        clip = plans[0]['clips'][len(plans[0]['clips']) // 2]
+        shift = 1 if clip['start'] < 1 else -1
+        recut = [dict(plans[0], clips=[dict(clip, start=clip['start'] + shift, end=clip['end'] + shift)
+                                       if i == len(plans[0]['clips']) // 2 else other
+                                       for i, other in enumerate(plans[0]['clips'])]), *plans[1:]]
+
+        for case, case_plans in (('first render', plans), ('same plans', plans), ('one clip re-cut', recut)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                counts = make_sub_movies.render_sub_movies(case_plans, 'process', 'ffmpeg')
+                elapsed = time.perf_counter() - start
+
+            record('segments', {'case': case}, seconds=elapsed, **counts)
+            print(f"segments {case}: {counts['cached']} reused, {counts['encoded'] + counts['copied']} rendered, "
+                  f"{elapsed:.2f}s")
+
+
+def bench_stream():
+    """
+    Music video of a 60s song at 720p (3 sub videos, 8 clips, ffmpeg backend): sub video renders then the filter_graph
+    composite, against the HLS stream, timing when the first segment of the stream can be played. Proxies are made
+    beforehand, segments are rendered again for each case
+    """
+
+    with tempfile.TemporaryDirectory() as folder:
+        music_file_path = make_project(folder, 60, 8)
+        temp_path = join(folder, 'temp') + os.sep
+        with contextlib.redirect_stdout(io.StringIO()):
+            plans = make_sub_movies.plan_sub_movies(music_file_path, 128, 3, '720', 'smart_vid', 0)
+            ProxyCache.of(temp_path).use_proxies(plans)
+        output_path = streaming.stream_path(temp_path, 'song', 'hls')
+
+        def first_segment(start: float, playable: list, done: threading.Event):
+            while not done.is_set() and not playable:
+                if os.path.exists(output_path) and '.m4s' in open(output_path).read():
+                    playable.append(time.perf_counter() - start)
+                time.sleep(0.05)
+
+        for case in ('render then composite', 'stream'):
+            shutil.rmtree(join(folder, 'cache', 'segments'), ignore_errors=True)
+            playable, done = [], threading.Event()
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                if case == 'stream':
+                    watcher = threading.Thread(target=first_segment, args=(start, playable, done))
+                    watcher.start()
+                    streaming.stream(plans, music_file_path, temp_path, 'song', 'hls')
+                    done.set()
+                    watcher.join()
+                else:
+                    make_sub_movies.render_sub_movies(plans, 'process', 'ffmpeg')
+                    compositor.filter_graph([plan['output_path'] for plan in plans], music_file_path, temp_path,
+                                            'song', RenderProfile.of(plans[0]))
+                elapsed = time.perf_counter() - start
+
+            first = playable[0] if playable else elapsed
+            record('stream', {'case': case}, seconds=elapsed, first_playable=first)
+            print(f"stream {case}: playable after {first:.2f}s, done in {elapsed:.2f}s")
+
+
+class ThrottledRangeHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for a video CDN: serves files from memory with keep-alive, HTTP Range and a bandwidth cap per connection
+    """
+
+    protocol_version = 'HTTP/1.1'
+    files = {}  # url path => bytes
+    rate = 4 << 20  # bytes per second and connection
+    sent = 0  # bytes sent by every handler
+
+    def do_GET(self):
+        data = self.files[self.path]
+        start = int(self.headers['Range'][6:].split('-')[0]) if self.headers['Range'] else 0
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Length', str(len(data) - start))
+        if start:
+            self.send_header('Content-Range', f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.end_headers()
+        for offset in range(start, len(data), 1 << 16):
+            self.wfile.write(data[offset:offset + (1 << 16)])
+            ThrottledRangeHandler.sent += len(data[offset:offset + (1 << 16)])
+            time.sleep((1 << 16) / self.rate)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_download():
+    """
+    Downloads of 16 x 8 MB files from a local server capped at 4 MB/s per connection for 1 up to 16 workers, then the
+    resume of a half downloaded file
+    """
+
+    rng = np.random.default_rng(0)
+    ThrottledRangeHandler.files = {f"/clip{i}.mp4": rng.bytes(8 << 20) for i in range(16)}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottledRangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stderr(io.StringIO()):
+        for workers in (1, 2, 4, 8, 16):
+            downloads = [(url + path, join(folder, f"{workers}_{path[1:]}"), len(data))
+                         for path, data in ThrottledRangeHandler.files.items()]
+            start = time.perf_counter()
+            failures = video_downloader.download_all(downloads, workers)
+            elapsed = time.perf_counter() - start
+            assert not failures and all(open(file_path, 'rb').read() == ThrottledRangeHandler.files[path[len(url):]]
+                                        for path, file_path, _ in downloads)
+            print(f"download 16 x 8 MB, {workers} workers: {elapsed:.1f}s ({128 / elapsed:.0f} MB/s)")
+
+        data = ThrottledRangeHandler.files['/clip0.mp4']
+        file_path = join(folder, 'resumed.mp4')
+        with open(file_path + '.part', 'wb') as file:
+            file.write(data[:len(data) // 2])
+        ThrottledRangeHandler.sent = 0
+        video_downloader.download_from_url(url + '/clip0.mp4', file_path)
+        assert hashlib.sha256(open(file_path, 'rb').read()).digest() == hashlib.sha256(data).digest()
+        print(f"download resume of a half downloaded 8 MB file: {ThrottledRangeHandler.sent / (1 << 20):.1f} MB sent")
+    server.shutdown()
+
+
+class FakeProvider:
+    """
+    Stand-in for a video provider: pages of 20 videos among which 1 in 4 is 16:9, with a 200 ms round trip
+    """
+
+    def __init__(self, pages: int = 10):
+        self.pages = pages
+        self.calls = 0
+
+    def search(self, query: str, page: int, global_args: dict):
+        self.calls += 1
+        time.sleep(0.2)
+        videos = [{'id': f"{query}{page}_{i}", 'width': 1920, 'height': 1080 if i % 4 == 0 else 1440,
+                   'url': f"http://localhost/{query}{page}_{i}.mp4"} for i in range(global_args['per_page'])]
+        return videos, page < self.pages
+
+
+def bench_search():
+    """
+    Planning the download of 30 videos per query for 3 queries from a fake provider: first run pages until enough
+    videos qualify, the second run reads the cached pages
+    """
+
+    provider = FakeProvider()
+    args = {'global': {'size': 'large', 'ratio': 16 / 9, 'minWidth': 1920, 'minHeight': 1080, 'per_page': 20,
+                       'video_nb': 30, 'ratio_strict': 1, 'keep_all': 0, 'sub_folders': True},
+            'fake': {'use_api': 1, 'provider': provider}}
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stderr(io.StringIO()):
+        for run in ('first', 'cached'):
+            provider.calls = 0
+            start = time.perf_counter()
+            downloads = video_downloader.plan_downloads(['sea', 'boat', 'ship'], join(folder, 'videos'), args)
+            assert len(downloads) == 90 and all(url.split('_')[-1].split('.')[0] in ('0', '4', '8', '12', '16')
+                                                for url, _, _, _ in downloads)
+            print(f"search {run} run: {len(downloads)} videos found with {provider.calls} provider calls in "
+                  f"{time.perf_counter() - start:.2f}s")
+
+
+class ListProvider:
+    """
+    Stand-in for a video provider returning the same videos {'id', 'url'} (as 1920x1080) for every query
+    """
+
+    def __init__(self, videos: list):
+        self.videos = videos
+
+    def search(self, query: str, page: int, global_args: dict):
+        return [dict(vid, width=1920, height=1080) for vid in self.videos], False
+
+
+def bench_store():
+    """
+    Downloads of 3 queries finding the same 5 videos on two providers, one of them re-encoded by the second provider:
+    bytes downloaded and stored with the footage store, then a second run
+    """
+
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stderr(io.StringIO()):
+        sources = ('mandelbrot', 'smptehdbars', 'cellauto', 'testsrc2', 'gradients')
+        for source in sources:
+            subprocess.run(["ffmpeg", "-f", "lavfi", "-i", f"{source}=size=1280x720:rate=25", "-t", "8", "-c:v",
+                            "libx264", "-pix_fmt", "yuv420p", "-y", join(folder, f"{source}.mp4"),
+                            "-hide_banner", "-loglevel", "error"], check=True)
+        subprocess.run(["ffmpeg", "-i", join(folder, "mandelbrot.mp4"), "-vf", "scale=960:540", "-c:v", "libx264",
+                        "-crf", "28", "-y", join(folder, "reencoded.mp4"), "-hide_banner", "-loglevel", "error"],
+                       check=True)
+        ThrottledRangeHandler.files = {f"/{name}": open(join(folder, name), 'rb').read()
+                                       for name in os.listdir(folder)}
+        ThrottledRangeHandler.rate = 1 << 30
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottledRangeHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        args = {'global': {'size': 'large', 'ratio': 16 / 9, 'minWidth': 1920, 'minHeight': 1080, 'per_page': 20,
+                           'video_nb': 10, 'ratio_strict': 1, 'keep_all': 0, 'sub_folders': True},
+                'a': {'use_api': 1, 'provider': ListProvider([{'id': source, 'url': f"{url}/{source}.mp4"}
+                                                              for source in sources])},
+                'b': {'use_api': 1, 'provider': ListProvider([{'id': 'copy', 'url': f"{url}/reencoded.mp4"}])}}
+        output_dir = join(folder, 'videos')
+        for run in ('first', 'second'):
+            ThrottledRangeHandler.sent = 0
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                video_downloader.video_downloader(['sea', 'boat', 'ship'], output_dir, args)
+            elapsed = time.perf_counter() - start
+            files = [join(root, name) for root, _, names in os.walk(output_dir) for name in names
+                     if name.endswith('.mp4') and '.store' not in root]
+            inodes = {os.stat(path).st_ino: os.path.getsize(path) for path in files}
+            print(f"store {run} run: {len(files)} files in query folders ({sum(map(os.path.getsize, files)) >> 20} MB), "
+                  f"{len(inodes)} stored ({sum(inodes.values()) >> 20} MB), "
+                  f"{ThrottledRangeHandler.sent / (1 << 20):.1f} MB downloaded in {elapsed:.1f}s")
+        server.shutdown()
+
+
+BENCHMARKS = {
+    'analysis': bench_analysis,
+    'tempo': bench_tempo,
+    'imports': bench_imports,
+    'memory': bench_memory,
+    'composite': bench_composite,
+    'render': bench_render,
+    'backends': bench_backends,
+    'effects': bench_effects,
+    'slicing': bench_slicing,
+    'stages': bench_stages,
+    'profiles': bench_profiles,
+    'outputs': bench_outputs,
+    'keyframes': bench_keyframes,
+    'segments': bench_segments,
+    'stream': bench_stream,
+    'library': bench_library,
+    'catalog': bench_catalog,
+    'proxies': bench_proxies,
+    'download': bench_download,
+    'search': bench_search,
+    'store': bench_store,
+}
+
+
+def commit():
+    """
+    Returns the git commit (str) of the benchmarked tree, None outside of a git checkout
+    """
+
+    output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return output.stdout.strip() if output.returncode == 0 else None
+
+
+def compare(results: list, baseline: list):
+    """
+    Prints every metric recorded in both results and baseline with its ratio to the baseline, flagging regressions
+    """
+
+    old = {(entry['benchmark'], json.dumps(entry['case'], sort_keys=True)): entry['metrics'] for entry in baseline}
+    for entry in results:
+        metrics = old.get((entry['benchmark'], json.dumps(entry['case'], sort_keys=True)), {})
+        for name, value in entry['metrics'].items():
+            if metrics.get(name):
+                ratio = value / metrics[name]
+                print(f"{entry['benchmark']} {entry['case']} {name}: {metrics[name]:.2f} => {value:.2f} (x{ratio:.2f})" +
+                      (" REGRESSION" if ratio > REGRESSION else ""))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Offline benchmarks")
+    parser.add_argument("names", nargs='*', help=f"benchmarks to run among {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--json", help="file where the recorded results are written")
+    parser.add_argument("--compare", help="results of a previous --json run to compare with")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks {unknown}")
+
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({'commit': commit(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                       'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'results': RESULTS}, file, indent=1)
+    if args.compare:
+        with open(args.compare, "r") as file:
+            compare(RESULTS, json.load(file)['results'])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
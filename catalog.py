@@ -0,0 +1,133 @@
+import os
+import json
+import sqlite3
+import pathlib
+import concurrent.futures
+from os.path import join, split, normpath, isfile
+
+from tools import probe_video, keyframe_index, project_cache_path
+from song_analysis import file_hash
+
+'''
+Persistent footage catalog: metadata and content hash of every video file are read once, then again only when the file
+changes
+
+Stored in SQLite (project_folder/cache/catalog.sqlite by default), a file is probed again when its size or mtime
+changes. Clips are indexed by duration so "clips lasting at least d seconds" is a range query on a sorted index. The
+key frame times of every file are read from its packet flags at the same time, so that cuts can start on them
+'''
+
+CATALOG_VERSION = 3  # bump to rebuild existing catalogs when the table changes
+COLUMNS = ('path', 'duration', 'width', 'height', 'fps', 'codec', 'hash', 'keyframes')
+PROBE_WORKERS = 8  # ffprobe processes run at once when many files are new
+
+
+def default_catalog_path(folder: str):
+    """
+    returns project_folder/cache/catalog.sqlite for a folder located in project_folder/
+    """
+
+    return project_cache_path(folder, 'catalog.sqlite')
+
+
+def clip_of(row: tuple):
+    """
+    returns the clip (dict) of a row of COLUMNS
+    """
+
+    return dict(zip(COLUMNS, row), keyframes=json.loads(row[COLUMNS.index('keyframes')]))
+
+
+class FootageCatalog:
+    """
+    Video metadata {'path', 'duration', 'width', 'height', 'fps', 'codec', 'hash', 'keyframes'} of folders in a SQLite
+    database, keyframes being the key frame times in seconds (list)
+
+    db_path (str): database file, created if needed
+    read_only (bool): True to only read what a previous refresh stored, files are then never probed. A read only catalog
+        can be shared by threads, ex: the songs of a batch
+    """
+
+    def __init__(self, db_path: str, read_only: bool = False):
+        self.read_only = read_only
+        if read_only:
+            self.db = sqlite3.connect(pathlib.Path(db_path).absolute().as_uri() + "?mode=ro", uri=True,
+                                      check_same_thread=False)
+            return
+        os.makedirs(split(db_path)[0] or os.curdir, exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+            self.db.executescript(f"""
+                DROP TABLE IF EXISTS clips;
+                CREATE TABLE clips (folder TEXT, path TEXT PRIMARY KEY, duration REAL, width INTEGER, height INTEGER,
+                                    fps REAL, codec TEXT, hash TEXT, keyframes TEXT, size INTEGER, mtime_ns INTEGER);
+                CREATE INDEX clips_by_duration ON clips (folder, duration);
+                PRAGMA user_version = {CATALOG_VERSION};
+            """)
+
+    @classmethod
+    def of(cls, folder: str, read_only: bool = False):
+        """
+        Opens the default catalog of a project folder (see default_catalog_path)
+        """
+
+        return cls(default_catalog_path(folder), read_only)
+
+    def refresh(self, folder: str):
+        """
+        Probes the new and modified files of a folder, forgets the deleted ones, returns its clips sorted by path. A
+        read only catalog returns the clips stored
+        """
+
+        if self.read_only:
+            return self.clips(folder, order_by='path')
+        folder = normpath(folder)
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self.db.execute(
+            "SELECT path, size, mtime_ns FROM clips WHERE folder = ?", (folder,))}
+        files = {}
+        for name in os.listdir(folder):
+            path = join(folder, name)
+            if isfile(path):
+                stat = os.stat(path)
+                files[path] = stat.st_size, stat.st_mtime_ns
+
+        changed = [path for path, signature in files.items() if known.get(path) != signature]
+        if changed:
+            print(f'Probing {len(changed)} new or modified videos from "{folder}"')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+            probed = list(executor.map(lambda path: dict(probe_video(path), hash=file_hash(path),
+                                                         keyframes=json.dumps(keyframe_index(path)['keyframes'])),
+                                       changed))
+
+        with self.db:
+            self.db.executemany("DELETE FROM clips WHERE path = ?", [(path,) for path in known if path not in files])
+            self.db.executemany("INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(folder, *[info[column] for column in COLUMNS], *files[info['path']])
+                                 for info in probed])
+        return self.clips(folder, order_by='path')
+
+    def clips(self, folder: str, min_duration: float = 0, order_by: str = 'duration'):
+        """
+        Returns the clips (list of dict) of a folder lasting at least min_duration seconds, sorted by duration or path
+        """
+
+        rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM clips WHERE folder = ? AND duration >= ? "
+                               f"ORDER BY {'duration, path' if order_by == 'duration' else 'path'}",
+                               (normpath(folder), min_duration))
+        return [clip_of(row) for row in rows]
+
+    def lookup(self, path: str):
+        """
+        Returns the clip (dict) of a video file, refreshing its folder first if the file is new or was modified
+        """
+
+        path, stat = join(normpath(split(path)[0]), split(path)[1]), os.stat(path)
+        row = self.db.execute("SELECT size, mtime_ns FROM clips WHERE path = ?", (path,)).fetchone()
+        if row != (stat.st_size, stat.st_mtime_ns):
+            if self.read_only:
+                raise LookupError(f"{path} was added or modified after the catalog was refreshed")
+            self.refresh(split(path)[0])
+        return clip_of(self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM clips WHERE path = ?", (path,)).fetchone())
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,244 @@
+import os
+from os.path import exists, join
+
+import tracing
+from render_profile import INTERMEDIATE_QUALITY, RenderProfile, target_size
+
+'''
+Blends the sub videos together, glitches the result and adds the song audio
+
+If cascade: one ffmpeg encode per blend / mash / glitch / mux step, with intermediate files in temp/
+If filter_graph: a single ffmpeg filter_complex graph doing every step in one decode and one encode
+
+Both can deliver several output targets (resolutions and aspect ratios, see render_profile.target_size) at once: the
+composited stream is split, then each branch is scaled, center cropped and encoded on its own in the same ffmpeg run
+'''
+
+BLEND = "blend='difference'"
+CHROMASHIFT = "chromashift=crv=-200:cbv=100:crh=100"
+
+
+def ffmpeg_settings(profile: RenderProfile = None):
+    """
+    returns the (input, codec, options) ffmpeg command parts (lists) used by the cascade, the codec encoding the
+    intermediate blends of profile (the final one by default)
+    """
+
+    profile = profile if profile else RenderProfile()
+    ffmpeg_cmd_in = ["ffpb", *profile.decode_args()]
+    ffmpeg_cmd_codec = profile.encode_args(INTERMEDIATE_QUALITY)
+    ffmpeg_cmd_opt = ["-hide_banner", "-loglevel", "warning", "-stats"]
+    return ffmpeg_cmd_in, ffmpeg_cmd_codec, ffmpeg_cmd_opt
+
+
+def cascade_paths(sub_vid_paths: list):
+    """
+    returns the intermediate *_blended.mp4 and *_mashed.mp4 paths (list) written by blend_cascade
+    """
+
+    blend_vid_paths = [path.replace("subVid", 'blended') for path in sub_vid_paths[1:]]
+    mashed_vid_paths = [path.replace("blended", 'mashed') for path in blend_vid_paths[1:]]
+    return blend_vid_paths + mashed_vid_paths
+
+
+def blend_cascade(sub_vid_paths: list, temp_path: str, song_name: str, profile: RenderProfile = None):
+    """
+    Blends sub videos pairwise into *_blended.mp4, then *_mashed.mp4, then _generated.mp4, every step being a separate
+    ffmpeg encode. Returns the _generated.mp4 path
+    """
+
+    ffmpeg_cmd_in, ffmpeg_cmd_codec, ffmpeg_cmd_opt = ffmpeg_settings(profile)
+    blend_vid_paths = [''] * (len(sub_vid_paths)-1)
+    mashed_vid_paths = [''] * (len(sub_vid_paths)-2)
+    generated_output_path = join(temp_path, f"{song_name}_generated.mp4")
+
+    count = 0
+    for i in reversed(range(len(sub_vid_paths)-1)):
+        count += 1
+        blend_vid_paths[i] = sub_vid_paths[i+1].replace("subVid", 'blended')
+        if sub_vid_paths and not exists(blend_vid_paths[i]):
+            print(f"Blending sub videos together {count}")
+            tracing.run([*ffmpeg_cmd_in, "-i", sub_vid_paths[i+1], "-i", sub_vid_paths[i], *ffmpeg_cmd_codec,
+                         "-filter_complex", BLEND, "-y", blend_vid_paths[i], *ffmpeg_cmd_opt], 'blend')
+            if i == 0 and len(blend_vid_paths) == 1:
+                os.rename(blend_vid_paths[0], generated_output_path)
+        if i < len(sub_vid_paths)-2 and not exists(mashed_vid_paths[i]):
+            print(f"Blending those blended videos together {count-1}")
+            mashed_vid_paths[i] = blend_vid_paths[i+1].replace("blended", 'mashed')
+            tracing.run([*ffmpeg_cmd_in, "-i", blend_vid_paths[i+1], "-i", blend_vid_paths[i], *ffmpeg_cmd_codec,
+                         "-filter_complex", BLEND, "-y", mashed_vid_paths[i], *ffmpeg_cmd_opt], 'blend')
+            if i == 0 and len(mashed_vid_paths) == 1:
+                os.rename(mashed_vid_paths[0], generated_output_path)
+        if i < len(sub_vid_paths)-3 and not exists(generated_output_path):
+            print(f"Mashing those blended videos together")
+            tracing.run([*ffmpeg_cmd_in, "-i", mashed_vid_paths[i+1], "-i", mashed_vid_paths[i], *ffmpeg_cmd_codec,
+                         "-filter_complex", BLEND, "-y", generated_output_path, *ffmpeg_cmd_opt], 'blend')
+
+    return generated_output_path
+
+
+def glitch(temp_path: str, song_name: str, profile: RenderProfile = None):
+    """
+    Chromashifts _generated.mp4 into _generated_final.mp4 to add pizazz. Returns the output path
+    """
+
+    profile = profile if profile else RenderProfile()
+    ffmpeg_cmd_in, _, ffmpeg_cmd_opt = ffmpeg_settings(profile)
+    temp_input_file = join(temp_path, f"{song_name}_generated.mp4")
+    temp_output_file = join(temp_path, f"{song_name}_generated_final.mp4")
+    if not exists(temp_output_file):
+        print(f"Glitching final result")
+        tracing.run([*ffmpeg_cmd_in, "-i", temp_input_file, "-vf", CHROMASHIFT, *profile.encode_args(),
+                     temp_output_file, *ffmpeg_cmd_opt], 'glitch')
+
+    return temp_output_file
+
+
+def mux(music_file_path: str, temp_path: str, song_name: str, profile: RenderProfile = None, targets: list = None):
+    """
+    Adds the song audio (its window for drafts) to _generated_final.mp4 in out/. Returns the output path, or the
+    output paths (list) of targets, decoded once and encoded to every target (see split_outputs) if given
+    """
+
+    # make temporary .aac file and add it to the mp4 video (.wav not supported directly)
+    profile = profile if profile else RenderProfile()
+    ffmpeg_cmd_in, _, ffmpeg_cmd_opt = ffmpeg_settings(profile)
+    temp_output_file = join(temp_path, f"{song_name}_generated_final.mp4")
+    output_paths = final_paths(temp_path, song_name, targets)
+    temp_audio_file = join(temp_path, f"{song_name}_temp.aac")
+    if not (all(exists(path) for path in output_paths) or exists(temp_audio_file)):
+        print(f"Copying Audio and adding it to video clip")
+        tracing.run([*ffmpeg_cmd_in, *profile.audio_window(), "-i", music_file_path, "-ab", profile.audio_bitrate,
+                     temp_audio_file, *ffmpeg_cmd_opt], 'audio')
+        os.makedirs(temp_path.replace("temp", 'out'), exist_ok=True)
+        if targets:
+            graph, outputs = split_outputs("0:v", targets, output_paths, profile, ["-map", "1:a:0", "-c:a", "copy"])
+            tracing.run([*ffmpeg_cmd_in, "-i", temp_output_file, "-i", temp_audio_file, "-filter_complex", graph,
+                         *outputs, *ffmpeg_cmd_opt], 'mux', targets=len(targets))
+        else:
+            tracing.run([*ffmpeg_cmd_in, "-i", temp_output_file, "-i", temp_audio_file, "-c", "copy", "-map", "0:v:0",
+                         "-map", "1:a:0", output_paths[0], *ffmpeg_cmd_opt], 'mux')
+
+    return output_paths if targets else output_paths[0]
+
+
+def cascade(sub_vid_paths: list, music_file_path: str, temp_path: str, song_name: str, profile: RenderProfile = None,
+            targets: list = None):
+    """
+    Blends sub videos pairwise into *_blended.mp4, then *_mashed.mp4, then _generated.mp4, glitches it into
+    _generated_final.mp4 and adds the audio, every step being a separate ffmpeg encode. Returns the output path, or
+    the output paths (list) of targets if given
+    """
+
+    blend_cascade(sub_vid_paths, temp_path, song_name, profile)
+    glitch(temp_path, song_name, profile)
+    return mux(music_file_path, temp_path, song_name, profile, targets)
+
+
+def final_path(temp_path: str, song_name: str, target=None):
+    """
+    returns the path of the finished music video (str) in out/, of its target (see render_profile.target_size) version
+    if given
+    """
+
+    size = "_{}x{}".format(*target_size(target)) if target else ""
+    return join(temp_path.replace("temp", 'out'), f"{song_name}_generated_final{size}.mp4")
+
+
+def final_paths(temp_path: str, song_name: str, targets: list = None):
+    """
+    returns the paths of the finished music videos (list) of targets, the single final_path without targets
+    """
+
+    return [final_path(temp_path, song_name, target) for target in targets] if targets \
+        else [final_path(temp_path, song_name)]
+
+
+def split_outputs(label: str, targets: list, output_paths: list, profile: RenderProfile, audio: list):
+    """
+    Returns the filter_complex (str) splitting the [label] stream into one branch per target, each scaled to cover the
+    target size then center cropped to it, and the ffmpeg output options (list) encoding every branch to its output
+    path with the audio options (ex: ["-map", "1:a:0", "-c:a", "copy"])
+    """
+
+    profile = profile.with_threads(profile.threads // len(targets))  # the encodes run side by side
+    filters = [f"[{label}]split={len(targets)}" + "".join(f"[s{i}]" for i in range(len(targets)))]
+    outputs = []
+    for i, (target, output_path) in enumerate(zip(targets, output_paths)):
+        width, height = target_size(target)
+        filters.append(f"[s{i}]scale={width}:{height}:force_original_aspect_ratio=increase,"
+                       f"crop={width}:{height},setsar=1[o{i}]")
+        outputs += ["-map", f"[o{i}]", *audio, *profile.encode_args(), "-y", output_path]
+    return ";".join(filters), outputs
+
+
+def blend_graph(count: int):
+    """
+    Returns the filter_complex (str) blending count video inputs the way the cascade does, then glitching the result
+
+    Each level blends every pair of neighbours of the previous one (subVid[i+1] over subVid[i]) until one stream is
+    left, streams feeding two blends are split first. The graph output is labelled [composite]
+    """
+
+    filters = []
+    level = [f"{i}:v" for i in range(count)]
+    depth = 0
+
+    while len(level) > 1:
+        tops, bottoms = [None] * len(level), [None] * len(level)
+        for i, label in enumerate(level):
+            if 0 < i < len(level) - 1:  # used by the blend below and the one above it
+                filters.append(f"[{label}]split[t{depth}_{i}][b{depth}_{i}]")
+                tops[i], bottoms[i] = f"t{depth}_{i}", f"b{depth}_{i}"
+            else:
+                tops[i] = bottoms[i] = label
+
+        depth += 1
+        level = [f"l{depth}_{i}" for i in range(len(level) - 1)]
+        for i, label in enumerate(level):
+            filters.append(f"[{tops[i + 1]}][{bottoms[i]}]{BLEND}[{label}]")
+
+    filters.append(f"[{level[0]}]{CHROMASHIFT}[composite]")
+    return ";".join(filters)
+
+
+def filter_graph(sub_vid_paths: list, music_file_path: str, temp_path: str, song_name: str, profile: RenderProfile = None,
+                 targets: list = None):
+    """
+    Blends, glitches and adds the audio in one ffmpeg run: one decode of each sub video and a single encode of
+    _generated_final.mp4 without intermediate files. Returns the output path
+
+    targets: output targets (see render_profile.target_size) all encoded from the one composited stream, the output
+        paths (list) being returned then
+    """
+
+    output_paths = final_paths(temp_path, song_name, targets)
+    if all(exists(path) for path in output_paths):
+        return output_paths if targets else output_paths[0]
+
+    profile = profile if profile else RenderProfile()
+    inputs = []
+    for path in sub_vid_paths:
+        inputs += [*profile.decode_args(), "-i", path]
+    inputs += [*profile.audio_window(), "-i", music_file_path]
+
+    audio = ["-map", f"{len(sub_vid_paths)}:a:0", "-c:a", "aac", "-b:a", profile.audio_bitrate]
+    if targets:
+        graph, outputs = split_outputs("composite", targets, output_paths, profile, audio)
+        graph = f"{blend_graph(len(sub_vid_paths))};{graph}"
+    else:
+        graph, outputs = blend_graph(len(sub_vid_paths)), ["-map", "[composite]", *audio, *profile.encode_args(),
+                                                           "-y", output_paths[0]]
+
+    print(f"Blending, glitching and adding audio to {len(sub_vid_paths)} sub videos in a single pass")
+    os.makedirs(temp_path.replace("temp", 'out'), exist_ok=True)
+    tracing.run(["ffpb", *inputs, "-filter_complex", graph, *outputs,
+                 "-hide_banner", "-loglevel", "warning", "-stats"], 'composite', targets=len(targets or ()))
+
+    return output_paths if targets else output_paths[0]
+
+
+COMPOSITORS = {
+    'cascade': cascade,
+    'filter_graph': filter_graph,
+}
@@ -0,0 +1,194 @@
+import os
+import json
+import math
+import bisect
+import random
+
+'''
+Edit decision list (EDL) of a sub video: which part of which clip goes where, with which effect and fade
+
+Planning is a pure function of its arguments and seed, the resulting dict only holds plain values so it can be
+saved as .json, sent to another process and rendered by any backend (moviepy or ffmpeg)
+
+If simple_vid: Simple, randomized, tempo synced video generation
+If smart_vid: Dynamic video generation - Intense sections of music will have faster visuals
+'''
+
+EDL_VERSION = 2
+FPS = 30  # frame rate of every rendered sub video
+
+HIGH_INTENSITY = [1, 1, 1, 4, 4, 4]
+MEDIUM_INTENSITY = [4, 4, 4, 4, 8, 8, 8, 16]
+LOW_INTENSITY = [8, 8, 8, 16, 16, 16, 16]
+
+
+def plan_edl(bpm: float, start: float, finish: float, duration: float, intensities: dict, dynamic: str,
+             footage: list, titles: list, seed=None, snap: bool = False):
+    """
+    Returns the clips [{path, start, end, effect, fx, title}, ...] of a simple or smart movie synced to a song
+
+    bpm (int / float): beats per minute tempo of the song
+    start: first downbeat
+    finish: last downbeat
+    duration: total duration
+    intensities (dict): {4barCount(int):intensity(str)}, see generate_timestamps.get_intensities
+    dynamic (str): 'simple_vid' or 'smart_vid'
+    footage (list): clips to use [{'path': str, 'duration': float, 'effect': str, 'keyframes': list}, ...]
+    titles (list): paths of the long clips used for intro / outro
+    seed: same seed and arguments => same clips
+    snap: clips start on a key frame of their video (on the first frame from it) when one leaves room for the slot,
+        so that renders copy them instead of encoding them again (see ffmpeg_render.stream_copyable)
+    """
+
+    rng = random.Random(seed)
+    length_of_a_beat = 60 / bpm   # time between beats
+    clips = []
+
+    # sorted duration index: the clips long enough for a slot are a suffix of it, found by bisection
+    footage = sorted(footage, key=lambda video: (video['duration'], video['path']))
+    durations = [video['duration'] for video in footage]
+
+    # black screen on start
+    if 0 < start < 4:
+        clips.append({'path': rng.choice(titles), 'start': 0, 'end': start,
+                      'effect': 'none', 'fx': 'black', 'title': True})
+
+    # ambient intro on start
+    elif start > 0:
+        clips.append({'path': rng.choice(titles), 'start': 0, 'end': start,
+                      'effect': 'none', 'fx': 'fadein', 'title': True})
+
+    new4_bar_block = True  # outlines every 4 bars to switch up speeds
+    current4_bar_block = 0  # current 4 bar block to pull intensities from
+    fade_out = False  # used to fade out before a drop
+    beats = 0  # current beats planned
+
+    while start < finish if dynamic == 'simple_vid' else beats < (len(intensities) * 16):
+
+        # switch up video rate every 4 bars
+        if beats % 16 == 0:
+            new4_bar_block = True
+
+        if new4_bar_block:
+
+            # simple video case (static video selection) #
+            if dynamic == 'simple_vid':
+                i = rng.choice([1, 4, 4, 4, 8, 8, 16, 16, 16])  # random rate of change of the videos
+
+            # smart video case (dynamic video selection) #
+            elif dynamic == 'smart_vid':
+                if intensities[current4_bar_block] == "High":
+                    # If the previous section was low and this one is high, make it speedy by default
+                    if current4_bar_block > 0 and intensities[current4_bar_block - 1] == "Low":
+                        i = 1
+                    else:
+                        i = rng.choice(HIGH_INTENSITY)
+                elif intensities[current4_bar_block] == "Medium":
+                    i = rng.choice(MEDIUM_INTENSITY)
+                else:
+                    try:
+                        # Check next section is a "drop"
+                        if intensities[current4_bar_block + 1] == "High":
+                            i = 16
+                            fade_out = True
+                        else:
+                            i = rng.choice(LOW_INTENSITY)
+                    except KeyError:
+                        i = rng.choice(LOW_INTENSITY)
+                current4_bar_block += 1
+
+        # uniform draw among the videos long enough for the slot
+        shortest = bisect.bisect_left(durations, length_of_a_beat * i)
+        if shortest == len(footage):
+            raise ValueError(f"no video lasts {length_of_a_beat * i:.2f}s ({i} beats at {bpm} bpm)")
+        video = footage[rng.randrange(shortest, len(footage))]
+        # the slot length is set by the beat, the start in the video is free: snapping it keeps the cut on the beat
+        keyframes = [time for time in video.get('keyframes', ()) if time <= video['duration'] - length_of_a_beat * i] \
+            if snap else []
+        if keyframes:
+            video_start = first_frame(rng.choice(keyframes), FPS) / FPS
+        else:
+            video_start = rng.randint(0, math.floor(video['duration'] - length_of_a_beat * i))  # random video part
+
+        clips.append({'path': video['path'], 'start': video_start, 'end': video_start + length_of_a_beat * i,
+                      'effect': video['effect'], 'fx': 'fadeout' if fade_out else None,  # fadeout before a drop
+                      'title': False})
+        fade_out = False
+
+        start += (length_of_a_beat * i)
+        beats += i
+        new4_bar_block = False
+
+    # Ambient outro
+    if start < duration:
+        clips.append({'path': rng.choice(titles), 'start': 0, 'end': duration - start,
+                      'effect': 'none', 'fx': 'fadeout_half', 'title': True})
+
+    return clips
+
+
+def first_frame(time: float, fps: float):
+    """
+    returns the index (int) of the first frame shown at or after time (float) in seconds
+    """
+
+    return math.ceil(time * fps - 1e-6)  # tolerance for float sums landing just past a frame
+
+
+def split_edl(edl: dict, chunks: int):
+    """
+    Splits an edit decision list at clip boundaries into at most chunks lists (dict) of similar durations
+
+    Each chunk keeps the position of its first clip on the whole timeline (timeline_start), so that renderers place
+    its frames exactly where a render of the whole list would, and is saved to its own _chunk{n} file
+    """
+
+    durations = [clip['end'] - clip['start'] for clip in edl['clips']]
+    total = sum(durations)
+    groups, position, timeline_start = [[]], 0, [edl.get('timeline_start', 0)]
+    for clip, duration in zip(edl['clips'], durations):
+        if groups[-1] and position >= total * len(groups) / chunks:
+            groups.append([])
+            timeline_start.append(edl.get('timeline_start', 0) + position)
+        groups[-1].append(clip)
+        position += duration
+
+    if len(groups) == 1:
+        return [edl]
+    base_path, extension = os.path.splitext(edl['output_path'])
+    return [dict(edl, clips=clips, timeline_start=start, output_path=f"{base_path}_chunk{n}{extension}")
+            for n, (clips, start) in enumerate(zip(groups, timeline_start))]
+
+
+def window_edl(edl: dict, start: float, end: float):
+    """
+    Returns the edit decision list (dict) of the part of the timeline from start to end seconds, the clips crossing
+    either bound being trimmed. Its timeline_start is start, so cuts and frames stay where they are in the whole list
+    """
+
+    clips, position = [], edl.get('timeline_start', 0)
+    for clip in edl['clips']:
+        duration = clip['end'] - clip['start']
+        first, last = max(start, position), min(end, position + duration)
+        if first < last:
+            clips.append(dict(clip, start=clip['start'] + first - position, end=clip['start'] + last - position))
+        position += duration
+    return dict(edl, clips=clips, timeline_start=max(start, edl.get('timeline_start', 0)))
+
+
+def save_edl(edl: dict, edl_path: str):
+    """
+    Saves an edit decision list (dict) as .json
+    """
+
+    with open(edl_path, "w") as file:
+        json.dump(edl, file, indent=1)
+
+
+def load_edl(edl_path: str):
+    """
+    Reads an edit decision list (dict) saved by save_edl
+    """
+
+    with open(edl_path, "r") as file:
+        return json.load(file)
@@ -0,0 +1,168 @@
+import os
+import shutil
+from os.path import join, splitext, exists
+
+import tracing
+from edl import first_frame
+from tools import EFFECTS
+from render_profile import RenderProfile
+from segment_cache import SegmentCache, segment_key
+
+'''
+Renders an edit decision list (see edl.py) with ffmpeg only: no frame goes through python
+
+Every clip is cut, scaled, coloured / mirrored and faded into its own segment with identical codec settings,
+then the segments are joined by the concat demuxer without re-encoding. Clips read from a proxy without effect or fade
+and starting on one of its key frames are copied from it instead, the proxy being encoded with the same settings.
+Segments are kept in a segment cache when the edit decision list names one (segment_dir), see segment_cache.py
+'''
+
+# ffmpeg equivalents of the operations of tools.EFFECTS, run on the decoded frames of the segment
+OPERATION_FILTERS = {
+    'swap_green_blue': "colorchannelmixer=gg=0:gb=1:bg=1:bb=0",
+    'mirror_x': "hflip",
+    'mirror_y': "vflip",
+}
+EFFECT_FILTERS = {effect: [OPERATION_FILTERS[operation] for operation in operations]
+                  for effect, operations in EFFECTS.items()}
+
+
+def fx_filters(fx: str, duration: float):
+    """
+    returns the ffmpeg filters of a clip fx (black screen or fades) lasting duration seconds
+    """
+
+    if fx == 'black':
+        return ["drawbox=color=black:t=fill"]
+    elif fx == 'fadein':
+        return [f"fade=t=in:st=0:d={duration / 2}"]
+    elif fx == 'fadeout':
+        return [f"fade=t=out:st={duration * 3 / 4}:d={duration / 4}"]
+    elif fx == 'fadeout_half':
+        return [f"fade=t=out:st={duration / 2}:d={duration / 2}"]
+    return []
+
+
+def frame_counts(clips: list, fps: float, position: float = 0):
+    """
+    returns the number of frames (int) of each clip, counted on the whole timeline so that the cuts don't drift
+    """
+
+    counts = []
+    for clip in clips:
+        end = position + clip['end'] - clip['start']
+        counts.append(first_frame(end, fps) - first_frame(position, fps))
+        position = end
+    return counts
+
+
+def segment_command(clip: dict, frames: int, resolution, fps: float, output_path: str, profile: RenderProfile = None):
+    """
+    returns the ffmpeg command (list) rendering frames frames of a clip from the edit decision list, encoded as the
+    intermediate files of profile (the final one by default)
+    """
+
+    profile = profile if profile else RenderProfile(resolution=resolution)
+
+    width, height = int(int(resolution) * (16 / 9)), int(resolution)
+    filters = [f"scale={width}:{height}", "setsar=1", f"fps={fps}", *EFFECT_FILTERS[clip['effect']],
+               *fx_filters(clip['fx'], frames / fps),
+               "tpad=stop=-1:stop_mode=clone"]  # clips too short for their slot hold their last frame
+
+    return ["ffmpeg", *profile.decode_args(), "-ss", str(clip['start']), "-i", clip['path'], "-vf", ",".join(filters),
+            "-frames:v", str(frames), "-an", *profile.intermediate_args(fps), "-pix_fmt", "yuv420p", "-y",
+            output_path, "-hide_banner", "-loglevel", "error"]
+
+
+def stream_copyable(clip: dict):
+    """
+    returns True if the segment of a clip can be copied from the file it reads: a proxy (see
+    proxies.ProxyCache.use_proxies) on one of whose key frames it starts, without effect nor fade
+    """
+
+    return bool(clip.get('keyframe')) and not EFFECT_FILTERS[clip['effect']] and not clip['fx']
+
+
+def copy_command(clip: dict, frames: int, fps: float, output_path: str):
+    """
+    returns the ffmpeg command (list) copying frames frames of a stream_copyable clip into a segment, from the key frame
+    it starts on
+    """
+
+    # half a frame after the start: rounding can't seek to the key frame before it
+    return ["ffmpeg", "-ss", str(clip['start'] + 0.5 / fps), "-i", clip['path'], "-frames:v", str(frames), "-an",
+            "-c:v", "copy", "-avoid_negative_ts", "make_zero", "-y", output_path, "-hide_banner", "-loglevel", "error"]
+
+
+def concat(segment_paths: list, output_path: str):
+    """
+    joins segments rendered with identical settings into output_path without re-encoding them
+    """
+
+    list_path = splitext(output_path)[0] + "_segments.txt"
+    with open(list_path, "w") as file:
+        for path in segment_paths:
+            file.write(f"file '{os.path.abspath(path)}'\n")
+    tracing.run(["ffmpeg", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", "-y", output_path,
+                 "-hide_banner", "-loglevel", "error"], 'concat')
+    os.remove(list_path)
+
+
+def render_segments(edl: dict, segments_path: str, counts: dict):
+    """
+    Yields the (path, frames) of the segments of an edit decision list in timeline order, each one being rendered (or
+    copied, see stream_copyable) when it's reached, so that it can be used before the next ones are
+
+    Segments are read from and added to the cache of edl['segment_dir'] if set, rendered to segments_path otherwise.
+    counts {'copied', 'encoded', 'cached'} (dict) is increased for every segment
+    """
+
+    profile = RenderProfile.of(edl)
+    cache = SegmentCache(edl['segment_dir']) if edl.get('segment_dir') else None
+    encoding = profile.with_threads(1).intermediate_args(edl['fps'])  # threads don't change the frames
+    if not cache:
+        os.makedirs(segments_path, exist_ok=True)
+
+    frames_per_clip = frame_counts(edl['clips'], edl['fps'], edl.get('timeline_start', 0))
+    for i, (clip, frames) in enumerate(zip(edl['clips'], frames_per_clip)):
+        if frames <= 0:
+            continue
+        copy = stream_copyable(clip)
+        if cache:
+            key = segment_key(clip, frames, edl['resolution'], edl['fps'], ["copy"] if copy else encoding)
+            cached_path = cache.get(key)
+            if cached_path:
+                counts['cached'] += 1
+                yield cached_path, frames
+                continue
+            output_path = cache.temp_path(key)
+        else:
+            output_path = join(segments_path, f"{i:05d}.mp4")
+
+        if copy:
+            tracing.run(copy_command(clip, frames, edl['fps'], output_path), 'segment copy')
+            counts['copied'] += 1
+        else:
+            tracing.run(segment_command(clip, frames, edl['resolution'], edl['fps'], output_path, profile), 'segment')
+            counts['encoded'] += 1
+        yield (cache.put(key, output_path) if cache else output_path), frames
+
+
+def render_edl(edl: dict):
+    """
+    Saves the movie described by an edit decision list (see make_sub_movies.plan_sub_movie) with ffmpeg, returns the
+    number of segments copied, encoded and found in the segment cache {'copied': int, 'encoded': int, 'cached': int}
+
+    Segments are read from and added to the cache of edl['segment_dir'] if set, rendered to a temporary folder otherwise
+    """
+
+    print(f"Generating video {os.path.split(edl['output_path'])[1]}")
+    with tracing.span(os.path.split(edl['output_path'])[1], 'sub video', backend='ffmpeg', clips=len(edl['clips']),
+                      encoder=RenderProfile.of(edl).encoder) as values:
+        segments_path = splitext(edl['output_path'])[0] + "_segments"
+        counts = {'copied': 0, 'encoded': 0, 'cached': 0}
+        concat([path for path, _ in render_segments(edl, segments_path, counts)], edl['output_path'])
+        if exists(segments_path):
+            shutil.rmtree(segments_path)
+        values.update(counts)
+    return counts
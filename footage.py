@@ -0,0 +1,86 @@
+import random
+from collections import OrderedDict
+
+from catalog import FootageCatalog
+from tools import open_clip, random_effect
+
+'''
+Footage library: metadata of every clip up front, video readers only when frames are needed
+
+Each VideoFileClip keeps an ffmpeg reader process and its buffers alive, opening all of them up front runs out of file
+descriptors and memory on large libraries. The pool keeps at most max_open readers running, the least recently used
+one is stopped when another one is needed and restarted on the next frame asked to it
+'''
+
+MAX_OPEN_READERS = 16
+
+
+class FootagePool:
+    """
+    Opens clips on demand with at most max_open ffmpeg readers running at once
+
+    resolution (str): desired output resolution (ex: 1080 or 720)
+    footage (list): clip metadata [{'path', 'duration', 'width', 'height', 'fps', 'codec', 'effect'}, ...]
+    max_open (int): maximum number of running readers
+    """
+
+    def __init__(self, resolution, footage: list = (), max_open: int = MAX_OPEN_READERS):
+        self.resolution = resolution
+        self.footage = list(footage)
+        self.max_open = max_open
+        self.sources = {}  # (path, effect, resized) => VideoFileClip owning the reader
+        self.clips = {}  # (path, effect, resized) => clip given out, keeping its reader in use
+        self.running = OrderedDict()  # keys of the clips whose reader runs, least recently used first
+
+    @classmethod
+    def scan(cls, videos_path: str, resolution, seed=None, max_open: int = MAX_OPEN_READERS, catalog=None):
+        """
+        Reads the metadata of every video file of a folder from a FootageCatalog (the project one by default), the same
+        seed gives every file the same random effect
+        """
+
+        print('Scanning videos from video path "{}"'.format(videos_path))
+        clips = (catalog if catalog else FootageCatalog.of(videos_path)).refresh(videos_path)
+        rng = random.Random(seed) if seed is not None else random
+        footage = []
+        for clip in clips:
+            # seed to randomise individual videos orientation / colour to give illusion of change between videos
+            footage.append(dict(clip, effect=random_effect(rng)))
+        return cls(resolution, footage, max_open)
+
+    def open(self, path: str, effect: str = 'none', resized: bool = True):
+        """
+        Returns the clip of a video file with an effect, at the pool resolution if resized, sharing its reader
+        """
+
+        from moviepy.editor import VideoFileClip  # readers are only opened by the moviepy render backend
+
+        key = path, effect, resized
+        if key not in self.clips:
+            self.sources[key] = open_clip(path, self.resolution, effect) if resized \
+                else VideoFileClip(path, audio=False)
+            # every frame request marks the reader as recently used (clips with an effect share the file reader)
+            self.clips[key] = self.sources[key].fl(lambda get_frame, t: self._use(key, t) or get_frame(t))
+        return self.clips[key]
+
+    def _use(self, key, t: float):
+        reader = self.sources[key].reader
+        if reader.proc is None:
+            # moviepy would restart it with a seek to t, landing on the next frame when t falls between two frames:
+            # seek to the start of the frame shown at t instead, so frames don't depend on when readers were stopped
+            reader.pos = int(reader.fps * t + 0.00001) + 1
+            reader.initialize((reader.pos - 1) / reader.fps)
+            reader.lastread = reader.read_frame()
+
+        self.running[key] = True
+        self.running.move_to_end(key)
+        while len(self.running) > self.max_open:
+            evicted, _ = self.running.popitem(last=False)
+            self.sources[evicted].reader.close()
+
+    def close(self):
+        for clip in self.sources.values():
+            clip.close()
+        self.sources.clear()
+        self.clips.clear()
+        self.running.clear()
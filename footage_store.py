@@ -0,0 +1,150 @@
+import os
+import json
+import shutil
+import subprocess
+from os.path import join, exists
+
+from tools import probe_video, save_json
+from song_analysis import file_hash
+
+'''
+Content-addressed footage store: every downloaded video is kept once, whatever the number of queries it was found for
+
+Videos are stored under .store/objects/ named after the sha256 of their bytes, query folders get hard links to them
+(copies where the file system has no hard links). The provider id of each video (pexels:123) is indexed so a video
+already in the store is linked without being downloaded again, and a perceptual hash of a few frames spots the same
+clip re-encoded by another provider
+'''
+
+STORE_VERSION = 1
+PHASH_POSITIONS = (0.2, 0.4, 0.6, 0.8)  # relative times of the frames hashed
+NEAR_DUPLICATE_BITS = 6  # mean number of differing bits (out of 64 per frame) under which two videos are the same clip
+FLAT_CONTRAST = 24  # grey levels between the darkest and lightest pixels of a frame under which its hash is meaningless
+
+
+def default_store_dir(output_dir: str):
+    """
+    returns output_dir/.store, on the same file system as the query folders so that they can hold hard links
+    """
+
+    return join(output_dir, '.store')
+
+
+def perceptual_hash(path: str):
+    """
+    Returns the difference hashes [int, ...] (64 bits each) of a few frames of a video, robust to scaling and encoding.
+    Frames too flat to tell apart (black, fades) are None
+    """
+
+    duration = probe_video(path)['duration']
+    hashes = []
+    for position in PHASH_POSITIONS:
+        pixels = subprocess.run(["ffmpeg", "-ss", str(duration * position), "-i", path, "-frames:v", "1",
+                                 "-vf", "scale=9:8,format=gray", "-f", "rawvideo", "-", "-loglevel", "error"],
+                                check=True, capture_output=True).stdout
+        if max(pixels) - min(pixels) < FLAT_CONTRAST:
+            hashes.append(None)
+            continue
+        bits = [pixels[row * 9 + x] > pixels[row * 9 + x + 1] for row in range(8) for x in range(8)]
+        hashes.append(sum(bit << i for i, bit in enumerate(bits)))
+    return hashes
+
+
+def hash_distance(hashes: list, other_hashes: list):
+    """
+    Returns the mean number of differing bits (float) between the perceptual hashes of two videos, infinite when less
+    than half of their frames can be compared
+    """
+
+    distances = [bin(a ^ b).count('1') for a, b in zip(hashes, other_hashes) if a is not None and b is not None]
+    return sum(distances) / len(distances) if len(distances) >= len(hashes) / 2 else float('inf')
+
+
+class FootageStore:
+    """
+    Videos stored once by content, with an index of provider ids and perceptual hashes (index.json)
+
+    root (str): store folder, created if needed
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = join(root, 'index.json')
+        self.index = {'version': STORE_VERSION, 'sources': {}, 'objects': {}}
+        if exists(self.index_path):
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+            if index.get('version') == STORE_VERSION:
+                self.index = index
+
+    @classmethod
+    def of(cls, output_dir: str):
+        """
+        Opens the default store of a download folder (see default_store_dir)
+        """
+
+        return cls(default_store_dir(output_dir))
+
+    def _save(self):
+        save_json(self.index_path, self.index)
+
+    def object_path(self, content_hash: str):
+        return join(self.root, 'objects', f"{content_hash}.mp4")
+
+    def incoming_path(self, source: str):
+        """
+        Returns where to download the video of a source (provider:id) before it is added to the store
+        """
+
+        return join(self.root, 'incoming', f"{source.replace(':', '_')}.mp4")
+
+    def link_source(self, source: str, file_path: str):
+        """
+        Links the stored video of a source (provider:id) to file_path, returns False if the store doesn't have it
+        """
+
+        content_hash = self.index['sources'].get(source)
+        if content_hash is None or not exists(self.object_path(content_hash)):
+            return False
+        self._link(content_hash, file_path)
+        return True
+
+    def add(self, download_path: str, source: str, file_paths: list):
+        """
+        Moves a downloaded video into the store (or drops it if the same or a near identical video is already there),
+        then links it to file_paths. Returns the content hash (str) of the stored video
+        """
+
+        content_hash = file_hash(download_path)
+        objects = self.index['objects']
+        if content_hash not in objects:
+            hashes = perceptual_hash(download_path)
+            near = next((other for other, entry in objects.items()
+                         if hash_distance(hashes, entry['phash']) <= NEAR_DUPLICATE_BITS), None)
+            if near:
+                print(f"{source} is a near duplicate of {', '.join(objects[near]['sources'])}, keeping the stored one")
+                content_hash = near
+            else:
+                os.makedirs(join(self.root, 'objects'), exist_ok=True)
+                os.replace(download_path, self.object_path(content_hash))
+                objects[content_hash] = {'size': os.path.getsize(self.object_path(content_hash)), 'phash': hashes,
+                                         'sources': []}
+        if exists(download_path):
+            os.remove(download_path)
+
+        if source not in objects[content_hash]['sources']:
+            objects[content_hash]['sources'].append(source)
+        self.index['sources'][source] = content_hash
+        self._save()
+        for file_path in file_paths:
+            self._link(content_hash, file_path)
+        return content_hash
+
+    def _link(self, content_hash: str, file_path: str):
+        if exists(file_path):
+            return
+        os.makedirs(os.path.dirname(file_path) or os.curdir, exist_ok=True)
+        try:
+            os.link(self.object_path(content_hash), file_path)
+        except OSError:  # no hard links on this file system
+            shutil.copyfile(self.object_path(content_hash), file_path)
@@ -1,10 +1,14 @@
 import os
 import sys
 import csv
-import librosa
+import math
+import numpy as np
 
 from tinytag import TinyTag
-from scipy.io.wavfile import read
+
+import beats
+
+BLOCK_SIZE = 1 << 20  # samples analysed at once, bounds the memory used whatever the song length
 
 
 def get_duration(music_file_path: str):
@@ -15,41 +19,112 @@ def get_duration(music_file_path: str):
     return TinyTag.get(music_file_path).duration
 
 
-def guess_first_and_last_down_beat(music_file_path: str):
+def open_wav(music_file_path: str):
     """
-    Reads a .wav audio file (str) and guesses the timestamp of first and last downbeats (float,float) in seconds
+    Opens a .wav audio file (str) without loading it: returns (sample rate, samples as a (frames, channels) np.ndarray)
+
+    The samples are memory-mapped, mono_blocks then reads them block by block, whatever the song length
     """
 
-    _, data = read(music_file_path)
-    data = data[:, 0]  # one stereo channel for ease
-    highest_db = max(data)
-    count, count2 = 0, 0
+    from scipy.io.wavfile import read  # scipy.io takes longer to import than the rest of the analysis
 
-    # find first downbeat
-    for count, point in enumerate(data):
-        if point >= (highest_db / 1.5):  # > 0 to avoid noise / ambience
-            break
+    try:
+        rate, data = read(music_file_path, mmap=True)
+    except ValueError:  # 24 bit and other non byte aligned files can't be memory-mapped
+        rate, data = read(music_file_path)
+    return rate, data.reshape(len(data), -1)  # mono files as a single channel
 
-    # find last downbeat
-    for count2, point in enumerate(data[::-1]):
-        if point >= (highest_db / 1.5):  # > 0 to avoid noise / ambience
-            break
 
-    duration = get_duration(music_file_path)
+def full_scale(data: np.ndarray):
+    """
+    returns the value (float) of a full scale sample of data once centred on 0 (see zero_level), 1 for float samples
+    """
 
-    return (count / len(data)) * duration, ((len(data) - count2) / len(data)) * duration
+    return 2 ** (data.dtype.itemsize * 8 - 1) if data.dtype.kind in 'iu' else 1
 
 
-def get_timestamps(music_file_path: str, bpm: float):
+def zero_level(data: np.ndarray):
+    """
+    returns the value (int) of a silent sample of data: 128 for unsigned 8 bit samples, 0 for signed and float ones
     """
-    Returns a list [float, float, ...] of the timestamps of all the 4 bar regions in the song
 
-    Parameters:
-    - bpm (the tempo (beats per minute) of the song)
+    return 2 ** (data.dtype.itemsize * 8 - 1) if data.dtype.kind == 'u' else 0
+
+
+def read_block(data: np.ndarray, start: int, stop: int):
+    """
+    Returns data[start:stop], read from the file when data is memory-mapped so that the pages don't stay resident
+    """
+
+    if not isinstance(data, np.memmap):
+        return data[start:stop]
+    frames = np.fromfile(data.filename, dtype=data.dtype, count=(stop - start) * data.shape[1],
+                         offset=data.offset + start * data.strides[0])
+    return frames.reshape(-1, data.shape[1])
+
+
+def mono_blocks(data: np.ndarray, first: int = 0, last: int = None, reverse: bool = False):
+    """
+    Yields (offset(int), samples(np.ndarray)) of fixed size blocks of data[first:last], channels mixed down to mono and
+    centred on 0
+    """
+
+    last = len(data) if last is None else last
+    offsets = range(first, last, BLOCK_SIZE)
+    for offset in reversed(offsets) if reverse else offsets:
+        samples = read_block(data, offset, min(offset + BLOCK_SIZE, last)).mean(axis=1, dtype=np.float64)
+        if data.dtype.kind == 'u':
+            samples -= zero_level(data)
+        yield offset, samples
+
+
+def first_count_reaching(ratio: float, length: int):
+    """
+    Returns the lowest count (int) for which count / length >= ratio, without walking every sample
+    """
+
+    count = max(math.ceil(ratio * length), 0)
+    # float rounding of ratio * length can be off by one either way
+    while count > 0 and (count - 1) / length >= ratio:
+        count -= 1
+    while count / length < ratio:
+        count += 1
+    return count
+
+
+def onset_envelope(sr: int, data: np.ndarray):
+    """
+    returns the onset envelope (flux, rms, fps) of (frames, channels) samples, see beats.onset_envelope
+    """
+
+    return beats.onset_envelope(mono_blocks(data), sr, full_scale(data))
+
+
+def guess_beat_grid(music_file_path: str, bpm: float = None):
+    """
+    Reads a .wav audio file (str) and returns its beat grid {'bpm', 'beats', 'downbeats', 'start', 'finish'} in
+    seconds (see beats.beat_grid), the bpm being guessed if not given
+    """
+
+    flux, rms, fps = onset_envelope(*open_wav(music_file_path))
+    bpm = float(bpm) if bpm else beats.estimate_tempo(flux, fps)
+    return beats.beat_grid(flux, rms, fps, bpm, get_duration(music_file_path))
+
+
+def guess_first_and_last_down_beat(music_file_path: str, bpm: float = None):
+    """
+    Reads a .wav audio file (str) and guesses the timestamp of first and last downbeats (float,float) in seconds
+    """
+
+    grid = guess_beat_grid(music_file_path, bpm)
+    return grid['start'], grid['finish']
+
+
+def timestamps_between(start: float, finish: float, bpm: float):
+    """
+    Returns a list [float, float, ...] of the timestamps of all the 4 bar regions from the first to the last downbeat
     """
 
-    # estimated guess of first and last beat in song
-    start, finish = guess_first_and_last_down_beat(music_file_path)
     length_of_a_beat = 1 / (bpm / 60)
     timestamps = [start]
 
@@ -60,75 +135,71 @@ def get_timestamps(music_file_path: str, bpm: float):
     return timestamps
 
 
-def get_counts_in_4_bars(music_file_path: str, bpm: float):
+def get_timestamps(music_file_path: str, bpm: float):
     """
-    returns the number of data points in 4 bars of a file for downstream works
+    Returns a list [float, float, ...] of the timestamps of all the 4 bar regions in the song
+
+    Parameters:
+    - bpm (the tempo (beats per minute) of the song)
     """
 
-    _, data = read(music_file_path)
-    data = data[:, 0]  # one stereo channel for ease
+    # first and last downbeat of the beat grid of the song
+    start, finish = guess_first_and_last_down_beat(music_file_path, bpm)
+    return timestamps_between(start, finish, bpm)
 
-    length = len(data)
-    duration = get_duration(music_file_path)
+
+def counts_in_4_bars(length: int, duration: float, bpm: float):
+    """
+    returns the number of data points (int) in 4 bars of a song made of length samples, None if the song is shorter
+    """
 
     length_of_a_beat = 1 / (bpm / 60)
     length_of_16_beats = length_of_a_beat * 16  # 4 bars
 
-    # find how many counts in 16 beats
-    for count, point in enumerate(data):
-        if count / length >= length_of_16_beats / duration:
-            return count
+    count = first_count_reaching(length_of_16_beats / duration, length)
+    return count if count < length else None
 
 
-def get_intensities(music_file_path: str, bpm: float):
+def get_counts_in_4_bars(music_file_path: str, bpm: float):
     """
-    Returns {4barCount(int):intensity(str)} for each 4 bar segment in the given .wav file
-
-    Intensities = "Low","Medium","High
+    returns the number of data points in 4 bars of a file for downstream works
     """
 
-    duration = get_duration(music_file_path)
-    start, finish = guess_first_and_last_down_beat(music_file_path)
-    counts_in_4_bars = get_counts_in_4_bars(music_file_path, bpm)
-
-    intensities = {}
-
-    # analyse waveform
-    _, data = read(music_file_path)
+    _, data = open_wav(music_file_path)
+    return counts_in_4_bars(len(data), get_duration(music_file_path), bpm)
 
-    # one stereo channel for ease
-    data = data[:, 0]
 
-    length = len(data)
-
-    count_ = 0
-    sum_ = float(0)
-    bar_block = 0  # current index of 4 bar block
+def block_averages(data: np.ndarray, first: int, last: int, block_length: int):
+    """
+    Returns the mean absolute amplitude (np.ndarray) of every complete block of block_length samples in data[first:last]
+    """
 
-    for count, point in enumerate(data):
-        if start / duration <= count / length <= finish / duration:  # only calculate between first and last downbeat
+    blocks = (max(last - first, 0)) // block_length
+    sums = np.zeros(blocks)
 
-            count_ += 1
-            sum_ += float(abs(point))  # absolute value because deviation from 0 (no volume) is what is important
+    for offset, samples in mono_blocks(data, first, first + blocks * block_length):
+        # a read block can straddle several 4 bar blocks: sum each part into the 4 bar block it belongs to
+        position = offset - first
+        boundaries = np.arange(-position % block_length, len(samples), block_length)
+        if not len(boundaries) or boundaries[0] != 0:
+            boundaries = np.insert(boundaries, 0, 0)
+        sums[(position + boundaries) // block_length] += np.add.reduceat(np.abs(samples), boundaries)
 
-            if sum_ < 0:
-                sys.exit()
+    return sums / block_length
 
-            # calculate and save average every 4 bars
-            if count_ >= counts_in_4_bars:
-                intensities[bar_block] = sum_ / count_
 
-                count_ = 0
-                sum_ = float(0)
-                bar_block += 1
+def classify_intensities(averages):
+    """
+    Returns {4barCount(int):intensity(str)} from the average amplitude of each 4 bar block, relative to the loudest one
+    """
 
-    max_average_value = max(intensities.values())
+    max_average_value = max(averages)
+    intensities = {}
 
-    # all intensities are relative to one another
-    for key in intensities.keys():
-        if intensities[key] > 0.96 * max_average_value:
+    for key, average in enumerate(averages):
+        if average > 0.96 * max_average_value:
             intensities[key] = "High"
-        elif intensities[key] > 0.65 * max_average_value:
+        elif average > 0.65 * max_average_value:
             intensities[key] = "Medium"
         else:
             intensities[key] = "Low"
@@ -136,6 +207,36 @@ def get_intensities(music_file_path: str, bpm: float):
     return intensities
 
 
+def intensities_of(data: np.ndarray, duration: float, bpm: float, start: float, finish: float):
+    """
+    Returns {4barCount(int):intensity(str)} for each 4 bar segment of (frames, channels) samples (np.ndarray) from the
+    first downbeat (start) to the last (finish) in seconds
+    """
+
+    length = len(data)
+
+    # only calculate between first and last downbeat
+    first = first_count_reaching(start / duration, length)
+    last = first_count_reaching(np.nextafter(finish / duration, np.inf), length)
+
+    averages = block_averages(data, first, last, counts_in_4_bars(length, duration, bpm))
+
+    # all intensities are relative to one another
+    return classify_intensities(averages.tolist())
+
+
+def get_intensities(music_file_path: str, bpm: float):
+    """
+    Returns {4barCount(int):intensity(str)} for each 4 bar segment in the given .wav file
+
+    Intensities = "Low","Medium","High
+    """
+
+    start, finish = guess_first_and_last_down_beat(music_file_path, bpm)
+    _, data = open_wav(music_file_path)
+    return intensities_of(data, get_duration(music_file_path), float(bpm), start, finish)
+
+
 def save_intensities(music_file_path: str, intensities: dict):
     """
     Saves intensities from get_intensities(filename, bpm) as .csv
@@ -162,11 +263,12 @@ def save_intensities(music_file_path: str, intensities: dict):
 def guess_bpm(music_file_path: str):
     """
     Reads a .wav file and returns an estimate of the bpm, If bpm is known it should be entered manually for best results
+
+    Only a few excerpts of the song are analysed (see beats.fast_tempo)
     """
 
-    y, sr = librosa.load(music_file_path)
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    tempo = round(librosa.feature.tempo(onset_envelope=onset_env, sr=sr)[0], 1)
+    sr, data = open_wav(music_file_path)
+    tempo = beats.fast_tempo(lambda first, last: mono_blocks(data, first, last), len(data), sr, full_scale(data))
     print(f"Estimated tempo of '{os.path.split(music_file_path)[1]}' = {tempo}")
     return tempo
 
@@ -1,190 +1,250 @@
+import os
+import sys
 import math
 import random
+import contextlib
 import concurrent.futures
 from os.path import join, split, splitext
 
-from moviepy.editor import *
+import tracing
+from footage import FootagePool
+from catalog import FootageCatalog
+from proxies import ProxyCache
+from segment_cache import SegmentCache
+from song_analysis import SongAnalysis
+from edl import EDL_VERSION, FPS, plan_edl, split_edl, window_edl, first_frame, save_edl
+from ffmpeg_render import render_edl, concat
+from render_profile import INTERMEDIATE_QUALITY, RenderProfile
 
-from generate_timestamps import *
-from tools import preload, get_closest_percent
-
-'''
-If simple_vid: Simple, randomized, tempo synced video generation
-If smart_vid: Dynamic video generation - Intense sections of music will have faster visuals
 '''
+Plans sub videos as edit decision lists (see edl.py) then renders them with moviepy or ffmpeg
 
-GPU_accel = False
+If moviepy: every frame goes through python (effects, fades and compositing with moviepy)
+If ffmpeg: every clip is cut, scaled and faded by ffmpeg then joined without re-encoding (see ffmpeg_render.py)
+'''
 
-HIGH_INTENSITY = [1, 1, 1, 4, 4, 4]
-MEDIUM_INTENSITY = [4, 4, 4, 4, 8, 8, 8, 16]
-LOW_INTENSITY = [8, 8, 8, 16, 16, 16, 16]
+RENDER_BACKENDS = ('moviepy', 'ffmpeg')
 
 
-# def make_sub_movie(music_file_path: str, bpm: float, videos_list: list, idx: int,
-#                    start: float, finish: float, duration: float, intensities: dict, resolution: str, dynamic: str):
-def make_sub_movie(args):
+def plan_sub_movie(music_file_path: str, bpm: float, footage: list, idx: int, start: float, finish: float,
+                   duration: float, intensities: dict, resolution: str, dynamic: str, seed=None,
+                   snap_keyframes: bool = False):
     """
-    Saves a simple or smart movie synced to the provided audio file
+    Returns the edit decision list (dict) of a simple or smart movie synced to the provided audio file
+
+    The list only holds plain values (paths, offsets, effects), it can be saved as .json or sent to another process
 
     music_file_path (str): path to song (.wav)
     bpm (int / float): beats per minute tempo of the song
-    videos_list (list): videos to use
+    footage (list): videos to use, metadata from FootagePool.footage
     idx (int): video index
 
     start: first downbeat
     finish: last downbeat
     duration: total duration
     resolution (str): desired output resolution (ex: 1080 or 720)
+    seed: same seed => same video, drawn at random if not provided
+    snap_keyframes: clips start on key frames of their video when possible, see edl.plan_edl
     """
 
-    music_file_path, bpm, videos_list, idx, start, finish, duration, intensities, resolution, dynamic = (
-        args[0], args[1], args[2], args[3], args[4], args[5], args[6], args[7], args[8], args[9])
-
     song_name, _ = splitext(split(music_file_path)[1])
     project_folder = split(split(music_file_path)[0])[0]
     titles_path = str(join(project_folder, 'titles' + os.sep))
-    titles_list = os.listdir(titles_path)
+    titles_list = [titles_path + title for title in sorted(os.listdir(titles_path))]
     temp_path = str(join(project_folder, 'temp' + os.sep))
-    length_of_a_beat = 60 / bpm   # time between beats
-    videos = []
-
-    # black screen on start
-    if 0 < start < 4:
-        videos.append(VideoFileClip(titles_path + random.choice([x for x in titles_list])).subclip(0, start).fx(vfx.colorx, 0.0))
-
-    # ambient intro on start
-    elif start > 0:
-        clip = VideoFileClip(titles_path + random.choice([x for x in titles_list])).subclip(0, start)
-        videos.append(clip.fx(vfx.fadein, duration=clip.duration/2))
-
-    new4_bar_block = True  # outlines every 4 bars to switch up speeds
-    current4_bar_block = 0  # current 4 bar block to pull intensities from
-    fade_out = False  # used to fade out before a drop
-    beats = 0  # current beats rendered
-
-    current_render_percent = 0  # used to print progress to console
-
-    print(f"Generating video {song_name}_subVid{idx}.mp4")
-
-    while start < finish if dynamic == 'simple_vid' else beats < (len(intensities) * 16):
-
-        # switch up video rate every 4 bars
-        if beats % 16 == 0:
-            new4_bar_block = True
-
-        if new4_bar_block:
-
-            # simple video case (static video selection) #
-            if dynamic == 'simple_vid':
-                i = random.choice([1, 4, 4, 4, 8, 8, 16, 16, 16])  # random rate of change of the videos
-
-            # smart video case (dynamic video selection) #
-            elif dynamic == 'smart_vid':
-                if intensities[current4_bar_block] == "High":
-                    # If the previous section was low and this one is high, make it speedy by default
-                    if current4_bar_block > 0 and intensities[current4_bar_block - 1] == "Low":
-                        i = 1
-                    else:
-                        i = random.choice(HIGH_INTENSITY)
-                elif intensities[current4_bar_block] == "Medium":
-                    i = random.choice(MEDIUM_INTENSITY)
-                else:
-                    try:
-                        # Check next section is a "drop"
-                        if intensities[current4_bar_block + 1] == "High":
-                            i = 16
-                            fade_out = True
-                        else:
-                            i = random.choice(LOW_INTENSITY)
-                    except KeyError:
-                        i = random.choice(LOW_INTENSITY)
-                current4_bar_block += 1
-
-        while True:
-            try:  # try / catch block to account for videos that are not long enough
-                video = random.choice(videos_list)
-                video_start = random.randint(0, math.floor(video.duration - length_of_a_beat * i))  # random video part
-                break
-            except ValueError:
-                continue
-
-        if not fade_out:
-            videos.append(video.subclip(video_start, video_start + length_of_a_beat * i))
-        else:  # fadeout before a drop
-            video_fade_out = video.subclip(video_start, video_start + length_of_a_beat * i)
-            videos.append(video_fade_out.fx(vfx.fadeout, duration=video_fade_out.duration / 4))
-            fade_out = False
-
-        start += (length_of_a_beat * i)
-        beats += i
-
-        # print progress to screen
-        percent = start / finish * 100 if dynamic == 'simple_vid' else beats / (len(intensities) * 16) * 100
-        percent_rendered = get_closest_percent(percent)
-        if percent_rendered != current_render_percent:
-            current_render_percent = percent_rendered
-            print(f"{current_render_percent} %/ rendered")
-
-        new4_bar_block = False
-
-    # Ambient outro
-    if start < duration:
-        clip = VideoFileClip(titles_path + random.choice([x for x in titles_list])).subclip(0, duration-start)
-        videos.append(clip.fx(vfx.fadeout, duration=clip.duration/2))
-
-    # Makes all videos at the same resolution
-    print(f"Making sub videos {resolution}p")
-    width, height = str(int(int(resolution) * (16 / 9))), resolution
-    for vid in videos:
-        if vid.h != int(height):
-            print(f"resizing video {vid.filename}")
-            output_path = splitext(vid.filename)[0] + "_resized" + splitext(vid.filename)[1]
-            os.system("ffmpeg -hwaccel cuda -i " + vid.filename + " -c:v h264_nvenc -vf scale=" + width + ":" + height +
-                      " -crf 18 -preset slow -qp 20 -y " + output_path + " -hide_banner -loglevel warning")  # -qp 20 -c:v h264_cuvid
-            vid.size = (int(width), int(height))
-            vid.filename = output_path
-
-    final_clip = concatenate_videoclips(videos, method="compose")
-
-    # write video
-    os.makedirs(temp_path, exist_ok=True)
-    codec = "h264_nvenc" if GPU_accel else "mpeg4"
-    final_clip.write_videofile(filename=f"{temp_path}{song_name}_subVid{idx}.mp4", bitrate='8000000',
-                               threads=64, verbose=False, preset="slow", audio=False, codec=codec)
-
-    # memory save
-    for v in videos:
-        v.close()
-    final_clip.close()
+    seed = random.randrange(1 << 32) if seed is None else seed
+
+    print(f"Planning video {song_name}_subVid{idx}.mp4")
+    try:
+        clips = plan_edl(bpm, start, finish, duration, intensities, dynamic, footage, titles_list, f"{seed}-{idx}",
+                         snap_keyframes)
+    except ValueError as error:  # a batch reports it and goes on with the next song
+        sys.exit(f"Can't plan {song_name}_subVid{idx}.mp4: {error}, add longer videos to "
+                 f"{join(project_folder, 'videos' + os.sep)}")
+
+    return {'version': EDL_VERSION, 'seed': seed, 'output_path': f"{temp_path}{song_name}_subVid{idx}.mp4",
+            'resolution': resolution, 'fps': FPS, 'clips': clips}
+
+
+def render_sub_movie(plan: dict):
+    """
+    Saves the movie described by an edit decision list from plan_sub_movie with moviepy, opening its own video readers
+
+    Clips are read at the plan resolution, from proxies already at that resolution when the plan went through
+    ProxyCache.use_proxies
+    """
+
+    from moviepy.editor import vfx, concatenate_videoclips  # seconds to import, the ffmpeg backend doesn't need it
+
+    print(f"Generating video {split(plan['output_path'])[1]}")
+    with tracing.span(split(plan['output_path'])[1], 'sub video', backend='moviepy', clips=len(plan['clips'])):
+        pool = FootagePool(plan['resolution'])  # one reader per (file, effect), shared by all the subclips taken from it
+        videos = []
+
+        for clip in plan['clips']:
+            video = pool.open(clip['path'], clip['effect']).subclip(clip['start'], clip['end'])
+
+            if clip['fx'] == 'black':
+                video = video.fx(vfx.colorx, 0.0)
+            elif clip['fx'] == 'fadein':
+                video = video.fx(vfx.fadein, duration=video.duration/2)
+            elif clip['fx'] == 'fadeout':
+                video = video.fx(vfx.fadeout, duration=video.duration / 4)
+            elif clip['fx'] == 'fadeout_half':
+                video = video.fx(vfx.fadeout, duration=video.duration/2)
+            videos.append(video)
+
+        # frames are taken at the same times as in a render of the whole timeline, even for a chunk of it
+        fps = plan['fps']
+        timeline_start = plan.get('timeline_start', 0)
+        first = first_frame(timeline_start, fps)
+        frames = first_frame(timeline_start + sum(clip['end'] - clip['start'] for clip in plan['clips']), fps) - first
+        offset = first / fps - timeline_start
+        final_clip = concatenate_videoclips(videos, method="compose").subclip(offset, offset + (frames - 0.5) / fps)
+
+        # write video
+        os.makedirs(split(plan['output_path'])[0], exist_ok=True)
+        final_clip.write_videofile(filename=plan['output_path'], fps=fps, verbose=False, audio=False,
+                                   **RenderProfile.of(plan).moviepy_args(INTERMEDIATE_QUALITY))
+
+        # memory save
+        pool.close()
+        final_clip.close()
+
+
+def make_sub_movie(args):
+    """
+    Plans then saves a simple or smart movie synced to the provided audio file, see plan_sub_movie for the arguments
+    """
+
+    render_sub_movie(plan_sub_movie(*args))
+
+
+def render_sliced(plans: list, render, Executor, workers: int, executor=None):
+    """
+    Renders sub videos cut into time slices at clip boundaries, every slice of every sub video sharing one pool of
+    workers, then joins the slices of each sub video without re-encoding them. Returns what render returned for
+    every slice (list)
+
+    executor: pool of workers shared with other renders (batch mode), a pool of Executor is started if not provided
+    """
+
+    chunks = {plan['output_path']: split_edl(plan, math.ceil(workers / len(plans))) for plan in plans}
+    with contextlib.nullcontext(executor) if executor else Executor(max_workers=workers) as executor:
+        results = list(executor.map(render, [chunk for plan_chunks in chunks.values() for chunk in plan_chunks]))
+
+    for output_path, plan_chunks in chunks.items():
+        if len(plan_chunks) > 1:
+            concat([chunk['output_path'] for chunk in plan_chunks], output_path)
+            for chunk in plan_chunks:
+                os.remove(chunk['output_path'])
+    return results
+
+
+def plan_sub_movies(music_file_path: str, bpm: float, complexity, resolution: str, dynamic: str, seed=None,
+                    profile: RenderProfile = None, snap_keyframes: bool = False, catalog: FootageCatalog = None):
+    """
+    Plans complexity sub videos and saves their edit decision lists next to them as .edl.json, returns the plans
+
+    profile: render profile of the sub videos, final at resolution by default. Its resolution replaces resolution,
+    only its window of the song is kept and its outputs are named after it, so that drafts don't replace finals
+    snap_keyframes: clips start on key frames of their video when possible, see edl.plan_edl
+    catalog: footage catalog read, the project one by default
+    """
+
+    profile = profile if profile else RenderProfile(resolution=resolution)
+    resolution = profile.resolution
+
+    print(f"Analysing waveform of '{split(music_file_path)[1]}'")
+    analysis = SongAnalysis(music_file_path, bpm)
+    start, finish = analysis.first_and_last_down_beat
+    duration = analysis.duration
+    intensities = analysis.intensities
+    analysis.release()
+
+    videos_path = join(split(split(music_file_path)[0])[0], 'videos' + os.sep)
+    footage = FootagePool.scan(videos_path, resolution, seed, catalog=catalog).footage
+    plans = [plan_sub_movie(music_file_path, bpm, footage, i, start, finish, duration, intensities, resolution,
+                            dynamic, seed, snap_keyframes) for i in range(int(complexity))]
+    plans = [dict(window_edl(plan, *profile.window) if profile.window else plan, profile=profile.settings(),
+                  output_path=plan['output_path'].replace("_subVid", f"{profile.suffix()}_subVid")) for plan in plans]
+    for plan in plans:  # kept next to the sub videos, to inspect a cut or render it again
+        os.makedirs(split(plan['output_path'])[0], exist_ok=True)
+        save_edl(plan, edl_path(plan['output_path']))
+    return plans
+
+
+def edl_path(sub_vid_path: str):
+    """
+    returns the path of the .edl.json file (str) saved next to a sub video
+    """
+
+    return splitext(sub_vid_path)[0] + ".edl.json"
+
+
+def ready_plans(plans: list, backend: str = 'ffmpeg', catalog: FootageCatalog = None, evict: bool = True):
+    """
+    Returns the edit decision lists reading from proxies, every source being transcoded once to the sub video
+    resolution and frame rate, and keeping their segments in the segment cache of the project for the ffmpeg backend
+
+    catalog: footage catalog giving the sources hashes, the project one by default
+    evict: False to leave the caches over their budget, when other songs may still read the files it would delete
+    """
+
+    folder = split(plans[0]['output_path'])[0]
+    plans = ProxyCache.of(folder, catalog=catalog).use_proxies(plans, evict=evict)
+    if backend == 'ffmpeg':
+        plans = [dict(plan, segment_dir=SegmentCache.of(folder).cache_dir) for plan in plans]
+    return plans
+
+
+def render_sub_movies(plans: list, parallel_proc, backend: str = 'ffmpeg', workers: int = None, executor=None,
+                      catalog: FootageCatalog = None, evict: bool = True):
+    """
+    Renders sub videos from their edit decision lists, in worker processes or threads if parallel_proc, or in the
+    workers of executor if provided
+
+    The ffmpeg backend reuses the segments of previous renders (see segment_cache.py), the numbers of segments
+    {'copied', 'encoded', 'cached'} are then returned. catalog and evict: see ready_plans
+    """
+
+    plans = ready_plans(plans, backend, catalog, evict)
+
+    render = render_edl if backend == 'ffmpeg' else render_sub_movie
+    if parallel_proc in ('process', 'thread', True, 'True'):
+        # moviepy compositing is mostly GIL bound python: worker processes scale with cores where threads don't
+        Executor = concurrent.futures.ProcessPoolExecutor if parallel_proc == 'process' \
+            else concurrent.futures.ThreadPoolExecutor
+        workers = workers if workers else os.cpu_count()
+        # encodes running at once share the cores instead of each starting a thread per core
+        plans = [dict(plan, profile=RenderProfile.of(plan).with_threads(os.cpu_count() // workers).settings())
+                 for plan in plans]
+        results = render_sliced(plans, render, Executor, workers, executor)
+    else:
+        results = [render(plan) for plan in plans]
+
+    if backend == 'ffmpeg':
+        counts = {name: sum(result[name] for result in results) for name in ('copied', 'encoded', 'cached')}
+        print(f"Segments: {counts['cached']} reused, {counts['encoded'] + counts['copied']} rendered "
+              f"({counts['copied']} copied from proxies)")
+        if evict:
+            SegmentCache.of(split(plans[0]['output_path'])[0]).evict()
+        return counts
 
 
 def main(argv):
     music_file_path = argv[0]
-    bpm = argv[1]
+    bpm = float(argv[1])
     complexity = argv[2]
     resolution = argv[3]
     parallel_proc = argv[4]
     dynamic = argv[5]
+    workers = int(argv[6]) if len(argv) > 6 and argv[6] else os.cpu_count()
+    backend = argv[7] if len(argv) > 7 and argv[7] else 'ffmpeg'
+    seed = int(argv[8]) if len(argv) > 8 and argv[8] not in (None, '', 'None') else None
 
-    print(f"Analysing waveform of '{split(music_file_path)[1]}'")
-    start, finish = guess_first_and_last_down_beat(music_file_path)
-    duration = get_duration(music_file_path)
-    intensities = get_intensities(music_file_path, bpm)
-
-    videos_path = join(split(split(music_file_path)[0])[0], 'videos' + os.sep)
-    videos_list = preload(videos_path, resolution)
-    if parallel_proc:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=int(complexity)) as executor:
-            futures = []
-            for i in range(int(complexity)):
-                args = music_file_path, bpm, videos_list, i, start, finish, duration, intensities, resolution, dynamic
-                future = executor.submit(make_sub_movie, args)
-                futures.append(future)
-            concurrent.futures.wait(futures)
-    else:
-        for i in range(int(complexity)):
-            args = music_file_path, bpm, videos_list, i, start, finish, duration, intensities, resolution, dynamic
-            make_sub_movie(args)
+    plans = plan_sub_movies(music_file_path, bpm, complexity, resolution, dynamic, seed)
+    render_sub_movies(plans, parallel_proc, backend, workers)
 
 
 if __name__ == "__main__":
@@ -2,14 +2,25 @@ import os
 import sys
 import time
 # import tqdm
+import copy
+import random
 import argparse
-import pixabay.core
-from pexelsapi.pexels import Pexels
+import traceback
+import contextlib
+import concurrent.futures
 from os.path import exists, join, split, splitext
 
-import generate_timestamps
-from video_downloader import video_downloader
-from make_sub_movies import main as make_sub_movies
+import tracing
+from edl import EDL_VERSION, load_edl
+from catalog import FootageCatalog
+from proxies import ProxyCache
+from segment_cache import SegmentCache
+from pipeline import Pipeline, Stage
+from song_analysis import ANALYSIS_VERSION, SongAnalysis
+from compositor import COMPOSITORS, blend_cascade, cascade_paths, filter_graph, final_paths, glitch, mux
+from make_sub_movies import edl_path, plan_sub_movies, render_sub_movies
+from render_profile import PROFILES, RenderProfile
+from streaming import STREAM_FORMATS, stream, stream_path
 
 # TODO:
 # Add global progress-bar => In progress
@@ -24,31 +35,32 @@ CLI_mode = False  # if False => adjust parameters below
 # parameters
 complexity = '3'
 dynamic = True
-GPU_accel = False
 output_res = '1080'
-parallel_proc = False
+profile = 'final'  # 'final' for delivery, 'draft' for a fast 360p preview of the window below
+window = None  # (start, end) in seconds of the song rendered, the whole song if None
+encoder = None  # ffmpeg encoder (ex: 'libx264'), the best one available if None
+outputs = []  # output targets made from one composite (ex: ['1080', '720', '1080x1920']), output_res only if empty
+parallel_proc = 'process'  # 'process', 'thread' or False to render sub videos one after another
+workers = os.cpu_count()  # maximum number of sub videos rendered at once
+backend = 'ffmpeg'  # 'ffmpeg' (no python frame handling) or 'moviepy' to render sub videos
+seed = None  # same seed => same cuts, random if None
+snap_keyframes = False  # True to start cuts on key frames of the footage sources only
+compositor = 'filter_graph'  # 'filter_graph' (single ffmpeg pass) or 'cascade' (one encode per blend / glitch / mux)
+stream_format = ''  # 'hls' or 'fmp4' to watch the music video in out/ while it's rendered, no stream if empty
+dry_run = False  # only report which stages would run
+batch_mode = False  # True to make the music video of every song in music/ (or of the songs below)
+songs = []  # songs of project_folder/music/ made in batch mode, all of them if empty
+trace = ''  # path of a Chrome trace (.json) of the stages, sub videos and ffmpeg runs, no tracing if empty
 
 project_folder = 'E:\\FAB_COMPOS\\Video_songs\\Brest2008\\Clip'
 
-# FFMPEG settings
-ffmpeg_cmd_in = "ffpb -hwaccel cuda -i " if GPU_accel else "ffpb -i "
-ffmpeg_cmd_codec = " -c:v h264_nvenc" if GPU_accel else ""
-ffmpeg_cmd_opt = " -hide_banner -loglevel warning -stats"
-
-# Get API_KEYS
-with open("api_keys.txt", "r") as f:
-    pixabay_api_key = f.readline().replace('\n', '')
-    pexels_api_key = f.readline().replace('\n', '')
-
 titles_queries = ['ocean']
 videos_queries = ['boat', 'mariners', 'old ship', 'sailors', 'sea']
-download_args = {
+download_args = {  # API clients are added from api_keys.txt when downloading, see download_footage
     'global': {'size': 'large', 'ratio': 16 / 9, 'minWidth': 1920, 'minHeight': 1080,
                'per_page': 100, 'video_nb': 10, 'ratio_strict': 1, 'keep_all': 0, 'sub_folders': False},
-    'pixabay': {'use_api': 1, 'px': pixabay.core(pixabay_api_key),
-                'lang': 'en', 'orientation': 'horizontal', 'colors': 'all'},
-    'pexels': {'use_api': 1, 'px': Pexels(pexels_api_key),
-               'lang': 'en-US', 'orientation': 'landscape', 'colors': ''}
+    'pixabay': {'use_api': 1, 'lang': 'en', 'orientation': 'horizontal', 'colors': 'all'},
+    'pexels': {'use_api': 1, 'lang': 'en-US', 'orientation': 'landscape', 'colors': ''}
 }
 
 
@@ -70,76 +82,15 @@ def music_video_generator(args):
     start = time.time()
 
     # Download video clips based on queries
-    if download:
-        video_downloader(titles_queries, join(project_folder, 'titles'), download_args)
-        video_downloader(videos_queries, join(project_folder, 'videos'), download_args)
-
-    # Generates n(complexity) number of randomized videos
-    song_name, _ = splitext(split(args.music_file_path)[1])
-    if generate and not exists(join(args.temp_path, f"{song_name}_subVid{int(args.complexity)-1}.mp4")):
-        sub_vid_args = args.music_file_path, float(args.bpm), args.complexity, args.output_res, args.parallel_proc
-        if args.dynamic:
-            os.system("python make_sub_movies.py {0} {1} {2} {3} {4} smart_vid".format(*sub_vid_args)) if CLI_mode \
-                else make_sub_movies([*sub_vid_args, 'smart_vid'])
-        else:
-            os.system("python make_sub_movies.py {0} {1} {2} {3} {4} simple_vid".format(*sub_vid_args)) if CLI_mode \
-                else make_sub_movies([*sub_vid_args, 'simple_vid'])
-
-    # Blends all videos
-    sub_vid_paths = [join(args.temp_path, path) for path in reversed(os.listdir(args.temp_path)) if 'subVid' in path]
-    blend_vid_paths = [''] * (len(sub_vid_paths)-1)
-    mashed_vid_paths = [''] * (len(sub_vid_paths)-2)
-    generated_output_path = join(args.temp_path, f"{song_name}_generated.mp4")
-
-    if not sub_vid_paths:
-        sys.exit("No sub movie to blend! Check if make_sub_movie has run successfully")  # Kill process
-
-    count = 0
-    for i in reversed(range(len(sub_vid_paths)-1)):
-        count += 1
-        blend_vid_paths[i] = sub_vid_paths[i+1].replace("subVid", 'blended')
-        if sub_vid_paths and not exists(blend_vid_paths[i]):
-            print(f"Blending sub videos together {count}")
-            os.system(f"{ffmpeg_cmd_in} {sub_vid_paths[i+1]} -i {sub_vid_paths[i]} {ffmpeg_cmd_codec} "
-                      f"-filter_complex blend='difference' -y {blend_vid_paths[i]} {ffmpeg_cmd_opt}")
-            if i == 0 and len(blend_vid_paths) == 1:
-                os.rename(blend_vid_paths[0], generated_output_path)
-        if i < len(sub_vid_paths)-2 and not exists(mashed_vid_paths[i]):
-            # print("Blending those blended videos together " + str(count-1))
-            print(f"Blending those blended videos together {count-1}")
-            mashed_vid_paths[i] = blend_vid_paths[i+1].replace("blended", 'mashed')
-            os.system(ffmpeg_cmd_in + blend_vid_paths[i+1] + " -i " + blend_vid_paths[i] + ffmpeg_cmd_codec +
-                      " -filter_complex blend='difference' -y " + mashed_vid_paths[i] + ffmpeg_cmd_opt)
-            if i == 0 and len(mashed_vid_paths) == 1:
-                os.rename(mashed_vid_paths[0], generated_output_path)
-        if i < len(sub_vid_paths)-3 and not exists(generated_output_path):
-            # print("Mashing those blended videos together")
-            print(f"Mashing those blended videos together")
-            os.system(ffmpeg_cmd_in + mashed_vid_paths[i+1] + " -i " + mashed_vid_paths[i] + ffmpeg_cmd_codec +
-                      " -filter_complex blend='difference' -y " + generated_output_path + ffmpeg_cmd_opt)
-
-    # chromashift to add pizazz\
-    temp_input_file = join(args.temp_path, f"{song_name}_generated.mp4")
-    temp_output_file = join(args.temp_path, f"{song_name}_generated_final.mp4")
-    if not exists(temp_output_file):
-        # print("Glitching final result")
-        print(f"Glitching final result")
-        os.system(ffmpeg_cmd_in + temp_input_file + ffmpeg_cmd_codec +
-                  " -vf chromashift=crv=-200:cbv=100:crh=100 -qp 20 " + temp_output_file + ffmpeg_cmd_opt)
-
-    # make temporary .aac file and add it to the mp4 video (.wav not supported directly)
-    output_path_final = temp_output_file.replace("temp", 'out')
-    temp_audio_file = join(args.temp_path, f"{song_name}_temp.aac")
-    if not (exists(output_path_final) or exists(temp_audio_file)):
-        # print("Copying Audio and adding it to video clip")
-        print(f"Copying Audio and adding it to video clip")
-        os.system(ffmpeg_cmd_in + args.music_file_path + " -ab 256k " + temp_audio_file + ffmpeg_cmd_opt)
-        os.makedirs(args.temp_path.replace("temp", 'out'), exist_ok=True)
-        os.system(ffmpeg_cmd_in + temp_output_file + " -i " + temp_audio_file +
-                  " -c copy -map 0:v:0 -map 1:a:0 " + output_path_final + ffmpeg_cmd_opt)
+    if download and not args.dry_run:
+        download_footage()
+
+    # Runs the stages whose inputs or parameters changed since the last run
+    with tracing.span(args.song_name, 'song'):
+        build_pipeline(args).run(args.dry_run)
 
     # file clean up
-    if clean_up:
+    if clean_up and not args.dry_run:
         # print("deleting temporary files")
         print(f"Deleting temporary files")
         for vid in os.listdir(args.temp_path):
@@ -150,6 +101,195 @@ def music_video_generator(args):
     print(f"Total program runtime, in seconds - {end - start}")
 
 
+def batch(args, song_names: list):
+    """
+    Makes the music video of every song, sharing the footage catalog, the analysis and proxy caches and one pool of
+    render workers sized to the machine. A song failing doesn't stop the others
+
+    Songs are processed a few at a time so that the analysis, planning and ffmpeg passes of one song overlap with the
+    sub video renders of another, the renders of every song queue up in the shared pool
+    """
+
+    start = time.time()
+    if download and not args.dry_run:
+        download_footage()
+
+    catalog = FootageCatalog.of(args.videos_path)  # probed once here, only read by the songs
+    for folder in (args.videos_path, args.titles_path):
+        catalog.refresh(folder)
+    catalog.close()
+
+    songs_in_flight = max(1, min(len(song_names), args.workers // 4))
+    # the caches are evicted once every song is done: a song could delete the proxies or segments another one reads
+    args = copy.copy(args)
+    args.catalog, args.evict = FootageCatalog.of(args.videos_path, read_only=True), False
+    args.profile = args.profile.with_threads(args.profile.threads // songs_in_flight)  # composites run side by side
+    Executor = {'process': concurrent.futures.ProcessPoolExecutor,
+                'thread': concurrent.futures.ThreadPoolExecutor}.get(args.parallel_proc)
+    failures = {}
+
+    def make(song_name):
+        song_start = time.time()
+        try:
+            with tracing.span(song_name, 'song'):
+                build_pipeline(song_args(args, song_name), render_pool).run(args.dry_run)
+            print(f"'{song_name}' done in {time.time() - song_start:.0f}s")
+        except (Exception, SystemExit) as error:  # sys.exit of a song stops the song only
+            traceback.print_exc()
+            failures[song_name] = error
+
+    with Executor(max_workers=args.workers) if Executor else contextlib.nullcontext() as render_pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=songs_in_flight) as songs_pool:
+        list(songs_pool.map(make, song_names))
+
+    if not args.dry_run:
+        ProxyCache.of(args.videos_path, catalog=args.catalog).evict()
+        SegmentCache.of(args.videos_path).evict()
+    args.catalog.close()
+
+    if clean_up and not args.dry_run:
+        print(f"Deleting temporary files")
+        for vid in os.listdir(args.temp_path):
+            os.remove(join(args.temp_path, vid))
+
+    elapsed = time.time() - start
+    done = len(song_names) - len(failures)
+    print(f"{done} / {len(song_names)} songs in {elapsed:.0f}s, {done * 3600 / elapsed:.1f} songs per hour")
+    for song_name, error in failures.items():
+        print(f"failed: '{song_name}' ({error!r})")
+    return failures
+
+
+def download_footage():
+    """
+    Downloads the titles and videos matching the queries into the project folder, the API keys being read from
+    api_keys.txt and the provider clients built only then
+    """
+
+    import pixabay.core
+    from pexelsapi.pexels import Pexels
+    from video_downloader import video_downloader
+
+    # Get API_KEYS
+    with open("api_keys.txt", "r") as f:
+        pixabay_api_key = f.readline().replace('\n', '')
+        pexels_api_key = f.readline().replace('\n', '')
+
+    args = dict(download_args, pixabay=dict(download_args['pixabay'], px=pixabay.core(pixabay_api_key)),
+                pexels=dict(download_args['pexels'], px=Pexels(pexels_api_key)))
+    video_downloader(titles_queries, join(project_folder, 'titles'), args)
+    video_downloader(videos_queries, join(project_folder, 'videos'), args)
+
+
+def song_args(args, song_name: str):
+    """
+    Returns a copy of args (argparse.Namespace) for a song of project_folder/music/
+    """
+
+    args = copy.copy(args)
+    args.song_name = song_name
+    args.music_file_path = str(join(args.project_folder, "music", song_name))
+    args.titles_path = str(join(args.project_folder, "titles" + os.sep))
+    args.videos_path = str(join(args.project_folder, "videos" + os.sep))
+    args.temp_path = str(join(args.project_folder, "temp" + os.sep))
+    return args
+
+
+def build_pipeline(args, render_pool=None):
+    """
+    Returns the pipeline (see pipeline.py) making the music video: analysis => plan => sub video renders => blend,
+    glitch and mux (a single composite stage with the filter_graph compositor, a single stream stage rendering and
+    compositing at once when streaming)
+
+    render_pool: workers rendering the sub videos, shared by the songs of a batch, see make_sub_movies.render_sub_movies
+    """
+
+    song, _ = splitext(split(args.music_file_path)[1])
+    profile = args.profile
+    song_name = song + profile.suffix()  # drafts have their own outputs and stages, finals are left untouched
+    pipeline = Pipeline(join(args.project_folder, 'cache', f"{song_name}_stages.json"))
+    # without a seed the cuts of the previous run are kept, pass a seed to get new ones. Drafts keep the cuts of the
+    # final video, so that a draft previews what the final render will be
+    seeds = pipeline if song_name == song else Pipeline(join(args.project_folder, 'cache', f"{song}_stages.json"))
+    seed = args.seed if args.seed not in (None, '', 'None') else seeds.remember('seed', random.randrange(1 << 32))
+    # threads are left out: they don't change the output
+    render_params = {'profile': profile.name, 'window': profile.settings()['window'], 'encoder': profile.encoder}
+    targets = args.outputs if profile.name == 'final' else []  # drafts preview the cut, at their own resolution
+    output_paths = final_paths(args.temp_path, song_name, targets)
+    sub_vid_paths = [join(args.temp_path, f"{song_name}_subVid{i}.mp4") for i in range(int(args.complexity))]
+    renders, sub_vid_files = [], []
+
+    def bpm():
+        return SongAnalysis(args.music_file_path, args.bpm).bpm
+
+    if generate:
+        # Generates n(complexity) number of randomized videos
+        catalog = args.catalog if args.catalog else FootageCatalog.of(args.videos_path)
+        footage = [[split(clip['path'])[1], clip['hash']]
+                   for folder in (args.videos_path, args.titles_path) for clip in catalog.refresh(folder)]
+        if not args.catalog:
+            catalog.close()
+
+        analysis = pipeline.add(Stage('analysis', lambda stages: SongAnalysis(args.music_file_path, args.bpm).analyse(),
+                                      {'bpm': args.bpm, 'analysis_version': ANALYSIS_VERSION},
+                                      files=[args.music_file_path]))
+        plan = pipeline.add(Stage('plan', lambda stages: plan_sub_movies(
+            args.music_file_path, bpm(), args.complexity, profile.resolution,
+            'smart_vid' if args.dynamic else 'simple_vid', seed, profile, args.snap_keyframes, args.catalog),
+            {'complexity': args.complexity, 'resolution': profile.resolution, 'dynamic': bool(args.dynamic),
+             'seed': seed, 'edl_version': EDL_VERSION, 'footage': footage, 'snap_keyframes': args.snap_keyframes,
+             **render_params},
+            inputs=[analysis], outputs=[edl_path(path) for path in sub_vid_paths]))
+
+        if args.stream_format:  # output targets are left to the final render
+            pipeline.add(Stage('stream', lambda stages: stream(
+                [load_edl(edl_path(path)) for path in sub_vid_paths], args.music_file_path, args.temp_path, song_name,
+                args.stream_format, profile, args.catalog, args.evict),
+                {'stream_format': args.stream_format, **render_params}, inputs=[plan], files=[args.music_file_path],
+                outputs=[stream_path(args.temp_path, song_name, args.stream_format)]))
+            return pipeline
+
+        def render(stages):  # stale sub videos are rendered together, sharing one pool of workers
+            render_sub_movies([load_edl(edl_path(stage.outputs[0])) for stage in stages], args.parallel_proc,
+                              args.backend, args.workers, render_pool, args.catalog, args.evict)
+
+        renders = [pipeline.add(Stage(f"render{i}", render, {'backend': args.backend}, inputs=[plan], outputs=[path]))
+                   for i, path in enumerate(sub_vid_paths)]
+    else:
+        sub_vid_paths = sub_vid_files = [path for path in sub_vid_paths if exists(path)]
+        if not sub_vid_paths:
+            sys.exit("No sub movie to blend! Check if make_sub_movie has run successfully")  # Kill process
+
+    # Blends all videos, glitches the result and adds the song audio
+    params = {'compositor': args.compositor, **render_params, 'outputs': targets}
+    if args.compositor == 'filter_graph':
+        pipeline.add(Stage('composite', lambda stages: filter_graph(
+            sub_vid_paths, args.music_file_path, args.temp_path, song_name, profile, targets),
+            params, inputs=renders, files=[args.music_file_path, *sub_vid_files], outputs=output_paths))
+    else:
+        def blend(stages):
+            for path in cascade_paths(sub_vid_paths):  # stale intermediate files would be reused
+                if exists(path):
+                    os.remove(path)
+            blend_cascade(sub_vid_paths, args.temp_path, song_name, profile)
+
+        def add_audio(stages):
+            temp_audio_file = join(args.temp_path, f"{song_name}_temp.aac")
+            if exists(temp_audio_file):
+                os.remove(temp_audio_file)
+            mux(args.music_file_path, args.temp_path, song_name, profile, targets)
+
+        blended = pipeline.add(Stage('blend', blend, params, inputs=renders, files=sub_vid_files,
+                                     outputs=[join(args.temp_path, f"{song_name}_generated.mp4")]))
+        glitched = pipeline.add(Stage('glitch', lambda stages: glitch(args.temp_path, song_name, profile), params,
+                                      inputs=[blended],
+                                      outputs=[join(args.temp_path, f"{song_name}_generated_final.mp4")]))
+        pipeline.add(Stage('mux', add_audio, params, inputs=[glitched], files=[args.music_file_path],
+                           outputs=output_paths))
+
+    return pipeline
+
+
 def parse_args():
     if CLI_mode:
         parser = argparse.ArgumentParser(description='Generate a music video - talent free!')
@@ -162,7 +302,39 @@ def parse_args():
                             help="True for dynamic visuals based on song intensity, False for random visuals")
         parser.add_argument("--output", help="Output file prefix eg MyVideo")
         parser.add_argument("--output_res", default="1080", help="Output video resolution, 1080 or 720")
-        parser.add_argument("--parallel_proc", default=True, help="Use multiprocessing to improve performances")
+        parser.add_argument("--profile", default="final", choices=list(PROFILES),
+                            help="final to render for delivery, draft for a fast 360p preview of --window, saved "
+                                 "next to the final video (final by default)")
+        parser.add_argument("--window", help="START:END in seconds of the song to render (the whole song by default)")
+        parser.add_argument("--outputs", nargs="*", default=[],
+                            help="Output targets scaled and cropped from one composite at --output_res: 16:9 "
+                                 "resolutions or WIDTHxHEIGHT, ex: 1080 720 1080x1920 (--output_res only by default)")
+        parser.add_argument("--encoder", help="ffmpeg encoder, ex: libx264 (the best one available by default)")
+        parser.add_argument("--parallel_proc", default="process", choices=["process", "thread", "False"],
+                            help="Render sub videos in worker processes, threads or one after another (process by default)")
+        parser.add_argument("--workers", default=os.cpu_count(), type=int,
+                            help="Maximum number of sub videos rendered at once (number of cores by default)")
+        parser.add_argument("--backend", default="ffmpeg", choices=["ffmpeg", "moviepy"],
+                            help="ffmpeg to cut and join clips without python frame handling, moviepy to composite "
+                                 "every frame in python (ffmpeg by default)")
+        parser.add_argument("--seed", type=int, help="Same seed => same cuts (random by default)")
+        parser.add_argument("--snap_keyframes", default="False", choices=["True", "False"],
+                            help="Start cuts on key frames of the footage sources only. Whole second cuts already "
+                                 "start on key frames of the proxies, which are copied (False by default)")
+        parser.add_argument("--compositor", default="filter_graph", choices=list(COMPOSITORS),
+                            help="filter_graph to blend, glitch and add audio in one ffmpeg pass, cascade for one pass "
+                                 "per step with intermediate files (filter_graph by default)")
+        parser.add_argument("--stream", default="", choices=["", *STREAM_FORMATS], dest="stream_format",
+                            help="hls or fmp4 to render and composite at once into a stream in out/ that players open "
+                                 "within seconds, with the ffmpeg backend (no stream by default)")
+        parser.add_argument("--dry_run", action="store_true",
+                            help="Only report which stages would run, the others being up to date")
+        parser.add_argument("--batch", action="store_true", dest="batch_mode",
+                            help="Make the music video of every song in project_folder/music/ (or of --songs)")
+        parser.add_argument("--songs", nargs="*", default=[], help="Songs of project_folder/music/ made in batch mode")
+        parser.add_argument("--trace", default="",
+                            help="Write a Chrome trace (.json, see chrome://tracing or ui.perfetto.dev) of the stages, "
+                                 "sub videos and ffmpeg runs there, and print a summary at the end")
         args = parser.parse_args()
     else:
         args = argparse.Namespace(project_folder=project_folder,
@@ -172,19 +344,45 @@ def parse_args():
                                   dynamic=dynamic,
                                   output='',
                                   output_res=output_res,
-                                  parallel_proc=parallel_proc)
+                                  profile=profile,
+                                  window=window,
+                                  encoder=encoder,
+                                  outputs=outputs,
+                                  parallel_proc=parallel_proc,
+                                  workers=workers,
+                                  backend=backend,
+                                  seed=seed,
+                                  snap_keyframes=snap_keyframes,
+                                  compositor=compositor,
+                                  stream_format=stream_format,
+                                  dry_run=dry_run,
+                                  batch_mode=batch_mode,
+                                  songs=songs,
+                                  trace=trace)
 
     # Defining additional necessary arguments
     args.project_folder = args.project_folder if args.project_folder else os.getcwd()
+    args.snap_keyframes = args.snap_keyframes in (True, 'True')
+    args.catalog, args.evict = None, True  # a batch shares a read only catalog and evicts the caches once, see batch
+    args.window = args.window.split(':') if isinstance(args.window, str) else args.window
+    args.profile = RenderProfile(args.profile, args.output_res, args.window, args.encoder)
     args.song_name = args.song_name if args.song_name else str(os.listdir(join(args.project_folder, "music"))[0])
-    args.music_file_path = str(join(args.project_folder, "music", args.song_name))
-    args.titles_path = str(join(args.project_folder, "titles" + os.sep))
-    args.videos_path = str(join(args.project_folder, "videos" + os.sep))
-    args.temp_path = str(join(args.project_folder, "temp" + os.sep))
-    args.bpm = str(generate_timestamps.guess_bpm(args.music_file_path)) if not args.bpm else args.bpm
+    args.songs = args.songs if args.songs else sorted(song for song in os.listdir(join(args.project_folder, "music"))
+                                                      if song.lower().endswith('.wav'))
 
-    return args
+    return song_args(args, args.song_name)
 
 
 if __name__ == "__main__":
-    music_video_generator(parse_args())
+    arguments = parse_args()
+    if arguments.trace:  # spans of the worker processes are gathered in project_folder/cache/trace
+        tracing.start(join(arguments.project_folder, 'cache', 'trace'))
+    try:
+        if arguments.batch_mode:
+            batch(arguments, arguments.songs)
+        else:
+            music_video_generator(arguments)
+    finally:
+        if arguments.trace:
+            tracing.export(arguments.trace)
+            tracing.summary()
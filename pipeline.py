@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+from os.path import exists
+
+import tracing
+from tools import save_json
+from song_analysis import file_hash
+
+'''
+Pipeline of stages (analysis, plan, sub video renders, blend / glitch / mux) forming a DAG
+
+Each stage is keyed by a hash of its parameters, of the content of its input files and of the keys of the stages it
+depends on. A stage runs again only when its key differs from the one of its last successful run or when one of its
+outputs is missing, so changing the bpm, the resolution or the footage rebuilds what depends on it and nothing else.
+Keys are known before anything runs, so a dry run reports what would rebuild without running it. Stages writing the
+same files (the composite of either compositor) rebuild when another one wrote them last
+'''
+
+PIPELINE_VERSION = 1  # bump to rebuild every stage when stages change
+
+
+class Stage:
+    """
+    A step of the pipeline
+
+    name (str): unique name of the stage
+    run (callable): run(stages) builds the outputs of a list of stale stages sharing this function and depth, so that
+        similar stages (sub video renders) share one pool of workers
+    params (dict): json serialisable values the outputs depend on
+    inputs (list): names of the stages it depends on
+    files (list): paths of the input files it depends on, keyed by content
+    outputs (list): paths of the files it builds, stale ones are deleted before it runs
+    """
+
+    def __init__(self, name: str, run, params: dict = None, inputs: list = (), files: list = (), outputs: list = ()):
+        self.name = name
+        self.run = run
+        self.params = params if params else {}
+        self.inputs = list(inputs)
+        self.files = list(files)
+        self.outputs = list(outputs)
+
+
+class Pipeline:
+    """
+    Stages added in dependency order, with the key of their last successful run kept in a manifest (.json)
+
+    manifest_path (str): where keys and remembered values are persisted
+    """
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.stages = {}
+        self.keys = {}
+        self.manifest = {'version': PIPELINE_VERSION, 'stages': {}, 'values': {}, 'files': {}, 'outputs': {}}
+        if exists(manifest_path):
+            with open(manifest_path, "r") as file:
+                manifest = json.load(file)
+            if manifest.get('version') == PIPELINE_VERSION:
+                self.manifest = dict(manifest, outputs=manifest.get('outputs', {}))  # output path => stage writing it
+
+    def _save(self):
+        save_json(self.manifest_path, self.manifest, indent=1)
+
+    def remember(self, name: str, value):
+        """
+        Returns the value remembered under name by a previous run, remembering value if there is none
+        """
+
+        if name not in self.manifest['values']:
+            self.manifest['values'][name] = value
+            self._save()
+        return self.manifest['values'][name]
+
+    def file_key(self, path: str):
+        """
+        Returns the content hash (str) of a file, hashed again only when its size or mtime changed
+        """
+
+        stat = os.stat(path)
+        size, mtime_ns, content_hash = self.manifest['files'].get(path, (None, None, None))
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            content_hash = file_hash(path)
+            self.manifest['files'][path] = stat.st_size, stat.st_mtime_ns, content_hash
+        return content_hash
+
+    def add(self, stage: Stage):
+        """
+        Adds a stage depending on stages already added, returns its name
+        """
+
+        missing = [name for name in stage.inputs if name not in self.stages]
+        if missing:
+            raise ValueError(f"stage {stage.name} depends on unknown stages {missing}")
+        self.stages[stage.name] = stage
+        self.keys[stage.name] = hashlib.sha256(json.dumps({
+            'stage': stage.name, 'params': stage.params,
+            'inputs': [self.keys[name] for name in stage.inputs],
+            'files': [self.file_key(path) for path in stage.files],
+        }, sort_keys=True).encode()).hexdigest()
+        return stage.name
+
+    def status(self, name: str):
+        """
+        Returns why a stage has to run (str), or None if its outputs are up to date
+        """
+
+        last_key = self.manifest['stages'].get(name)
+        if last_key is None:
+            return "never built"
+        if last_key != self.keys[name]:
+            return "inputs or parameters changed"
+        if not all(exists(path) for path in self.stages[name].outputs):
+            return "output missing"
+        writers = {self.manifest['outputs'].get(path, name) for path in self.stages[name].outputs} - {name}
+        if writers:
+            return f"output written by {', '.join(sorted(writers))}"
+        return None
+
+    def run(self, dry_run: bool = False):
+        """
+        Runs the stale stages, depth by depth. If dry_run, only reports which stages would run and why
+        """
+
+        depths = {}
+        for name, stage in self.stages.items():
+            depths[name] = 1 + max((depths[input_name] for input_name in stage.inputs), default=-1)
+
+        stale = {name: self.status(name) for name in self.stages}
+        for name, reason in stale.items():
+            print(f"{'rebuild' if reason else 'up to date':>10}  {name}" + (f" ({reason})" if reason else ""))
+        if dry_run:
+            return [name for name, reason in stale.items() if reason]
+
+        for depth in sorted(set(depths.values())):
+            batches = {}  # stale stages of this depth grouped by run function
+            for name, stage in self.stages.items():
+                if depths[name] == depth and stale[name]:
+                    batches.setdefault(stage.run, []).append(stage)
+            for run, stages in batches.items():
+                for stage in stages:
+                    for path in stage.outputs:
+                        if exists(path):
+                            os.remove(path)
+                with tracing.span(", ".join(stage.name for stage in stages), 'stage', depth=depth):
+                    run(stages)
+                for stage in stages:
+                    self.manifest['stages'][stage.name] = self.keys[stage.name]
+                    self.manifest['outputs'].update((path, stage.name) for path in stage.outputs)
+                self._save()
+        return [name for name, reason in stale.items() if reason]
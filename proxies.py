@@ -0,0 +1,157 @@
+import os
+import bisect
+import threading
+import collections
+import concurrent.futures
+from os.path import join, exists
+
+import tracing
+from catalog import FootageCatalog
+from tools import evict_least_recent, keyframe_index, project_cache_path
+from render_profile import RenderProfile
+
+'''
+Proxy cache: every source video transcoded once to the render resolution, frame rate and pixel format
+
+Proxies are named after the source content hash and the proxy settings, so they are shared by every sub video, every
+run and every copy of a file. They use a short GOP so that renders seek into them without decoding long runs of frames,
+and keep the key frames of their source: a cut starting on one of them is copied from the proxy without encoding it
+again (see ffmpeg_render.stream_copyable), the proxy being encoded like the sub videos of the render profile.
+The least recently used proxies are deleted once the cache grows over its size budget
+'''
+
+PROXY_VERSION = 2  # bump when proxies are encoded differently, older ones are then made again
+PROXY_BUDGET = 20 * 1024 ** 3  # bytes kept in the cache before the least recently used proxies are deleted
+PROXY_WORKERS = 4  # sources transcoded at once
+
+_making = collections.defaultdict(threading.Lock)  # proxy path => lock, a proxy is made once by concurrent songs
+
+
+def default_proxy_dir(folder: str):
+    """
+    returns project_folder/cache/proxies for a folder located in project_folder/
+    """
+
+    return project_cache_path(folder, 'proxies')
+
+
+def proxy_command(source_path: str, resolution, fps: float, pix_fmt: str, output_path: str,
+                  profile: RenderProfile = None, keyframes: list = ()):
+    """
+    returns the ffmpeg command (list) transcoding a source video into a proxy with the intermediate encoding of profile
+    (the final one by default), with key frames at the keyframes times (list) of the source as well
+    """
+
+    profile = profile if profile else RenderProfile(resolution=resolution)
+    width, height = int(int(resolution) * (16 / 9)), int(resolution)
+
+    return ["ffmpeg", *profile.decode_args(), "-i", source_path, "-vf", f"scale={width}:{height},setsar=1,fps={fps}",
+            "-an", *profile.intermediate_args(fps, keyframes), "-pix_fmt", pix_fmt,
+            "-movflags", "+faststart", "-y", output_path, "-hide_banner", "-loglevel", "error"]
+
+
+def starts_on_keyframe(clip: dict, index: dict, fps: float):
+    """
+    returns True if a clip of an edit decision list starts on a key frame of the file it reads, whose keyframe_index
+    is index, and that file holds every frame of the clip
+    """
+
+    keyframes = index['keyframes']
+    i = bisect.bisect_left(keyframes, clip['start'] - 0.5 / fps)
+    return i < len(keyframes) and abs(keyframes[i] - clip['start']) < 0.5 / fps \
+        and round((clip['end'] - clip['start']) * fps) < index['frames'] - round(clip['start'] * fps)
+
+
+class ProxyCache:
+    """
+    Transcodes sources on first use into cache_dir and hands out the proxy paths
+
+    cache_dir (str): where proxies are kept (project_folder/cache/proxies by default)
+    catalog (FootageCatalog): gives the content hash of the sources
+    budget (int): cache size in bytes over which the least recently used proxies are deleted
+    """
+
+    def __init__(self, cache_dir: str, catalog: FootageCatalog, budget: int = PROXY_BUDGET):
+        self.cache_dir = cache_dir
+        self.catalog = catalog
+        self.budget = budget
+
+    @classmethod
+    def of(cls, folder: str, budget: int = PROXY_BUDGET, catalog: FootageCatalog = None):
+        """
+        Opens the default proxy cache of a project folder, with its default catalog unless one is given
+        """
+
+        return cls(default_proxy_dir(folder), catalog if catalog else FootageCatalog.of(folder), budget)
+
+    def proxy_path(self, source_path: str, resolution, fps: float, pix_fmt: str = 'yuv420p',
+                   profile: RenderProfile = None):
+        """
+        Returns the path (str) the proxy of a source encoded with profile (the final one by default) has in the cache,
+        whether it was made or not
+        """
+
+        profile = profile if profile else RenderProfile(resolution=resolution)
+        content_hash = self.catalog.lookup(source_path)['hash']
+        return join(self.cache_dir, f"{content_hash}_{resolution}p{fps:g}_{pix_fmt}_{profile.codec_tag()}"
+                                    f"_v{PROXY_VERSION}.mp4")
+
+    def proxy(self, source_path: str, resolution, fps: float, pix_fmt: str = 'yuv420p', profile: RenderProfile = None):
+        """
+        Returns the proxy path (str) of a source, transcoding it with profile if it's not in the cache yet
+        """
+
+        return self._make(source_path, resolution, fps, pix_fmt,
+                          self.proxy_path(source_path, resolution, fps, pix_fmt, profile), profile,
+                          self.catalog.lookup(source_path)['keyframes'])
+
+    def _make(self, source_path: str, resolution, fps: float, pix_fmt: str, proxy_path: str,
+              profile: RenderProfile = None, keyframes: list = ()):
+        with _making[proxy_path]:
+            if exists(proxy_path):
+                os.utime(proxy_path)  # marks it as recently used
+            else:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                temp_path = f"{proxy_path}.{os.getpid()}-{threading.get_ident()}.tmp.mp4"
+                tracing.run(proxy_command(source_path, resolution, fps, pix_fmt, temp_path, profile, keyframes),
+                            'proxy')
+                os.replace(temp_path, proxy_path)  # atomic, concurrent runs never read a half written proxy
+        return proxy_path
+
+    def use_proxies(self, plans: list, workers: int = PROXY_WORKERS, evict: bool = True):
+        """
+        Returns the edit decision lists (see make_sub_movies.plan_sub_movie) reading from proxies instead of sources,
+        every distinct source being transcoded once with the profile of the plans. The original path of each clip is
+        kept as its source, and clips starting on a key frame of their proxy are marked keyframe
+
+        evict: False to leave the cache over its budget, when other renders may still read the proxies it would delete
+        """
+
+        profile = RenderProfile.of(plans[0]).with_threads(os.cpu_count() // workers)
+
+        # sqlite connections stay in this thread, workers only run ffmpeg
+        proxies = {(clip['path'], plan['resolution'], plan['fps']): None for plan in plans for clip in plan['clips']}
+        keyframes = {source: self.catalog.lookup(source[0])['keyframes'] for source in proxies}
+        proxies = {source: self.proxy_path(*source, 'yuv420p', profile) for source in proxies}
+        missing = sum(not exists(proxy_path) for proxy_path in proxies.values())
+        if missing:
+            print(f"Making {missing} proxies")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            indexes = dict(zip(proxies, executor.map(lambda source: keyframe_index(self._make(
+                *source, 'yuv420p', proxies[source], profile, keyframes[source])), proxies)))  # re-raises ffmpeg errors
+        if evict:
+            self.evict(keep=set(proxies.values()))
+
+        def proxied(clip: dict, plan: dict):
+            source = clip['path'], plan['resolution'], plan['fps']
+            return dict(clip, path=proxies[source], source=clip['path'],
+                        keyframe=starts_on_keyframe(clip, indexes[source], plan['fps']))
+
+        return [dict(plan, clips=[proxied(clip, plan) for clip in plan['clips']]) for plan in plans]
+
+    def evict(self, keep=()):
+        """
+        Deletes the least recently used proxies, except the keep ones, until the cache fits in its budget
+        """
+
+        evict_least_recent(self.cache_dir, self.budget, keep)
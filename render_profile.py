@@ -0,0 +1,204 @@
+import os
+import functools
+import subprocess
+
+'''
+Render profiles: the encoder, speed, quality and resolution of every ffmpeg and moviepy encode
+
+The encoders of the ffmpeg build are probed once per process (ffmpeg -encoders), hardware ones are only kept if they
+encode a test frame since builds list them whatever the machine has. "final" renders for delivery with the best encoder
+found, "draft" renders a window of the song at 360p as fast as possible to iterate on a cut in seconds
+'''
+
+ENCODERS = ('h264_nvenc', 'h264_qsv', 'h264_videotoolbox', 'libx264', 'mpeg4')  # best first
+HARDWARE_ENCODERS = ('h264_nvenc', 'h264_qsv', 'h264_videotoolbox')
+HWACCELS = {'h264_nvenc': 'cuda', 'h264_videotoolbox': 'videotoolbox'}  # hardware decoding feeding the encoder
+PRESETS = {  # encoder => preset of each speed
+    'libx264': {'fastest': 'ultrafast', 'fast': 'veryfast'},
+    'h264_nvenc': {'fastest': 'p1', 'fast': 'p4'},
+    'h264_qsv': {'fastest': 'veryfast', 'fast': 'medium'},
+}
+INTERMEDIATE_QUALITY = 18  # constant quality of proxies and sub videos, encoded again by the compositor
+INTERMEDIATE_GOP = 0.5  # seconds between the key frames of proxies and sub videos
+
+PROFILES = {
+    'draft': {'resolution': '360', 'speed': 'fastest', 'quality': 28, 'audio_bitrate': '128k'},
+    'final': {'resolution': None, 'speed': 'fast', 'quality': 20, 'audio_bitrate': '256k'},  # --output_res
+}
+
+
+def ffmpeg_list(option: str):
+    """
+    returns the output lines (list) of ffmpeg -hide_banner option (-encoders, -hwaccels...)
+    """
+
+    return subprocess.run(["ffmpeg", "-hide_banner", option], capture_output=True, text=True).stdout.splitlines()
+
+
+def encodes(encoder: str):
+    """
+    returns True if ffmpeg encodes a test frame with encoder
+    """
+
+    return subprocess.run(["ffmpeg", "-f", "lavfi", "-i", "color=size=256x144:duration=0.1", "-frames:v", "1",
+                           "-c:v", encoder, "-f", "null", "-", "-hide_banner", "-loglevel", "error"],
+                          capture_output=True).returncode == 0
+
+
+@functools.lru_cache(maxsize=None)
+def best_encoder():
+    """
+    Returns the first of ENCODERS (str) this ffmpeg build lists and can run, probed once per process
+    """
+
+    listed = {line.split()[1] for line in ffmpeg_list("-encoders") if len(line.split()) > 1}
+    for encoder in ENCODERS:
+        if encoder in listed and (encoder not in HARDWARE_ENCODERS or encodes(encoder)):
+            return encoder
+    return 'mpeg4'
+
+
+@functools.lru_cache(maxsize=None)
+def hwaccels():
+    """
+    returns the hardware decoding methods (set) of this ffmpeg build
+    """
+
+    return {line.strip() for line in ffmpeg_list("-hwaccels")[1:]}
+
+
+def target_size(target):
+    """
+    returns the (width, height) in pixels (ints) of an output target: a 16:9 resolution (ex: '720') or WIDTHxHEIGHT
+    (ex: '1080x1920' for a vertical cut)
+    """
+
+    if 'x' in str(target):
+        width, height = str(target).split('x')
+        return int(width), int(height)
+    return int(int(target) * (16 / 9)), int(target)
+
+
+class RenderProfile:
+    """
+    Encoding settings of a named profile on this machine
+
+    name (str): key of PROFILES
+    resolution: output resolution (ex: '1080'), used if the profile doesn't set one
+    window (tuple): (start, end) in seconds of the song rendered, the whole song if None
+    encoder (str): ffmpeg encoder, the best one available if None (see best_encoder)
+    threads (int): threads of each encode, the number of cores by default
+    """
+
+    def __init__(self, name: str = 'final', resolution=None, window: tuple = None, encoder: str = None,
+                 threads: int = None):
+        settings = PROFILES[name]
+        self.name = name
+        self.resolution = str(settings['resolution'] or resolution or '1080')
+        self.speed = settings['speed']
+        self.quality = settings['quality']
+        self.audio_bitrate = settings['audio_bitrate']
+        self.window = tuple(float(time) for time in window) if window else None
+        self.encoder = encoder if encoder else best_encoder()
+        self.threads = int(threads) if threads else os.cpu_count()
+
+    @classmethod
+    def of(cls, edl: dict):
+        """
+        Returns the profile an edit decision list was planned with, final for lists without one
+        """
+
+        return cls(**edl['profile']) if edl.get('profile') else cls(resolution=edl.get('resolution'))
+
+    def settings(self):
+        """
+        returns the values (dict) the profile is made from, to be saved with an edit decision list
+        """
+
+        return {'name': self.name, 'resolution': self.resolution, 'window': list(self.window) if self.window else None,
+                'encoder': self.encoder, 'threads': self.threads}
+
+    def with_threads(self, threads: int):
+        """
+        returns a copy of the profile whose encodes use threads threads, when several of them run at once
+        """
+
+        return RenderProfile(**dict(self.settings(), threads=max(1, threads)))
+
+    def suffix(self):
+        """
+        returns what is appended to the song name in the outputs of the profile, so that drafts don't replace finals
+        """
+
+        return '' if self.name == 'final' else f"_{self.name}"
+
+    @property
+    def preset(self):
+        return PRESETS.get(self.encoder, {}).get(self.speed)
+
+    def decode_args(self):
+        """
+        returns the ffmpeg options (list) put before an input to decode it on the GPU of the encoder, if possible
+        """
+
+        hwaccel = HWACCELS.get(self.encoder)
+        return ["-hwaccel", hwaccel] if hwaccel and hwaccel in hwaccels() else []
+
+    def quality_args(self, quality: int = None):
+        """
+        returns the ffmpeg options (list) setting the constant quality of the encoder (quality ~ x264 crf, lower is
+        better), the profile quality by default
+        """
+
+        quality = self.quality if quality is None else quality
+        if self.encoder == 'libx264':
+            return ["-crf", str(quality)]
+        elif self.encoder == 'h264_nvenc':
+            return ["-qp", str(quality)]
+        elif self.encoder == 'h264_qsv':
+            return ["-global_quality", str(quality)]
+        elif self.encoder == 'h264_videotoolbox':
+            return ["-q:v", str(max(1, 100 - 2 * quality))]  # 1 to 100, higher is better
+        return ["-q:v", str(max(2, quality // 6))]  # mpeg4 quantiser, 2 to 31
+
+    def encode_args(self, quality: int = None):
+        """
+        returns the ffmpeg options (list) encoding the video stream, see quality_args
+        """
+
+        preset = ["-preset", self.preset] if self.preset else []
+        return ["-c:v", self.encoder, *preset, *self.quality_args(quality), "-threads", str(self.threads)]
+
+    def intermediate_args(self, fps: float, keyframes: list = ()):
+        """
+        returns the ffmpeg options (list) encoding the video stream of proxies and sub videos: a key frame every
+        INTERMEDIATE_GOP seconds and at the keyframes times (list) if given, no B-frames. Files encoded with the same
+        options have the same stream headers, so parts of them can be joined without encoding them again
+        """
+
+        gop = str(max(1, round(fps * INTERMEDIATE_GOP)))
+        forced = ["-force_key_frames", ",".join(f"{time:.6f}" for time in keyframes)] if keyframes else []
+        return [*self.encode_args(INTERMEDIATE_QUALITY), "-g", gop, "-keyint_min", gop, "-sc_threshold", "0", "-bf", "0",
+                *forced]
+
+    def codec_tag(self):
+        """
+        returns the encoder and preset (str) of the profile, added to the names of the files encoded with it
+        """
+
+        return f"{self.encoder}-{self.preset}" if self.preset else self.encoder
+
+    def moviepy_args(self, quality: int = None):
+        """
+        returns the keyword arguments (dict) of moviepy's write_videofile encoding like encode_args
+        """
+
+        return {'codec': self.encoder, 'preset': self.preset if self.preset else 'medium', 'threads': self.threads,
+                'ffmpeg_params': self.quality_args(quality)}
+
+    def audio_window(self):
+        """
+        returns the ffmpeg options (list) put before the song input to only read the window of the profile
+        """
+
+        return ["-ss", str(self.window[0]), "-t", str(self.window[1] - self.window[0])] if self.window else []
@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import threading
+from os.path import join, exists
+
+from tools import evict_least_recent, project_cache_path
+
+'''
+Segment cache: every clip segment rendered by the ffmpeg backend, reused by the sub videos and runs cutting it again
+
+A segment is named after a hash of everything its frames depend on: the file it reads (the path of a proxy, which is
+never modified, the path, size and modification time of other files), where the cut starts, how many frames it lasts,
+its effect and fade, the sub video resolution and frame rate and the intermediate encoding of the render profile.
+Segments all share that encoding (see render_profile.RenderProfile.intermediate_args), so cached ones are joined to new
+ones without encoding them again.
+Re-cutting a section of a song only renders the segments of that section.
+The least recently used segments are deleted once the cache grows over its size budget
+'''
+
+SEGMENT_BUDGET = 10 * 1024 ** 3  # bytes kept in the cache before the least recently used segments are deleted
+
+
+def default_segment_dir(folder: str):
+    """
+    returns project_folder/cache/segments for a folder located in project_folder/
+    """
+
+    return project_cache_path(folder, 'segments')
+
+
+def segment_key(clip: dict, frames: int, resolution, fps: float, encoding: list):
+    """
+    returns the name (str) of the segment of frames frames of a clip, encoded with the encoding ffmpeg options (list)
+    """
+
+    # proxies are named after their content and settings, their modification time only tells when they were last used
+    stat = os.stat(clip['path'])
+    signature = [] if clip.get('source') else [stat.st_size, stat.st_mtime_ns]
+    values = [clip['path'], *signature, clip['start'], frames, clip['effect'], clip['fx'], str(resolution), fps,
+              encoding]
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+
+class SegmentCache:
+    """
+    Hands out the paths of cached segments in cache_dir
+
+    cache_dir (str): where segments are kept (project_folder/cache/segments by default)
+    budget (int): cache size in bytes over which the least recently used segments are deleted
+    """
+
+    def __init__(self, cache_dir: str, budget: int = SEGMENT_BUDGET):
+        self.cache_dir = cache_dir
+        self.budget = budget
+
+    @classmethod
+    def of(cls, folder: str, budget: int = SEGMENT_BUDGET):
+        """
+        Opens the default segment cache of a project folder
+        """
+
+        return cls(default_segment_dir(folder), budget)
+
+    def segment_path(self, key: str):
+        """
+        Returns the path (str) of a segment (see segment_key) in the cache, whether it was rendered or not
+        """
+
+        return join(self.cache_dir, f"{key}.mp4")
+
+    def get(self, key: str):
+        """
+        Returns the path (str) of a cached segment, marked as recently used, None if it wasn't rendered yet
+        """
+
+        path = self.segment_path(key)
+        if not exists(path):
+            return None
+        os.utime(path)
+        return path
+
+    def temp_path(self, key: str):
+        """
+        Returns a path (str) to render a segment to before it's added to the cache with put
+        """
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return f"{self.segment_path(key)}.{os.getpid()}-{threading.get_ident()}.tmp.mp4"
+
+    def put(self, key: str, temp_path: str):
+        """
+        Adds the segment rendered to temp_path to the cache, returns its path (str)
+        """
+
+        path = self.segment_path(key)
+        os.replace(temp_path, path)  # atomic, concurrent renders never read a half written segment
+        return path
+
+    def evict(self, keep=()):
+        """
+        Deletes the least recently used segments, except the keep ones, until the cache fits in its budget
+        """
+
+        evict_least_recent(self.cache_dir, self.budget, keep)
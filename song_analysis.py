@@ -0,0 +1,172 @@
+import json
+import hashlib
+from functools import cached_property
+from os.path import join, split, exists
+
+import beats
+import generate_timestamps
+from tools import project_cache_path, save_json
+
+'''
+Decodes a song once and caches every analysis result on disk, keyed by the song content hash and the parameters used
+'''
+
+ANALYSIS_VERSION = 3  # bump to invalidate cached analyses when the analysis code changes
+
+
+def file_hash(file_path: str, chunk_size: int = 1 << 20):
+    """
+    Returns the sha256 hex digest (str) of a file content, read in chunks
+    """
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_cache_dir(music_file_path: str):
+    """
+    returns project_folder/cache/analysis for a song located in project_folder/music/
+    """
+
+    return project_cache_path(split(music_file_path)[0], 'analysis')
+
+
+class SongAnalysis:
+    """
+    Lazy analysis of a song (.wav): every value is computed on first access from a single decode, then cached on disk
+
+    music_file_path (str): path to song (.wav)
+    bpm (float): tempo of the song, guessed from the audio if not provided
+    cache_dir (str): where results are persisted (default: project_folder/cache/analysis), None to use the default
+    """
+
+    def __init__(self, music_file_path: str, bpm: float = None, cache_dir: str = None):
+        self.music_file_path = music_file_path
+        self.given_bpm = float(bpm) if bpm else None
+        self.cache_dir = cache_dir if cache_dir else default_cache_dir(music_file_path)
+        self.cache_path = join(self.cache_dir, f"{file_hash(music_file_path)}.json")
+        self.cache = self._load_cache()
+
+    def _load_cache(self):
+        if exists(self.cache_path):
+            with open(self.cache_path, "r") as file:
+                cache = json.load(file)
+            if cache.get('version') == ANALYSIS_VERSION:
+                return cache
+        return {'version': ANALYSIS_VERSION, 'song': {}, 'bpm': {}}
+
+    def _save_cache(self):
+        save_json(self.cache_path, self.cache)
+
+    def _cached(self, section: dict, key: str, compute):
+        if key not in section:
+            section[key] = compute()
+            self._save_cache()
+        return section[key]
+
+    @property
+    def _song(self):
+        return self.cache['song']
+
+    @property
+    def _per_bpm(self):
+        return self.cache['bpm'].setdefault(str(self.bpm), {})
+
+    @cached_property
+    def samples(self):
+        """
+        (sample rate, (frames, channels) samples) of the song, memory-mapped once and only if some result is not cached
+        """
+
+        return generate_timestamps.open_wav(self.music_file_path)
+
+    @property
+    def frames(self):
+        return self.samples[1]
+
+    def release(self):
+        """
+        Frees the decoded samples, they are decoded again if a non cached value is requested later
+        """
+
+        self.__dict__.pop('samples', None)
+
+    def analyse(self):
+        """
+        Computes every value in one go (single decode) and frees the samples, returns self
+        """
+
+        _ = self.duration, self.bpm, self.beat_grid, self.counts_in_4_bars, self.timestamps, self.intensities
+        self.release()
+        return self
+
+    @property
+    def duration(self):
+        return self._cached(self._song, 'duration', lambda: generate_timestamps.get_duration(self.music_file_path))
+
+    @property
+    def bpm(self):
+        if self.given_bpm:
+            return self.given_bpm
+        return self._cached(self._song, 'guessed_bpm', self._guess_bpm)
+
+    def _guess_bpm(self):
+        flux, _, fps = self.onset_envelope
+        tempo = beats.estimate_tempo(flux, fps)
+        print(f"Estimated tempo of '{split(self.music_file_path)[1]}' = {tempo}")
+        return tempo
+
+    @cached_property
+    def onset_envelope(self):
+        """
+        (flux, rms, fps) onset envelope of the song (see beats.onset_envelope), the tempo and beat grid are both read
+        from it
+        """
+
+        return generate_timestamps.onset_envelope(*self.samples)
+
+    @property
+    def beat_grid(self):
+        """
+        {'bpm', 'beats', 'downbeats', 'start', 'finish'} beat grid of the song in seconds, see beats.beat_grid
+        """
+
+        return self._cached(self._per_bpm, 'beat_grid', lambda: beats.beat_grid(*self.onset_envelope, self.bpm,
+                                                                                 self.duration))
+
+    @property
+    def first_and_last_down_beat(self):
+        """
+        timestamps (float, float) in seconds of the first and last downbeats of the beat grid
+        """
+
+        return self.beat_grid['start'], self.beat_grid['finish']
+
+    @property
+    def counts_in_4_bars(self):
+        return self._cached(self._per_bpm, 'counts_in_4_bars',
+                            lambda: generate_timestamps.counts_in_4_bars(len(self.frames), self.duration, self.bpm))
+
+    @property
+    def timestamps(self):
+        """
+        timestamps [float, float, ...] of all the 4 bar regions in the song
+        """
+
+        return self._cached(self._per_bpm, 'timestamps', lambda: generate_timestamps.timestamps_between(
+            *self.first_and_last_down_beat, self.bpm))
+
+    @property
+    def intensities(self):
+        """
+        {4barCount(int):intensity(str)} for each 4 bar segment
+        """
+
+        # json objects only have str keys, the block order is kept in a list instead
+        intensities = self._cached(self._per_bpm, 'intensities', lambda: list(
+            generate_timestamps.intensities_of(self.frames, self.duration, self.bpm,
+                                               *self.first_and_last_down_beat).values()))
+        return dict(enumerate(intensities))
@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import threading
+import subprocess
+from os.path import join
+
+import tracing
+from catalog import FootageCatalog
+from compositor import blend_graph
+from ffmpeg_render import render_segments
+from make_sub_movies import ready_plans
+from render_profile import RenderProfile
+from segment_cache import SegmentCache
+
+'''
+Streaming mode: the music video is viewable while it's being rendered
+
+The segments of every sub video are rendered in timeline order (ffmpeg backend, see ffmpeg_render.render_segments) and
+fed as a raw video stream into a named pipe as soon as each one is ready: segments share their encoding, so their
+streams follow each other as one, timed by the frame rate. A single ffmpeg run reads the pipes and the song, blends,
+glitches and muxes the audio live, and writes the result as HLS (a playlist growing by STREAM_SECONDS segments) or as a
+fragmented MP4, which players open before the render ends. Named pipes need a POSIX system
+'''
+
+STREAM_FORMATS = ('hls', 'fmp4')
+STREAM_SECONDS = 2  # seconds between key frames, and of every HLS segment
+ELEMENTARY_FORMATS = {'mpeg4': 'm4v'}  # encoder => ffmpeg format of its raw video stream, h264 otherwise
+
+
+def stream_path(temp_path: str, song_name: str, stream_format: str = 'hls'):
+    """
+    returns the path (str) a player opens to watch the music video streamed in out/: the HLS playlist or the
+    fragmented MP4
+    """
+
+    out_path = temp_path.replace("temp", 'out')
+    if stream_format == 'hls':
+        return join(out_path, f"{song_name}_stream", "index.m3u8")
+    return join(out_path, f"{song_name}_stream.mp4")
+
+
+def elementary_format(profile: RenderProfile):
+    """
+    returns the ffmpeg format (str) of the raw video stream of the segments encoded with profile
+    """
+
+    return ELEMENTARY_FORMATS.get(profile.encoder, 'h264')
+
+
+def feed(edl: dict, pipe_path: str, segments_path: str, counts: dict):
+    """
+    Renders the segments of an edit decision list in timeline order and writes the raw video stream of each one into a
+    named pipe, so that the pipe carries the whole sub video as one stream
+    """
+
+    stream_format = elementary_format(RenderProfile.of(edl))
+    with open(pipe_path, 'wb') as pipe:
+        for path, _ in render_segments(edl, segments_path, counts):
+            subprocess.run(["ffmpeg", "-i", path, "-c", "copy", "-f", stream_format, "-hide_banner", "-loglevel", "error",
+                            "-"], stdout=pipe, check=True)
+
+
+def stream_command(pipe_paths: list, fps: float, music_file_path: str, output_path: str, stream_format: str,
+                   profile: RenderProfile):
+    """
+    returns the ffmpeg command (list) blending and glitching the fps sub video streams of pipe_paths like
+    compositor.filter_graph, with the song audio, into an HLS playlist or a fragmented MP4 written as it goes
+    """
+
+    inputs = []
+    for path in pipe_paths:
+        inputs += ["-f", elementary_format(profile), "-framerate", f"{fps:g}", "-i", path]
+    inputs += [*profile.audio_window(), "-i", music_file_path]
+
+    if stream_format == 'hls':
+        output = ["-f", "hls", "-hls_time", str(STREAM_SECONDS), "-hls_playlist_type", "event",
+                  "-hls_segment_type", "fmp4", "-hls_flags", "independent_segments",
+                  "-hls_segment_filename", join(os.path.split(output_path)[0], "segment%05d.m4s"), output_path]
+    else:
+        output = ["-movflags", "+frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", output_path]
+
+    return ["ffmpeg", *inputs, "-filter_complex", blend_graph(len(pipe_paths)),
+            "-map", "[composite]", "-map", f"{len(pipe_paths)}:a:0", *profile.encode_args(),
+            "-force_key_frames", f"expr:gte(t,n_forced*{STREAM_SECONDS})",
+            "-c:a", "aac", "-b:a", profile.audio_bitrate, "-y", *output, "-hide_banner", "-loglevel", "error"]
+
+
+def stream(plans: list, music_file_path: str, temp_path: str, song_name: str, stream_format: str = 'hls',
+           profile: RenderProfile = None, catalog: FootageCatalog = None, evict: bool = True):
+    """
+    Renders the sub videos of their edit decision lists (see make_sub_movies.plan_sub_movies) and composites them with
+    the song audio in one live pipeline, streamed to stream_path. Returns the path
+
+    catalog and evict: see make_sub_movies.ready_plans
+    """
+
+    if not hasattr(os, 'mkfifo'):
+        raise OSError("streaming needs named pipes (os.mkfifo), which this system doesn't have")
+    profile = profile if profile else RenderProfile.of(plans[0])
+    output_path = stream_path(temp_path, song_name, stream_format)
+    if stream_format == 'hls':
+        shutil.rmtree(os.path.split(output_path)[0], ignore_errors=True)  # segments of a previous stream
+    os.makedirs(os.path.split(output_path)[0], exist_ok=True)
+
+    # the sub videos render side by side with the live composite
+    threads = profile.threads // (len(plans) + 1)
+    plans = [dict(plan, profile=RenderProfile.of(plan).with_threads(threads).settings())
+             for plan in ready_plans(plans, 'ffmpeg', catalog, evict)]
+
+    pipes_path = tempfile.mkdtemp()
+    pipe_paths = [join(pipes_path, f"subVid{i}") for i in range(len(plans))]
+    counts = [{'copied': 0, 'encoded': 0, 'cached': 0} for _ in plans]  # one per feeder thread
+    errors = []
+
+    def run_feed(plan: dict, pipe_path: str, plan_counts: dict):
+        try:
+            feed(plan, pipe_path, os.path.splitext(plan['output_path'])[0] + "_segments", plan_counts)
+        except Exception as error:  # BrokenPipeError too when the composite stopped
+            errors.append(error)
+
+    for pipe_path in pipe_paths:
+        os.mkfifo(pipe_path)
+    feeders = [threading.Thread(target=run_feed, args=arguments) for arguments in zip(plans, pipe_paths, counts)]
+    for feeder in feeders:
+        feeder.start()
+
+    print(f"Streaming {len(plans)} sub videos with audio to {output_path}")
+    try:
+        tracing.run(stream_command(pipe_paths, plans[0]['fps'], music_file_path, output_path, stream_format, profile),
+                    'stream', stream_format=stream_format)
+    finally:
+        for pipe_path in pipe_paths:  # feeders still waiting for the composite to open their pipe give up
+            os.close(os.open(pipe_path, os.O_RDONLY | os.O_NONBLOCK))
+        for feeder in feeders:
+            feeder.join()
+        shutil.rmtree(pipes_path)
+        for plan in plans:
+            shutil.rmtree(os.path.splitext(plan['output_path'])[0] + "_segments", ignore_errors=True)
+
+    if errors:
+        raise errors[0]
+    counts = {name: sum(plan_counts[name] for plan_counts in counts) for name in counts[0]}
+    print(f"Segments: {counts['cached']} reused, {counts['encoded'] + counts['copied']} rendered "
+          f"({counts['copied']} copied from proxies)")
+    if evict:
+        SegmentCache.of(os.path.split(plans[0]['output_path'])[0]).evict()
+    return output_path
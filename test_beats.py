@@ -0,0 +1,38 @@
+import wave
+
+import numpy as np
+import pytest
+
+import beats
+import generate_timestamps
+
+'''
+Beat grid of songs without any bar of audible beats, see beats.beat_grid
+'''
+
+SR = 44100
+
+
+def write_wav(path: str, samples: np.ndarray):
+    with wave.open(path, "wb") as file:
+        file.setnchannels(2)
+        file.setsampwidth(2)
+        file.setframerate(SR)
+        file.writeframes(np.repeat(samples.astype('<i2')[:, None], 2, axis=1).tobytes())
+
+
+@pytest.mark.parametrize('bpm', [None, 128])
+@pytest.mark.parametrize('seconds, tone', [(5, False), (0.5, True), (0.02, True)], ids=['silent', 'sub-second', 'empty'])
+def test_no_audible_bar_spans_the_song(tmp_path, bpm, seconds, tone):
+    path = str(tmp_path / "song.wav")
+    t = np.arange(int(seconds * SR)) / SR
+    write_wav(path, np.sin(2 * np.pi * 440 * t) * 10000 * np.exp(-20 * (t % 0.25)) if tone else np.zeros(len(t)))
+
+    grid = generate_timestamps.guess_beat_grid(path, bpm)
+    assert (grid['start'], grid['finish']) == (0, generate_timestamps.get_duration(path))
+    assert generate_timestamps.guess_first_and_last_down_beat(path, bpm) == (grid['start'], grid['finish'])
+
+
+def test_empty_envelope():
+    grid = beats.beat_grid(np.zeros(0), np.zeros(0), 86.13, 120, 0.01)
+    assert grid == {'bpm': 120, 'beats': [], 'downbeats': [], 'start': 0, 'finish': 0.01}
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+import make_sub_movies
+from edl import plan_edl
+
+'''
+Edit decision lists planned from a seed (see edl.plan_edl), on footage metadata only
+'''
+
+BPM = 128
+START, FINISH, DURATION = 2.0, 62.0, 64.0
+INTENSITIES = dict(enumerate(["Low", "High", "Medium", "Low", "High", "Low", "Medium", "High"]))
+FOOTAGE = [{'path': f"videos/clip{i}.mp4", 'duration': 4.0 + 3 * i,
+            'effect': ['none', 'mirror_x', 'invert_green_blue'][i % 3], 'keyframes': [0.0, 2.0, 4.0, 6.0]}
+           for i in range(8)]
+TITLES = ["titles/intro.mp4", "titles/outro.mp4"]
+
+
+def plan(seed, dynamic='smart_vid', footage=FOOTAGE, snap=False):
+    return plan_edl(BPM, START, FINISH, DURATION, INTENSITIES, dynamic, footage, TITLES, seed, snap)
+
+
+@pytest.mark.parametrize('snap', [False, True])
+@pytest.mark.parametrize('dynamic', ['simple_vid', 'smart_vid'])
+def test_same_seed_same_edl(dynamic, snap):
+    assert plan("7-0", dynamic, snap=snap) == plan("7-0", dynamic, snap=snap)
+    assert plan("7-0", dynamic, list(reversed(FOOTAGE)), snap) == plan("7-0", dynamic, snap=snap)  # scan order
+    assert plan("7-0", dynamic, snap=snap) != plan("8-0", dynamic, snap=snap)
+
+
+def test_edl_fills_the_song():
+    clips = plan("7-0")
+    assert sum(clip['end'] - clip['start'] for clip in clips) == pytest.approx(DURATION)
+    assert all(clip['end'] <= next(video['duration'] for video in FOOTAGE if video['path'] == clip['path'])
+               for clip in clips if not clip['title'])
+
+
+def test_footage_too_short(tmp_path):
+    short = [dict(video, duration=1.0) for video in FOOTAGE]
+    with pytest.raises(ValueError, match="no video lasts"):
+        plan("7-0", footage=short)
+
+    os.makedirs(tmp_path / "titles")
+    (tmp_path / "titles" / "intro.mp4").touch()
+    with pytest.raises(SystemExit, match=r"Can't plan song_subVid0\.mp4: no video lasts .*, add longer videos to"):
+        make_sub_movies.plan_sub_movie(str(tmp_path / "music" / "song.wav"), BPM, short, 0, START, FINISH, DURATION,
+                                       INTENSITIES, '360', 'smart_vid', 7)
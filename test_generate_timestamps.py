@@ -0,0 +1,199 @@
+import sys
+import wave
+
+import numpy as np
+import pytest
+from scipy.io.wavfile import read
+from tinytag import TinyTag
+
+import benchmark
+import generate_timestamps
+
+'''
+Parity of the vectorised waveform analysis with the per sample loops of the original generate_timestamps
+
+The baseline_* functions are copied from the first version of generate_timestamps.py, only split where the loop averages
+are classified and reading the single channel of mono files (the original only read stereo ones). The downbeats are
+now read from the beat grid (see beats.py), the threshold guess they replaced is kept as benchmark.threshold_down_beats
+'''
+
+SR = 8000
+BPM = 128
+
+
+def get_duration(music_file_path: str):
+    return TinyTag.get(music_file_path).duration
+
+
+def read_channel(music_file_path: str):
+    _, data = read(music_file_path)
+    return data[:, 0] if data.ndim > 1 else data  # one stereo channel for ease
+
+
+def baseline_guess_first_and_last_down_beat(music_file_path: str):
+    data = read_channel(music_file_path)
+    highest_db = max(data)
+    count, count2 = 0, 0
+
+    # find first downbeat
+    for count, point in enumerate(data):
+        if point >= (highest_db / 1.5):  # > 0 to avoid noise / ambience
+            break
+
+    # find last downbeat
+    for count2, point in enumerate(data[::-1]):
+        if point >= (highest_db / 1.5):  # > 0 to avoid noise / ambience
+            break
+
+    duration = get_duration(music_file_path)
+
+    return (count / len(data)) * duration, ((len(data) - count2) / len(data)) * duration
+
+
+def baseline_get_counts_in_4_bars(music_file_path: str, bpm: float):
+    data = read_channel(music_file_path)
+
+    length = len(data)
+    duration = get_duration(music_file_path)
+
+    length_of_a_beat = 1 / (bpm / 60)
+    length_of_16_beats = length_of_a_beat * 16  # 4 bars
+
+    # find how many counts in 16 beats
+    for count, point in enumerate(data):
+        if count / length >= length_of_16_beats / duration:
+            return count
+
+
+def baseline_averages(music_file_path: str, bpm: float):
+    duration = get_duration(music_file_path)
+    start, finish = baseline_guess_first_and_last_down_beat(music_file_path)
+    counts_in_4_bars = baseline_get_counts_in_4_bars(music_file_path, bpm)
+
+    intensities = {}
+
+    # analyse waveform
+    data = read_channel(music_file_path)
+
+    length = len(data)
+
+    count_ = 0
+    sum_ = float(0)
+    bar_block = 0  # current index of 4 bar block
+
+    for count, point in enumerate(data):
+        if start / duration <= count / length <= finish / duration:  # only calculate between first and last downbeat
+
+            count_ += 1
+            sum_ += float(abs(point))  # absolute value because deviation from 0 (no volume) is what is important
+
+            if sum_ < 0:
+                sys.exit()
+
+            # calculate and save average every 4 bars
+            if count_ >= counts_in_4_bars:
+                intensities[bar_block] = sum_ / count_
+
+                count_ = 0
+                sum_ = float(0)
+                bar_block += 1
+
+    return intensities
+
+
+def baseline_get_intensities(music_file_path: str, bpm: float):
+    intensities = baseline_averages(music_file_path, bpm)
+
+    max_average_value = max(intensities.values())
+
+    # all intensities are relative to one another
+    for key in intensities.keys():
+        if intensities[key] > 0.96 * max_average_value:
+            intensities[key] = "High"
+        elif intensities[key] > 0.65 * max_average_value:
+            intensities[key] = "Medium"
+        else:
+            intensities[key] = "Low"
+
+    return intensities
+
+
+def write_song(path: str, channels: int, bits: int, seconds: float = 40):
+    """
+    Writes a song (.wav) of clicks in 4 bar sections of varying loudness after a quiet intro, every channel carrying the
+    same samples: the analysis mixes the channels down where the original read the first one
+    """
+
+    rng = np.random.default_rng(bits + channels)
+    t = np.arange(int(seconds * SR)) / SR
+    sections = np.resize([1.0, 0.3, 0.7], int(seconds * BPM / 60 / 16) + 1)
+    loudness = sections[(t * BPM / 60 / 16).astype(int)] * np.where(t < 3, 0.1, 1)
+    signal = np.sin(2 * np.pi * 110 * t) * np.exp(-20 * ((t * BPM / 60) % 1)) * loudness
+    signal += rng.normal(0, 0.002, len(t))
+    # the original abs() overflows on the most negative sample, which is left out
+    samples = np.round(np.clip(signal, -1, 1) * 0.9 * (2 ** (bits - 1) - 1)).astype('<i4')
+    if bits == 8:  # unsigned, silence is 128
+        samples += 128
+    frames = np.repeat(samples[:, None], channels, axis=1)
+    with wave.open(path, "wb") as file:
+        file.setnchannels(channels)
+        file.setsampwidth(bits // 8)
+        file.setframerate(SR)
+        file.writeframes(frames.view('u1').reshape(-1, 4)[:, :bits // 8].tobytes())
+
+
+@pytest.fixture(params=[(1, 16), (2, 16), (1, 24), (2, 24)], ids=lambda case: f"{case[0]}ch-{case[1]}bit")
+def song(request, tmp_path):
+    path = str(tmp_path / "song.wav")
+    write_song(path, *request.param)
+    return path
+
+
+@pytest.fixture(params=[generate_timestamps.BLOCK_SIZE, 10007], ids=['block', 'straddling-blocks'])
+def block_size(request, monkeypatch):
+    monkeypatch.setattr(generate_timestamps, 'BLOCK_SIZE', request.param)
+    return request.param
+
+
+def test_down_beats(song):
+    assert benchmark.threshold_down_beats(song) == baseline_guess_first_and_last_down_beat(song)
+
+
+def test_counts_in_4_bars(song):
+    assert generate_timestamps.get_counts_in_4_bars(song, BPM) == baseline_get_counts_in_4_bars(song, BPM)
+
+
+def test_block_averages(song, block_size):
+    _, data = generate_timestamps.open_wav(song)
+    duration, length = get_duration(song), len(data)
+    start, finish = baseline_guess_first_and_last_down_beat(song)
+    first = generate_timestamps.first_count_reaching(start / duration, length)
+    last = generate_timestamps.first_count_reaching(np.nextafter(finish / duration, np.inf), length)
+
+    averages = generate_timestamps.block_averages(data, first, last, generate_timestamps.counts_in_4_bars(
+        length, duration, BPM))
+    expected = baseline_averages(song, BPM)
+    assert len(averages) == len(expected)
+    np.testing.assert_allclose(averages, list(expected.values()), rtol=1e-12)
+
+
+def test_intensities(song, block_size):
+    _, data = generate_timestamps.open_wav(song)
+    intensities = generate_timestamps.intensities_of(data, get_duration(song), BPM,
+                                                     *baseline_guess_first_and_last_down_beat(song))
+    expected = baseline_get_intensities(song, BPM)
+    assert intensities == expected
+    assert set(expected.values()) == {"High", "Medium", "Low"}
+
+
+def test_unsigned_8_bit(tmp_path):
+    paths = {bits: str(tmp_path / f"{bits}.wav") for bits in (8, 16)}
+    for bits, path in paths.items():
+        write_song(path, 2, bits)
+    (_, unsigned), (_, signed) = generate_timestamps.open_wav(paths[8]), generate_timestamps.open_wav(paths[16])
+    assert generate_timestamps.full_scale(unsigned) == 128
+    assert abs(np.mean(next(generate_timestamps.mono_blocks(unsigned))[1])) < 1
+
+    bounds = baseline_guess_first_and_last_down_beat(paths[16])
+    assert generate_timestamps.intensities_of(unsigned, get_duration(paths[8]), BPM, *bounds) == \
+        generate_timestamps.intensities_of(signed, get_duration(paths[16]), BPM, *bounds)
@@ -0,0 +1,14 @@
+import pytest
+
+from benchmark import ENTRY_MODULES, IMPORT_BUDGET, import_time
+
+'''
+Import time budget of the entry modules, see benchmark.bench_imports for the timings
+'''
+
+
+@pytest.mark.parametrize('module', ENTRY_MODULES)
+def test_import_budget(module):
+    seconds, loaded = import_time(module)
+    assert seconds <= IMPORT_BUDGET, f"import {module} takes {seconds:.3f}s, over the {IMPORT_BUDGET}s budget"
+    assert not loaded, f"import {module} loads {', '.join(loaded)}, which should only be imported when used"
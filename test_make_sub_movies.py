@@ -0,0 +1,67 @@
+import os
+import subprocess
+import concurrent.futures
+from os.path import join
+
+import pytest
+
+import ffmpeg_render
+import make_sub_movies
+from benchmark import make_project
+from footage import FootagePool
+from song_analysis import SongAnalysis
+
+'''
+A sub video rendered in time slices (see make_sub_movies.render_sliced) against the same plan rendered in one piece
+'''
+
+SECONDS = 12
+SLICES = 3
+
+
+@pytest.fixture(scope='module')
+def plan(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp('project'))
+    music_file_path = make_project(folder, SECONDS, clips=4, height=144)
+    analysis = SongAnalysis(music_file_path, 128)
+    start, finish = analysis.first_and_last_down_beat
+    footage = FootagePool.scan(join(folder, 'videos' + os.sep), 144, seed=0).footage
+    return make_sub_movies.plan_sub_movie(music_file_path, 128, footage, 0, start, finish, analysis.duration,
+                                          analysis.intensities, '144', 'smart_vid', 0)
+
+
+def frame_times(video_path: str):
+    lines = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "frame=pts_time",
+                            "-of", "csv=p=0", video_path], check=True, capture_output=True, text=True).stdout.split()
+    return [float(line.split(',')[0]) for line in lines]  # frames carrying side data end with an extra column
+
+
+def frame_hashes(video_path: str):
+    lines = subprocess.run(["ffmpeg", "-i", video_path, "-map", "0:v", "-f", "framemd5", "-", "-hide_banner",
+                            "-loglevel", "error"], check=True, capture_output=True, text=True).stdout.splitlines()
+    return [line.split(',')[-1].strip() for line in lines if not line.startswith('#')]
+
+
+def render_both(plan: dict, render):
+    serial, sliced = (dict(plan, output_path=plan['output_path'].replace('.mp4', f"_{name}.mp4"))
+                      for name in ('serial', 'sliced'))
+    render(serial)
+    chunks = make_sub_movies.split_edl(sliced, SLICES)
+    assert len(chunks) > 1
+    make_sub_movies.render_sliced([sliced], render, concurrent.futures.ThreadPoolExecutor, SLICES)
+    assert not any(os.path.exists(chunk['output_path']) for chunk in chunks)
+    return serial['output_path'], sliced['output_path']
+
+
+def test_ffmpeg_slices_are_frame_identical(plan):
+    serial, sliced = render_both(plan, ffmpeg_render.render_edl)
+    assert frame_times(sliced) == frame_times(serial)
+    assert frame_hashes(sliced) == frame_hashes(serial)
+
+
+def test_moviepy_slices_keep_the_frame_times(plan):
+    # every slice is encoded on its own, so only the frames shown and their times are compared
+    serial, sliced = render_both(plan, make_sub_movies.render_sub_movie)
+    times = frame_times(serial)
+    assert len(times) == round(sum(clip['end'] - clip['start'] for clip in plan['clips']) * plan['fps'])
+    assert frame_times(sliced) == times
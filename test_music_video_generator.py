@@ -0,0 +1,65 @@
+import os
+import argparse
+
+import pytest
+
+import music_video_generator
+from benchmark import make_project
+from render_profile import RenderProfile
+
+'''
+Stages of the pipeline rebuilt by music_video_generator.build_pipeline when parameters change, on a synthetic project
+'''
+
+RENDERED = ['analysis', 'plan', 'render0', 'render1']
+
+
+@pytest.fixture(scope='module')
+def project(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp('project'))
+    make_project(folder, 12, clips=4, height=144)
+    return folder
+
+
+def song_args(project: str, **changes):
+    args = argparse.Namespace(project_folder=project, bpm=128, complexity='2', dynamic=True, outputs=[],
+                              parallel_proc=False, workers=1, backend='ffmpeg', seed=0, snap_keyframes=False,
+                              compositor='filter_graph', stream_format='', dry_run=False, catalog=None, evict=True,
+                              profile=RenderProfile(resolution='144'))
+    vars(args).update(changes)
+    return music_video_generator.song_args(args, 'song.wav')
+
+
+def run(project: str, dry_run: bool = False, **changes):
+    return music_video_generator.build_pipeline(song_args(project, **changes)).run(dry_run)
+
+
+def test_changed_bpm_rebuilds_what_depends_on_it(project, capsys):
+    run(project)
+    assert run(project, dry_run=True) == []
+
+    manifest = os.path.join(project, 'cache', 'song_stages.json')
+    with open(manifest) as file:
+        before = file.read()
+    capsys.readouterr()
+    assert run(project, dry_run=True, bpm=120) == [*RENDERED, 'composite']
+    assert "   rebuild  plan (inputs or parameters changed)" in capsys.readouterr().out.splitlines()
+    with open(manifest) as file:
+        assert file.read() == before  # a dry run builds nothing
+
+    assert run(project, bpm=120) == [*RENDERED, 'composite']
+    capsys.readouterr()
+    assert run(project, bpm=120) == []
+    assert all(line.startswith("up to date") for line in capsys.readouterr().out.splitlines())
+
+
+def test_switching_compositor_rebuilds_the_composite(project, capsys):
+    run(project)
+    assert run(project, compositor='cascade') == ['blend', 'glitch', 'mux']
+    assert run(project, compositor='cascade') == []
+
+    capsys.readouterr()
+    assert run(project, dry_run=True) == ['composite']
+    assert "   rebuild  composite (output written by mux)" in capsys.readouterr().out.splitlines()
+    assert run(project) == ['composite']
+    assert run(project, compositor='cascade') == ['mux']
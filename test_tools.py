@@ -0,0 +1,56 @@
+import subprocess
+
+import numpy as np
+import pytest
+
+import tools
+from benchmark import reference_effect
+from ffmpeg_render import EFFECT_FILTERS
+
+'''
+Clip effects (see tools.EFFECTS) against the per frame effects of the original preload (benchmark.reference_effect),
+applied to the frames in python and by their ffmpeg filters
+'''
+
+HEIGHT, WIDTH, FPS = 36, 64, 10
+FRAMES = np.random.default_rng(0).integers(0, 256, (3, HEIGHT, WIDTH, 3), dtype=np.uint8)
+OPERATIONS = {  # what every operation does to a frame, as the original preload did it
+    'swap_green_blue': lambda image: image[:, :, [0, 2, 1]],
+    'mirror_x': lambda image: image[:, ::-1],
+    'mirror_y': lambda image: image[::-1],
+}
+
+
+def clip():
+    from moviepy.editor import VideoClip
+
+    return VideoClip(lambda t: FRAMES[int(round(t * FPS))], duration=len(FRAMES) / FPS)
+
+
+@pytest.mark.parametrize('operation', [*tools.FLIPS, 'swap_green_blue'])
+def test_operation(operation):
+    apply = tools.frame_effect((operation,))
+    for frame in FRAMES:
+        result = apply(frame)
+        assert np.array_equal(result, OPERATIONS[operation](frame))
+        assert np.shares_memory(result, frame) == (operation in tools.FLIPS)  # flips are views, nothing is copied
+
+
+@pytest.mark.parametrize('effect', tools.EFFECTS)
+def test_effect_frames(effect):
+    # the swapped frame buffer is reused: every frame is checked before the next one overwrites it
+    applied, reference = tools.apply_effect(clip(), effect), reference_effect(clip(), effect)
+    assert applied.effect == effect
+    for i in range(len(FRAMES)):
+        assert np.array_equal(applied.get_frame(i / FPS), reference.get_frame(i / FPS))
+
+
+@pytest.mark.parametrize('effect', tools.EFFECTS)
+def test_effect_filters(effect):
+    filtered = subprocess.run(["ffmpeg", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{WIDTH}x{HEIGHT}", "-i", "-",
+                               "-vf", ",".join(EFFECT_FILTERS[effect]) or "null", "-f", "rawvideo", "-pix_fmt", "rgb24",
+                               "-", "-hide_banner", "-loglevel", "error"], input=FRAMES.tobytes(), check=True,
+                              capture_output=True).stdout
+    reference = reference_effect(clip(), effect)
+    assert np.array_equal(np.frombuffer(filtered, np.uint8).reshape(FRAMES.shape),
+                          [reference.get_frame(i / FPS) for i in range(len(FRAMES))])
@@ -0,0 +1,172 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import video_downloader
+
+'''
+Resumable downloads (see video_downloader.download_from_url) from a local stand-in for a video CDN, and searches
+(see video_downloader.plan_downloads) of a stand-in provider
+'''
+
+DATA = bytes(range(256)) * 1000
+GLOBAL_ARGS = {'size': 'large', 'ratio': 16 / 9, 'minWidth': 1920, 'minHeight': 1080, 'per_page': 8, 'video_nb': 6,
+               'ratio_strict': 1, 'keep_all': 0, 'sub_folders': True}
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves DATA with keep-alive and HTTP Range, or misbehaving as mode says:
+    'ignore_range' answers every request with the whole file (200), 'from_start' answers a range with the whole file
+    (206), 'truncate' and 'truncate_unsized' close the connection half way, with and without Content-Length
+    """
+
+    protocol_version = 'HTTP/1.1'
+    mode = 'range'
+    received = []  # (Range header, bytes sent) of every request
+
+    def do_GET(self):
+        start = int(self.headers['Range'][6:].split('-')[0]) if self.headers['Range'] else 0
+        if self.mode in ('ignore_range', 'from_start'):
+            start = 0
+        if start >= len(DATA):
+            self.received.append((self.headers['Range'], 0))  # before answering, the client may check it right after
+            self.send_response(416)
+            self.send_header('Content-Range', f"bytes */{len(DATA)}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = DATA[start:]
+        sent = len(body) // 2 if self.mode.startswith('truncate') else len(body)
+        self.received.append((self.headers['Range'], sent))
+        self.send_response(206 if self.headers['Range'] and self.mode != 'ignore_range' else 200)
+        if self.mode != 'truncate_unsized':
+            self.send_header('Content-Length', str(len(body)))
+        if self.headers['Range'] and self.mode != 'ignore_range':
+            self.send_header('Content-Range', f"bytes {start}-{len(DATA) - 1}/{len(DATA)}")
+        self.end_headers()
+        self.close_connection = sent < len(body)
+        self.wfile.write(body[:sent])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def url(server, monkeypatch):
+    monkeypatch.setattr(RangeHandler, 'received', [])
+    # a session per test: a connection left by another test may have been closed by the server
+    monkeypatch.setattr(video_downloader, '_sessions', threading.local())
+    return f"http://127.0.0.1:{server.server_address[1]}/clip.mp4"
+
+
+def download(url, tmp_path, part=None, size=None):
+    file_path = str(tmp_path / "clip.mp4")
+    if part is not None:
+        with open(file_path + ".part", "wb") as file:
+            file.write(part)
+    video_downloader.download_from_url(url, file_path, size=size)
+    with open(file_path, "rb") as file:
+        return file.read()
+
+
+def test_download(url, tmp_path):
+    assert download(url, tmp_path) == DATA
+    assert RangeHandler.received == [(None, len(DATA))]
+    assert not os.path.exists(str(tmp_path / "clip.mp4.part"))
+
+
+def test_resume_sends_the_remaining_bytes(url, tmp_path):
+    assert download(url, tmp_path, DATA[:1000]) == DATA
+    assert RangeHandler.received == [("bytes=1000-", len(DATA) - 1000)]
+
+
+@pytest.mark.parametrize('size', [None, len(DATA)])
+def test_complete_part_is_kept(url, tmp_path, size):
+    assert download(url, tmp_path, DATA, size) == DATA
+    assert RangeHandler.received == [(f"bytes={len(DATA)}-", 0)]
+
+
+@pytest.mark.parametrize('size', [None, len(DATA)])
+def test_oversized_part_starts_over(url, tmp_path, size):
+    assert download(url, tmp_path, DATA + b"stale", size) == DATA
+    assert RangeHandler.received == [(f"bytes={len(DATA) + 5}-", 0), (None, len(DATA))]
+
+
+@pytest.mark.parametrize('mode', ['ignore_range', 'from_start'])
+def test_range_not_honoured_starts_over(url, tmp_path, monkeypatch, mode):
+    monkeypatch.setattr(RangeHandler, 'mode', mode)
+    assert download(url, tmp_path, b"stale" * 100) == DATA
+
+
+@pytest.mark.parametrize('mode', ['truncate', 'truncate_unsized'])
+def test_truncated_download_is_not_renamed(url, tmp_path, monkeypatch, mode):
+    monkeypatch.setattr(RangeHandler, 'mode', mode)
+    with pytest.raises((requests.RequestException, IOError)):
+        download(url, tmp_path, size=len(DATA))
+    assert not os.path.exists(str(tmp_path / "clip.mp4"))
+
+    # the part file is resumed from where it stopped, empty when the body was cut in the first chunk read
+    part = os.path.getsize(str(tmp_path / "clip.mp4.part"))
+    monkeypatch.setattr(RangeHandler, 'mode', 'range')
+    assert part < len(DATA) and download(url, tmp_path, size=len(DATA)) == DATA
+    assert RangeHandler.received[-1] == (f"bytes={part}-" if part else None, len(DATA) - part)
+
+
+class PageProvider:
+    """
+    Stand-in for a video provider: 5 pages of 8 videos of which 1 in 4 qualifies, the others being 4:3, too small or
+    without a downloadable file. Pages asked are kept in calls
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def search(self, query: str, page: int, global_args: dict):
+        self.calls.append(page)
+        sizes = [(1920, 1080), (1920, 1440), (1280, 720), (1920, 1080)]
+        videos = [{'id': f"{query}{page}_{i}", 'width': sizes[i % 4][0], 'height': sizes[i % 4][1],
+                   'url': f"http://127.0.0.1/{query}{page}_{i}.mp4" if i % 4 != 3 else None, 'size': 1000}
+                  for i in range(global_args['per_page'])]
+        return videos, page < 5
+
+
+@pytest.fixture
+def provider():
+    return PageProvider()
+
+
+def plan(provider, tmp_path):
+    return video_downloader.plan_downloads(['sea'], str(tmp_path / "videos"), {
+        'global': GLOBAL_ARGS, 'fake': {'use_api': 1, 'provider': provider}})
+
+
+def test_search_stops_once_enough_videos_qualify(provider, tmp_path):
+    downloads = plan(provider, tmp_path)
+    assert len(downloads) == GLOBAL_ARGS['video_nb']
+    assert provider.calls == [1, 2, 3]  # 2 qualifying videos per page
+
+
+def test_search_filters_before_downloading(provider, tmp_path):
+    downloads = plan(provider, tmp_path)
+    assert all(url.rsplit('_', 1)[1] in ('0.mp4', '4.mp4') for url, _, _, _ in downloads)
+    assert [(source, size) for _, _, source, size in downloads][:2] == [('fake:sea1_0', 1000), ('fake:sea1_4', 1000)]
+
+
+def test_search_cached(provider, tmp_path):
+    downloads = plan(provider, tmp_path)
+    provider.calls.clear()
+    assert plan(provider, tmp_path) == downloads
+    assert provider.calls == []
@@ -1,15 +1,58 @@
+import os
+import json
 import random
-from moviepy.editor import *
+import threading
+import subprocess
+import numpy as np
+from os.path import join, split, normpath, exists, getsize
 
 
 PERCENTS = (0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100)
 
+# every effect as the operations it is made of: applied to the frames by apply_effect (moviepy backend), turned into
+# decoder side filters by ffmpeg_render.EFFECT_FILTERS (ffmpeg backend)
+EFFECTS = {
+    'none': (),
+    'invert_green_blue': ('swap_green_blue',),
+    'mirror_x': ('mirror_x',),
+    'invert_green_blue_mirror_y': ('swap_green_blue', 'mirror_y'),
+}
 
-def invert_green_blue(image):
+FLIPS = {
+    'mirror_x': (slice(None), slice(None, None, -1)),
+    'mirror_y': (slice(None, None, -1),),
+}
+
+
+def frame_effect(operations: tuple):
     """
-    Inverts green and blue pixels of a clip (VideoFileClip)
+    Returns a function applying operations (see EFFECTS) to the frames of a clip, None if there is none
+
+    Flips are views of the decoded frame, nothing is copied. Swapping green and blue writes into a frame allocated once
+    per clip (decoded frames are read-only and cached by the reader): it is overwritten by the next frame of the clip,
+    moviepy copies it into the composition first
     """
-    return image[:, :, [0, 2, 1]]
+
+    if not operations:
+        return None
+    flips = [FLIPS[operation] for operation in operations if operation in FLIPS]
+    swap = 'swap_green_blue' in operations
+    buffer = []
+
+    def apply(image):
+        for flip in flips:
+            image = image[flip]
+        if not swap:
+            return image
+        if not buffer or buffer[0].shape != image.shape:
+            buffer[:] = [np.empty(image.shape, image.dtype)]
+        swapped = buffer[0]
+        swapped[:, :, 0] = image[:, :, 0]
+        swapped[:, :, 1] = image[:, :, 2]
+        swapped[:, :, 2] = image[:, :, 1]
+        return swapped
+
+    return apply
 
 
 def get_closest_percent(percent):
@@ -21,30 +64,112 @@ def get_closest_percent(percent):
             return p
 
 
-def preload(videos_path, resolution):
+def random_effect(rng=random):
+    """
+    returns a random effect name, to give illusion of change between videos
+    """
+
+    randomizer = rng.random()
+    if randomizer < 0.3:
+        return 'none'
+    elif randomizer < 0.6:
+        return 'invert_green_blue'
+    elif randomizer < 0.9:
+        return 'mirror_x'
+    else:
+        return 'invert_green_blue_mirror_y'
+
+
+def apply_effect(clip, effect: str):
     """
-    preloads all video files once
+    applies an effect from random_effect to a clip (VideoFileClip), the effect name is kept in clip.effect
     """
 
-    videos_list = []
+    apply = frame_effect(EFFECTS[effect])
+    if apply:
+        clip = clip.fl_image(apply)  # one frame function for all the operations of the effect
+    clip.effect = effect
+    return clip
+
+
+def open_clip(path: str, resolution, effect: str = 'none'):
+    """
+    opens a video file at the given resolution (ex: 1080 or 720) with an effect from random_effect, without its audio
+    """
+
+    from moviepy.editor import VideoFileClip  # moviepy is only imported by the moviepy render backend
+
     width, height = int(int(resolution) * (16 / 9)), int(resolution)
-    print('Preloading videos from video path "{}"'.format(videos_path))
-
-    for vid in os.listdir(videos_path):
-        # seed to randomise individual videos orientation / colour to give illusion of change between videos
-        randomizer = random.random()
-        if randomizer < 0.3:
-            videos_list.append(VideoFileClip(videos_path + vid, target_resolution=(height, width)))
-        elif randomizer < 0.6:
-            videos_list.append(VideoFileClip(videos_path + vid, target_resolution=(height, width)).fl_image(invert_green_blue))
-        elif randomizer < 0.9:
-            videos_list.append(VideoFileClip(videos_path + vid, target_resolution=(height, width)).fx(vfx.mirror_x))
-        else:
-            videos_list.append(VideoFileClip(videos_path + vid, target_resolution=(height, width)).fl_image(invert_green_blue).fx(vfx.mirror_y))
-
-    for vid in videos_list:
-        if vid.size[0] > width or vid.size[1] > height:
-            print(vid.filename)
-            videos_list.remove(vid)
-
-    return videos_list
+    return apply_effect(VideoFileClip(path, target_resolution=(height, width), audio=False), effect)
+
+
+def project_cache_path(folder: str, name: str):
+    """
+    returns project_folder/cache/name for a folder located in project_folder/
+    """
+
+    return join(split(normpath(folder))[0], 'cache', name)
+
+
+def save_json(path: str, value, indent: int = None):
+    """
+    Writes value to the .json file path through a temporary file replacing it at once: concurrent runs never read a
+    half written file, an interrupted one never leaves one
+    """
+
+    os.makedirs(split(path)[0] or os.curdir, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(value, file, indent=indent)
+    os.replace(temp_path, path)
+
+
+def evict_least_recent(folder: str, budget: int, keep=()):
+    """
+    Deletes the least recently used files of a cache folder (oldest modification time first, caches touch the files
+    they hand out), except the keep ones and the .tmp files being written, until it holds at most budget bytes
+    """
+
+    if not exists(folder):
+        return
+    paths = [join(folder, name) for name in os.listdir(folder) if '.tmp' not in name]
+    size = sum(getsize(path) for path in paths)
+    for path in sorted(paths, key=os.path.getmtime):
+        if size <= budget:
+            break
+        if path not in keep:
+            size -= getsize(path)
+            os.remove(path)
+
+
+def probe_video(path: str):
+    """
+    returns the metadata (dict) of a video file: path, duration, width, height, fps and codec, without decoding it
+    """
+
+    output = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+                             "stream=width,height,avg_frame_rate,codec_name:format=duration", "-of", "json", path],
+                            check=True, capture_output=True, text=True).stdout
+    info = json.loads(output)
+    stream = info['streams'][0]
+    numerator, denominator = stream['avg_frame_rate'].split('/')
+    return {'path': path, 'duration': float(info['format']['duration']), 'width': stream['width'],
+            'height': stream['height'], 'fps': float(numerator) / float(denominator) if float(denominator) else 0.0,
+            'codec': stream['codec_name']}
+
+
+def keyframe_index(path: str):
+    """
+    returns the key frames of the first video stream of a file, read from its packet flags without decoding it:
+    {'keyframes': times in seconds from the start of the stream (list), 'frames': number of frames (int)}
+    """
+
+    output = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+                             "stream=start_time:packet=pts_time,flags", "-of", "json", path],
+                            check=True, capture_output=True, text=True).stdout
+    info = json.loads(output)
+    start = float(info['streams'][0].get('start_time', 0)) if info.get('streams') else 0.0
+    packets = [packet for packet in info.get('packets', []) if packet.get('pts_time', 'N/A') != 'N/A']
+    return {'keyframes': sorted(round(float(packet['pts_time']) - start, 6) for packet in packets
+                                if 'K' in packet['flags']),
+            'frames': len(packets)}
@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import time
+import threading
+import contextlib
+import subprocess
+
+'''
+Spans timing the pipeline stages, the sub video renders and every ffmpeg run, exported as a Chrome trace
+
+Tracing is off until start(trace_dir) is called: spans then append their events to trace_dir/<pid>.jsonl, worker
+processes inherit the folder through the environment. export() merges the events of every process into a .json trace
+loadable in chrome://tracing or https://ui.perfetto.dev, summary() prints where the time went
+'''
+
+TRACE_DIR_VARIABLE = 'MVG_TRACE_DIR'  # environment variable holding the trace folder, inherited by worker processes
+GROUPED = ('song', 'sub video')  # categories of spans summed up in the summary whatever their name
+
+_lock = threading.Lock()
+
+
+def start(trace_dir: str):
+    """
+    Starts recording spans of this process and of the worker processes it starts into trace_dir
+    """
+
+    os.makedirs(trace_dir, exist_ok=True)
+    for name in os.listdir(trace_dir):  # events of a previous run
+        if name.endswith('.jsonl'):
+            os.remove(os.path.join(trace_dir, name))
+    os.environ[TRACE_DIR_VARIABLE] = trace_dir
+
+
+def enabled():
+    return bool(os.environ.get(TRACE_DIR_VARIABLE))
+
+
+def _emit(event: dict):
+    path = os.path.join(os.environ[TRACE_DIR_VARIABLE], f"{os.getpid()}.jsonl")
+    with _lock, open(path, "a") as file:
+        file.write(json.dumps(event) + "\n")
+
+
+@contextlib.contextmanager
+def span(name: str, category: str = 'stage', **args):
+    """
+    Times the enclosed code (wall and CPU time of the current thread) as a span of the trace. Spans of the same thread
+    nest. The yielded dict takes extra values shown with the span
+    """
+
+    if not enabled():
+        yield args
+        return
+
+    start_us, wall, cpu = time.time() * 1e6, time.perf_counter(), time.thread_time()
+    try:
+        yield args
+    finally:
+        args.update(cpu_seconds=round(time.thread_time() - cpu, 3))
+        _emit({'name': name, 'cat': category, 'ph': 'X', 'ts': start_us, 'dur': (time.perf_counter() - wall) * 1e6,
+               'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+
+
+def run(command: list, name: str = None, **args):
+    """
+    Runs an ffmpeg (or ffpb) command as subprocess.run(command, check=True) does, inside a span holding its exit status,
+    the CPU time of the process, and the number of frames and speed read from ffmpeg -progress
+    """
+
+    name = name if name else command[0]
+    if command[0] not in ('ffmpeg', 'ffpb'):
+        with span(name, 'process', command=" ".join(command), **args) as values:
+            process = subprocess.run(command, check=True)
+            values['exit_status'] = process.returncode
+            return process
+
+    with span(name, 'ffmpeg', command=" ".join(command), **args) as values:
+        with subprocess.Popen([command[0], "-progress", "pipe:1", *command[1:]], stdout=subprocess.PIPE,
+                              text=True) as process:
+            progress = {}
+            for line in process.stdout:  # key=value lines, a block every half second
+                key, _, value = line.strip().partition('=')
+                progress[key] = value
+            if hasattr(os, 'wait4'):  # CPU time of ffmpeg itself, not of this thread
+                _, status, usage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+                values['process_cpu_seconds'] = round(usage.ru_utime + usage.ru_stime, 3)
+        values.update(exit_status=process.returncode, frames=int(progress.get('frame', 0) or 0),
+                      fps=float(progress.get('fps', 0) or 0), speed=progress.get('speed', '').strip())
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return process
+
+
+def events(trace_dir: str = None):
+    """
+    Returns the events (list of dict) recorded in trace_dir (the current trace folder by default) by every process
+    """
+
+    trace_dir = trace_dir if trace_dir else os.environ[TRACE_DIR_VARIABLE]
+    recorded = []
+    for name in sorted(os.listdir(trace_dir)):
+        if name.endswith('.jsonl'):
+            with open(os.path.join(trace_dir, name), "r") as file:
+                recorded += [json.loads(line) for line in file if line.strip()]
+    return sorted(recorded, key=lambda event: event['ts'])
+
+
+def export(trace_path: str, trace_dir: str = None):
+    """
+    Writes the recorded events as a Chrome trace (.json) to trace_path
+    """
+
+    with open(trace_path, "w") as file:
+        json.dump({'traceEvents': events(trace_dir), 'displayTimeUnit': 'ms'}, file)
+
+
+def summary(trace_dir: str = None):
+    """
+    Prints the number of runs, wall time and CPU time of every kind of span, the longest first. Numbered spans
+    (render0, render1...) are counted together
+    """
+
+    totals = {}
+    for event in events(trace_dir):
+        name = ", ".join(dict.fromkeys(re.sub(r'\d+', '', event['name']).split(", ")))  # render0, render1 => render
+        key = event['cat'], '' if event['cat'] in GROUPED else name
+        count, wall, cpu, frames = totals.get(key, (0, 0, 0, 0))
+        totals[key] = (count + 1, wall + event['dur'] / 1e6,
+                       cpu + event['args'].get('process_cpu_seconds', event['args']['cpu_seconds']),
+                       frames + event['args'].get('frames', 0))
+
+    print(f"{'span':<32}{'runs':>6}{'wall (s)':>11}{'cpu (s)':>10}{'frames':>9}")
+    for (category, name), (count, wall, cpu, frames) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        print(f"{(category + ' ' + name).strip():<32}{count:>6}{wall:>11.2f}{cpu:>10.2f}{frames if frames else '':>9}")
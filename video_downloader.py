@@ -1,37 +1,93 @@
 import os
+import json
 import math
+import time
+import hashlib
 import requests
+import threading
+import concurrent.futures
 import logging as log
 from tqdm import tqdm
 
-import pixabay.core
-from pexelsapi.pexels import Pexels
+from tools import project_cache_path, save_json
+from footage_store import FootageStore
 
 # TODO:
 # Import api_keys from text file => Done
 # Add coverr.co: https://api.coverr.co/docs/
 # free video footage, SplitShire Videos, Clipstill, Videezy, lifeofvids
 
-# Get API_KEYS
-f = open("api_keys.txt", "r")
-pixabay_api_key = f.readline().replace('\n', '')
-pexels_api_key = f.readline().replace('\n', '')
+SEARCH_TTL = 24 * 3600  # seconds search results are reused before asking the provider again
+DOWNLOAD_WORKERS = 8  # files downloaded at once
+CHUNK_SIZE = 1 << 20  # bytes written at a time, a download never holds more than this in memory
+
+_sessions = threading.local()  # one pooled HTTP session (keep-alive connections) per download thread
+
+
+def default_args():
+    """
+    Returns the download arguments used when running this file, with API clients built from api_keys.txt
+    """
+
+    import pixabay.core
+    from pexelsapi.pexels import Pexels
+
+    # Get API_KEYS
+    with open("api_keys.txt", "r") as f:
+        pixabay_api_key = f.readline().replace('\n', '')
+        pexels_api_key = f.readline().replace('\n', '')
+
+    return {
+        'global': {'size': 'large', 'ratio': 16 / 9, 'minWidth': 1920, 'minHeight': 1080,
+                   'per_page': 100, 'video_nb': 20, 'ratio_strict': 1, 'keep_all': 0, 'sub_folders': True},
+        'pixabay': {'use_api': 1, 'px': pixabay.core(pixabay_api_key),
+                    'lang': 'en', 'orientation': 'horizontal', 'colors': 'all'},
+        'pexels': {'use_api': 1, 'px': Pexels(pexels_api_key),
+                   'lang': 'en-US', 'orientation': 'landscape', 'colors': ''}
+    }
+
 
 # Init parameters
 queries = ['ocean', 'boat', 'mariners', 'old ship', 'sailors', 'sea']
 output_dir = 'G:\\BANQUES_VIDEOS'
-args = {
-    'global': {'size': 'large', 'ratio': 16 / 9, 'minWidth': 1920, 'minHeight': 1080,
-               'per_page': 100, 'video_nb': 20, 'ratio_strict': 1, 'keep_all': 0, 'sub_folders': True},
-    'pixabay': {'use_api': 1, 'px': pixabay.core(pixabay_api_key),
-                'lang': 'en', 'orientation': 'horizontal', 'colors': 'all'},
-    'pexels': {'use_api': 1, 'px': Pexels(pexels_api_key),
-               'lang': 'en-US', 'orientation': 'landscape', 'colors': ''}
-}
 
 
-def video_downloader(queries: list, output_dir: str, args: dict):
+def video_downloader(queries: list, output_dir: str, args: dict, workers: int = DOWNLOAD_WORKERS):
+    """
+    Downloads the videos matching queries from every provider of args into output_dir, workers files at once
+
+    Each video is downloaded once into the footage store of output_dir (see footage_store.py), even when several
+    queries find it, and the query folders link to the stored file
+    """
+
+    store = FootageStore.of(output_dir)
+    urls, destinations = {}, {}  # source (provider:id) => (url, size), paths in the query folders
+    for url, file_path, source, size in plan_downloads(queries, output_dir, args, store=store):
+        urls[source] = url, size
+        destinations.setdefault(source, []).append(file_path)
+
+    failures = download_all([(url, store.incoming_path(source), size) for source, (url, size) in urls.items()],
+                            workers)
+    for source in urls:
+        if store.incoming_path(source) not in failures:
+            store.add(store.incoming_path(source), source, destinations[source])
+    for file_path, error in failures.items():
+        print(f"Could not download {file_path}: {error}")
+    return failures
+
+
+def plan_downloads(queries: list, output_dir: str, args: dict, cache=None, store=None):
+    """
+    Returns the (url, file_path, source, size) of the videos to download for queries, from every provider of args,
+    source being provider:id and size the bytes of the file reported by the provider (None if it doesn't)
+
+    Search results pages are fetched lazily (and cached, see SearchCache) until enough videos qualify for each query and
+    provider, videos are filtered before any download. Videos already in store (FootageStore) are linked, not returned
+    """
+
     global_args = args['global']
+    cache = cache if cache else SearchCache(default_search_cache_dir(output_dir))
+    downloads = []
     # Loop on queries
     for query in queries:
         file_destination = os.path.join(output_dir, "".join(ch for ch in query if ch.isalnum())) \
@@ -40,61 +96,253 @@ def video_downloader(queries: list, output_dir: str, args: dict):
         # Loop on sources
         for key in args:
             if key != 'global' and args[key]['use_api']:
-                videos = get_video_list(query, key, args[key], global_args)
-                video_counter = min(math.ceil(global_args['video_nb']/(len(args)-1)), len(videos))
-                progress_bar = tqdm(total=video_counter, position=0, leave=True,
-                                    desc=f"{key} video download progress for query '{query}'")
-                # Loop on videos
+                video_counter = math.ceil(global_args['video_nb']/(len(args)-1))
+                # Loop on videos, page after page
+                videos = search_videos(query, key, args[key], global_args, cache) if video_counter else []
                 for vid in videos:
-                    progress_bar.update(1)
-                    filename = f"{vid['id']}.mp4" if isinstance(vid, dict) else f"{vid.getId()}.mp4"
-                    file_path = os.path.join(file_destination, filename)
-                    if video_counter == 0:
-                        log.info(f"All requested {key} video downloaded!")
-                        break
-                    elif os.path.exists(file_path):
-                        log.info(f"Video file '{filename }' has already been downloaded")
-                        video_counter -= 1
+                    if not qualifies(vid, global_args):
                         continue
+                    file_path = os.path.join(file_destination, f"{vid['id']}.mp4")
+                    source = f"{key}:{vid['id']}"
+                    video_counter -= 1
+                    if os.path.exists(file_path):
+                        log.info(f"Video file '{vid['id']}.mp4' has already been downloaded")
+                    elif store and store.link_source(source, file_path):
+                        log.info(f"Video file '{vid['id']}.mp4' linked from the footage store")
                     else:
-                        w = vid['width'] if key != 'pixabay' else next(iter(vid._raw_data['videos'].values()))['width']
-                        h = vid['height'] if key != 'pixabay' else next(iter(vid._raw_data['videos'].values()))['height']
-                        if global_args['ratio_strict'] and w/h == global_args['ratio'] or global_args['keep_all']:
-                            log.info(f"Downloading video file: {filename}")
-                            download_video(vid, key, file_path, global_args)
-                            video_counter -= 1
-
-
-def get_video_list(query, key, args, global_args):
-    videos = []
-    if key == 'pixabay':
-        videos = args['px'].queryVideo(query=query, lang=args['lang'], orientation=args['orientation'],
-                                       minWidth=global_args['minWidth'], minHeight=global_args['minHeight'],
-                                       colors=args['colors'], perPage=global_args['per_page'])
-    elif key == 'pexels':
-        videos = args['px'].search_videos(query=query, locale=args['lang'], orientation=args['orientation'],
-                                          size=global_args['size'],
-                                          color=args['colors'], page=1, per_page=global_args['per_page'])['videos']
-    return videos
-
-
-def download_video(vid, key, file_path, global_args):
-    if key == 'pixabay' and vid.getVideoLarge():
-        vid.download(file_path, global_args['size'])
-    elif key == 'pixabay' and vid.getVideoMedium():
-        vid.download(file_path, 'medium')
-    elif key == 'pexels':
-        for elem in vid['video_files']:
-            if elem['height'] == vid['height']:
-                download_from_url(elem['link'], file_path)
-                break
-
-
-def download_from_url(url, filename):
-    response = requests.get(url)
-    with open(filename, "wb") as f:
-        f.write(response.content)
+                        downloads.append((vid['url'], file_path, source, vid.get('size')))
+                    if video_counter == 0:  # before the next page is fetched
+                        break
+                if video_counter == 0:
+                    log.info(f"All requested {key} videos for query '{query}' found!")
+    return downloads
+
+
+def qualifies(vid: dict, global_args: dict):
+    """
+    True if a video (from get_video_list) has the requested ratio and minimum size and can be downloaded
+    """
+
+    w, h = vid['width'], vid['height']
+    ratio_ok = global_args['ratio_strict'] and w/h == global_args['ratio'] or global_args['keep_all']
+    return bool(vid['url']) and ratio_ok and w >= global_args['minWidth'] and h >= global_args['minHeight']
+
+
+class PixabayProvider:
+    """
+    Pixabay video search, args being the 'pixabay' download arguments (with the API client as 'px')
+    """
+
+    def __init__(self, args: dict):
+        self.args = args
+
+    def search(self, query: str, page: int, global_args: dict):
+        response = session().get(self.args['px'].host + 'videos/', timeout=60, params={
+            'key': self.args['px'].apiKey, 'q': query, 'lang': self.args['lang'],
+            'orientation': self.args['orientation'], 'colors': self.args['colors'],
+            'min_width': global_args['minWidth'], 'min_height': global_args['minHeight'],
+            'per_page': global_args['per_page'], 'page': page})
+        response.raise_for_status()
+        data = response.json()
+
+        videos = []
+        for hit in data['hits']:
+            first = next(iter(hit['videos'].values()))
+            video = hit['videos'][global_args['size']] if hit['videos']['large']['url'] else hit['videos']['medium']
+            videos.append({'id': hit['id'], 'width': first['width'], 'height': first['height'], 'url': video['url'],
+                           'size': video.get('size') or None})
+        return videos, page * global_args['per_page'] < data['totalHits']
+
+
+class PexelsProvider:
+    """
+    Pexels video search, args being the 'pexels' download arguments (with the API client as 'px')
+    """
+
+    def __init__(self, args: dict):
+        self.args = args
+
+    def search(self, query: str, page: int, global_args: dict):
+        data = self.args['px'].search_videos(query=query, locale=self.args['lang'], orientation=self.args['orientation'],
+                                             size=global_args['size'], color=self.args['colors'],
+                                             page=page, per_page=global_args['per_page'])
+        videos = []
+        for vid in data['videos']:
+            file = next((elem for elem in vid['video_files'] if elem['height'] == vid['height']), {})
+            videos.append({'id': vid['id'], 'width': vid['width'], 'height': vid['height'], 'url': file.get('link'),
+                           'size': file.get('size')})
+        return videos, 'next_page' in data
+
+
+PROVIDERS = {'pixabay': PixabayProvider, 'pexels': PexelsProvider}
+
+
+def get_video_list(query, key, args, global_args, page: int = 1):
+    """
+    Returns one page of search results ([{'id', 'width', 'height', 'url', 'size'}, ...], more pages: bool) of a
+    provider, size being the bytes of the file at url if the provider reports it
+
+    args['provider'], if set, replaces the provider of PROVIDERS[key] (any object with the same search method)
+    """
+
+    provider = args['provider'] if args.get('provider') else PROVIDERS[key](args)
+    return provider.search(query, page, global_args)
+
+
+def search_videos(query, key, args, global_args, cache):
+    """
+    Yields the search results of a provider page after page, a page being fetched only when the previous one is used up
+    """
+
+    filters = {name: value for name, value in args.items() if name not in ('px', 'provider', 'use_api')}
+    filters.update({name: global_args[name] for name in ('size', 'minWidth', 'minHeight', 'per_page')})
+    page, more = 1, True
+    while more:
+        videos, more = cache.get({'provider': key, 'query': query, 'filters': filters, 'page': page},
+                                 lambda: get_video_list(query, key, args, global_args, page))
+        yield from videos
+        page += 1
+
+
+def default_search_cache_dir(output_dir: str):
+    """
+    returns project_folder/cache/search for videos downloaded to project_folder/videos/
+    """
+
+    return project_cache_path(output_dir, 'search')
+
+
+class SearchCache:
+    """
+    Search results pages saved as .json, keyed by provider, query, filters and page, and kept for ttl seconds
+    """
+
+    def __init__(self, cache_dir: str, ttl: float = SEARCH_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def get(self, key: dict, fetch):
+        """
+        Returns the cached result of key if fresh, otherwise the result of fetch(), cached
+        """
+
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        path = os.path.join(self.cache_dir, f"{digest}.json")
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < self.ttl:
+            with open(path, "r") as f:
+                return json.load(f)
+
+        result = fetch()
+        save_json(path, result)
+        return result
+
+
+def session():
+    """
+    Returns the HTTP session (requests.Session) of the current thread, its connections are kept alive between files
+    """
+
+    if not hasattr(_sessions, 'session'):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+def content_range(response):
+    """
+    Returns the first byte (int) and the total size (int) of the file from the Content-Range header of a 206 or 416
+    response (ex: "bytes 100-199/200", "bytes */200"), None for those it doesn't give
+    """
+
+    unit_range, _, total = response.headers.get('Content-Range', '').partition('/')
+    start = unit_range.split(' ')[-1].split('-')[0]
+    return int(start) if start.isdigit() else None, int(total) if total.isdigit() else None
+
+
+def download_from_url(url, filename, progress=None, size=None):
+    """
+    Streams url into filename.part, resuming it with an HTTP Range request if a previous download was interrupted, then
+    renames it filename once it holds the whole file: as many bytes as the server reports (Content-Range or
+    Content-Length), or as the provider reported (size) when the server doesn't. A .part file that can't be resumed
+    from its end or doesn't have the size of the file is downloaded again from the start
+
+    progress: called with the number of bytes of each chunk written, and with the number of bytes of the file (total=)
+    size: bytes of the file reported by the provider, None if unknown
+    """
+
+    os.makedirs(os.path.dirname(filename) or os.curdir, exist_ok=True)
+    part_path = f"{filename}.part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': f"bytes={offset}-"} if offset else {}
+    with session().get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code == 416:  # nothing left after offset: the part file is complete if it has the file size
+            total = content_range(response)[1] or size
+            if total != offset:  # a stale or overgrown part file, or one whose size can't be checked
+                response.close()
+                os.remove(part_path)
+                return download_from_url(url, filename, progress, size)
+            chunks = ()
+        else:
+            response.raise_for_status()
+            if response.status_code == 206:
+                start, total = content_range(response)
+            else:  # range ignored by the server, starting over
+                start, total, offset = 0, int(response.headers.get('Content-Length', 0)) or None, 0
+            if start != offset:  # the server resumes elsewhere than the end of the part file
+                response.close()
+                os.remove(part_path)
+                return download_from_url(url, filename, progress, size)
+            total, chunks = total or size, response.iter_content(CHUNK_SIZE)
+        if progress:
+            progress(offset, total=total or offset)
+
+        with open(part_path, "ab" if offset else "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                if progress:
+                    progress(len(chunk))
+
+    written = os.path.getsize(part_path)
+    if total and written < total:
+        raise IOError(f"download of {url} interrupted, {filename}.part will be resumed")
+    if total and written > total:
+        os.remove(part_path)
+        raise IOError(f"download of {url} is larger than the file ({written} > {total} bytes), it will start over")
+    os.replace(part_path, filename)  # atomic, an interrupted download never leaves a truncated .mp4
+
+
+def download_all(downloads: list, workers: int = DOWNLOAD_WORKERS):
+    """
+    Downloads [(url, file_path, size), ...] with workers threads, showing the progress of all of them in bytes, size
+    being the bytes of the file reported by the provider (None if unknown, see download_from_url). A failed file doesn't
+    stop the others, returns the failures {file_path: error}
+    """
+
+    lock = threading.Lock()
+    progress_bar = tqdm(total=0, unit='B', unit_scale=True, position=0, leave=True,
+                        desc=f"Downloading {len(downloads)} videos")
+
+    def progress(size, total=None):
+        with lock:
+            if total is not None:
+                progress_bar.total += total
+                progress_bar.refresh()
+            progress_bar.update(size)
+
+    def download(url_path_and_size):
+        url, file_path, size = url_path_and_size
+        log.info(f"Downloading video file: {os.path.basename(file_path)}")
+        try:
+            download_from_url(url, file_path, progress, size)
+        except (requests.RequestException, IOError) as error:
+            log.warning(f"Download of {os.path.basename(file_path)} failed: {error}")
+            return file_path, error
+        return file_path, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        failures = {file_path: error for file_path, error in executor.map(download, downloads) if error}
+    progress_bar.close()
+    return failures
 
 
 if __name__ == "__main__":
-    video_downloader(queries, output_dir, args)
+    video_downloader(queries, output_dir, default_args())